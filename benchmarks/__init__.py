@@ -0,0 +1,7 @@
+"""
+性能基准测试
+
+运行方式（在项目根目录下）:
+    python -m benchmarks.bench_parser
+    python -m benchmarks.bench_suite --sizes 1000,100000
+"""
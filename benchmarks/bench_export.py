@@ -0,0 +1,57 @@
+"""
+导出基准测试：在合成数据上计时 export_users_to_excel 和各格式的流式导出
+
+运行方式:
+    python -m benchmarks.bench_export [--users 100000]
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import db_config
+from export_to_excel import build_links_summary, export_users_to_excel
+from stream_export import EXPORT_FORMATS, export_users_streaming
+from insert_users_array_to_db import insert_users_array
+from benchmarks.synthetic import make_users
+
+def main():
+    parser = argparse.ArgumentParser(description='导出基准测试')
+    parser.add_argument('--users', type=int, default=100000, help='合成用户数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_config.DB_PATH = Path(tmp_dir) / 'users.db'
+
+        started = time.perf_counter()
+        insert_users_array(make_users(args.users))
+        print(f"写入 {args.users} 个合成用户: {time.perf_counter() - started:.2f} 秒")
+
+        conn = db_config.get_db_connection()
+        users_df = pd.read_sql_query("SELECT * FROM users ORDER BY user_id DESC", conn)
+        links_df = pd.read_sql_query("SELECT * FROM user_links ORDER BY id", conn)
+
+        started = time.perf_counter()
+        build_links_summary(users_df, links_df)
+        print(f"链接汇总: {time.perf_counter() - started:.2f} 秒")
+
+        started = time.perf_counter()
+        output_file = export_users_to_excel(Path(tmp_dir) / 'exports')
+        print(f"导出 Excel: {time.perf_counter() - started:.2f} 秒 ({output_file.stat().st_size / 1024:.0f} KB)")
+
+        for fmt in EXPORT_FORMATS:
+            started = time.perf_counter()
+            try:
+                export_users_streaming(fmt, Path(tmp_dir) / 'stream')
+            except ImportError as e:
+                print(f"跳过 {fmt}: {e}")
+                continue
+            print(f"流式导出 {fmt}: {time.perf_counter() - started:.2f} 秒")
+
+        db_config.close_db_connection()
+
+if __name__ == "__main__":
+    main()
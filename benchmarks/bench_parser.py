@@ -0,0 +1,55 @@
+"""
+解析引擎基准测试：在 body.txt 上对比 bs4 与 lxml 快速解析引擎
+
+运行方式:
+    python -m benchmarks.bench_parser [--repeat 200] [--min-speedup 5]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from get_users_array_from_page import PARSER_ENGINES
+
+SAMPLE_PATH = Path(__file__).parent.parent / 'downloaded_page' / 'body.txt'
+
+def time_engine(engine, html_content, repeat):
+    """
+    计时某个解析引擎
+
+    返回:
+        float: 每次解析的平均耗时（毫秒）
+    """
+    parse = PARSER_ENGINES[engine]
+    parse(html_content)  # 预热
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parse(html_content)
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='解析引擎基准测试')
+    parser.add_argument('--repeat', type=int, default=200, help='每个引擎重复解析的次数')
+    parser.add_argument('--min-speedup', type=float, default=5.0, help='lxml 引擎相对 bs4 的最低加速比')
+    args = parser.parse_args()
+
+    with open(SAMPLE_PATH, 'r', encoding='utf-8') as f:
+        html_content = f.read()
+
+    # 先确认两个引擎输出完全一致
+    if PARSER_ENGINES['bs4'](html_content) != PARSER_ENGINES['lxml'](html_content):
+        print("两个解析引擎的输出不一致")
+        return 1
+
+    results = {engine: time_engine(engine, html_content, args.repeat) for engine in ('bs4', 'lxml')}
+    speedup = results['bs4'] / results['lxml']
+
+    for engine, ms in results.items():
+        print(f"{engine}: {ms:.3f} ms/页")
+    print(f"加速比: {speedup:.1f}x (要求 >= {args.min_speedup}x)")
+
+    return 0 if speedup >= args.min_speedup else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
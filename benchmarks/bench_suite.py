@@ -0,0 +1,300 @@
+"""
+基准测试套件：在 1千 / 10万 / 100万 合成用户上计时解析、入库、查询和导出，结果写成 JSON
+
+运行方式:
+    python -m benchmarks.bench_suite [--sizes 1000,100000,1000000] [--only extract,insert,query,export]
+    python -m benchmarks.bench_suite --sizes 1000 --compare benchmarks/results/bench_20250101_120000.json
+
+每项结果以 (name, users) 为键；--compare 与之前的结果文件对比，
+任一项比基线慢超过 --tolerance（默认 20%）时以退出码 1 结束，可用于发现性能回退。
+每完成一项就写入一次结果文件；某一项出错时记录到 errors 并继续，最后以退出码 1 结束。
+"""
+
+import argparse
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import db_config
+from get_users_array_from_page import extract_user_data
+from insert_users_array_to_db import insert_users_array
+from export_to_excel import export_users_to_excel
+from stream_export import export_users_streaming, XLSX_MAX_ROWS
+import query_db
+from benchmarks.synthetic import iter_pages, iter_user_chunks
+
+# 结果文件默认目录
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+# 默认的用户规模
+DEFAULT_SIZES = (1000, 100000, 1000000)
+
+# 可选的基准项
+BENCHMARKS = ('extract', 'insert', 'query', 'export')
+
+# 入库时每次调用 insert_users_array 的用户数（与流水线按页写入类似，但块更大以减少生成开销）
+INSERT_CHUNK = 10000
+
+# 判定为回退的默认相对变慢比例
+DEFAULT_TOLERANCE = 0.2
+
+def _result(name, users, seconds, repeat=1, items=None):
+    """
+    构造一条结果记录
+
+    参数:
+        name: 基准项名称
+        users: 数据规模（用户数）
+        seconds: 耗时（重复多次时为中位数）
+        repeat: 重复次数
+        items: 可选，本项处理的条目数，用于计算每条耗时
+    """
+    record = {'name': name, 'users': users, 'seconds': round(seconds, 6), 'repeat': repeat}
+    if items:
+        record['per_item_us'] = round(seconds / items * 1e6, 3)
+    return record
+
+def _median_time(func, repeat):
+    """重复执行 func，返回耗时中位数（秒）"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+def bench_extract(size, page_size=10, engine=None):
+    """
+    逐页生成与 body.txt 结构相同的页面并计时 extract_user_data（页面生成不计入耗时）
+    """
+    elapsed = 0.0
+    parsed = 0
+    for _, users, html_content in iter_pages(size, page_size):
+        started = time.perf_counter()
+        users_data = extract_user_data(html_content, engine)
+        elapsed += time.perf_counter() - started
+        if len(users_data) != len(users):
+            raise RuntimeError(f"解析结果数量不一致: {len(users_data)} != {len(users)}")
+        parsed += len(users_data)
+    return [_result(f"extract_user_data[{engine or 'default'}]", size, elapsed, items=parsed)]
+
+def bench_insert(size, timed=True):
+    """
+    分块写入 size 个合成用户，再原样写入一遍（内容未变化，走跳过路径）
+
+    参数:
+        timed: False 时只写入数据、不返回结果（供查询和导出准备数据）
+    """
+    results = []
+    for name in ('insert_users_array[new]', 'insert_users_array[unchanged]'):
+        elapsed = 0.0
+        for users_data in iter_user_chunks(size, INSERT_CHUNK):
+            started = time.perf_counter()
+            insert_users_array(users_data)
+            elapsed += time.perf_counter() - started
+        results.append(_result(name, size, elapsed, items=size))
+        if not timed:
+            return []
+    return results
+
+def query_cases(size):
+    """
+    查询基准项：(名称, 无参数函数)
+
+    直接调用被 cached_query 包装的原函数，计时的是数据库查询本身而不是缓存命中
+    """
+    middle = max(1, size // 2)
+    return [
+        ('query_users[limit=100]', lambda: query_db.query_users.__wrapped__(limit=100)),
+        ('query_users[keyset]', lambda: query_db.query_users.__wrapped__(limit=100, after_user_id=middle)),
+        ('count_users', query_db.count_users.__wrapped__),
+        ('get_country_stats', query_db.get_country_stats.__wrapped__),
+        ('get_revenue_stats', query_db.get_revenue_stats.__wrapped__),
+        ('get_user_history', lambda: query_db.get_user_history.__wrapped__(middle)),
+        ('search_users[email]', lambda: query_db.search_users.__wrapped__(f"user{middle}", 20)),
+        ('search_users[domain]', lambda: query_db.search_users.__wrapped__('@gmail.com', 20)),
+        ('query_users[cached]', lambda: query_db.query_users(limit=100)),
+    ]
+
+def bench_query(size, repeat=20):
+    """计时 query_db 中的各查询函数，每项重复 repeat 次取中位数"""
+    results = []
+    for name, func in query_cases(size):
+        func()  # 预热
+        results.append(_result(f"query_db.{name}", size, _median_time(func, repeat), repeat))
+    return results
+
+def _path_size(path):
+    """文件或目录（其中全部文件）的字节数"""
+    if path.is_dir():
+        return sum(item.stat().st_size for item in path.iterdir())
+    return path.stat().st_size
+
+def bench_export(size, output_dir):
+    """
+    计时 export_users_to_excel（一次性读入内存后写 xlsx）和流式 CSV 导出
+
+    链接表行数超过 Excel 单表上限时 pandas 无法写出 xlsx，此时跳过 export_users_to_excel，
+    只计时流式 CSV 导出
+    """
+    link_rows = db_config.get_db_connection().execute("SELECT COUNT(*) FROM user_links").fetchone()[0]
+    cases = [('export_users_streaming[csv]', lambda: export_users_streaming('csv', output_dir / 'csv'))]
+    if max(size, link_rows) < XLSX_MAX_ROWS:
+        cases.insert(0, ('export_users_to_excel', lambda: export_users_to_excel(output_dir)))
+    else:
+        print(f"链接数据 {link_rows} 行超过 Excel 单表上限，跳过 export_users_to_excel")
+
+    results = []
+    for name, func in cases:
+        started = time.perf_counter()
+        output = func()
+        record = _result(name, size, time.perf_counter() - started, items=size)
+        record['bytes'] = _path_size(output)
+        results.append(record)
+    return results
+
+def environment():
+    """记录运行环境，便于判断两次结果是否可比"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'commit': commit,
+    }
+
+def save_report(report, output):
+    """把结果写入 JSON 文件（先写临时文件再替换，中途中断也不会留下半个文件）"""
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = output.with_suffix('.tmp')
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    temp_file.replace(output)
+
+def run_suite(sizes=DEFAULT_SIZES, benchmarks=BENCHMARKS, page_size=10, repeat=20, engine=None, output=None):
+    """
+    在每个规模上依次运行选中的基准项，每个规模使用一个新的临时数据库
+
+    某一项出错时记录到 errors 并继续运行其余各项（依赖入库数据的查询和导出在入库失败时跳过）
+
+    参数:
+        output: 可选，结果 JSON 路径；每完成一项就写入一次，运行中途崩溃也能保留已完成的结果
+
+    返回:
+        dict: {'environment': {...}, 'results': [{'name', 'users', 'seconds', 'repeat', ...}, ...],
+               'errors': [{'name', 'users', 'error'}, ...]}
+    """
+    report = {'environment': environment(), 'results': [], 'errors': []}
+    original_db_path = db_config.DB_PATH
+    try:
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_config.DB_PATH = Path(tmp_dir) / 'users.db'
+                query_db.QUERY_CACHE.clear()
+                steps = []
+                if 'extract' in benchmarks:
+                    steps.append(('extract', lambda: bench_extract(size, page_size, engine)))
+                if 'insert' in benchmarks or 'query' in benchmarks or 'export' in benchmarks:
+                    steps.append(('insert', lambda: bench_insert(size, timed='insert' in benchmarks)))
+                if 'query' in benchmarks:
+                    steps.append(('query', lambda: bench_query(size, repeat)))
+                if 'export' in benchmarks:
+                    steps.append(('export', lambda: bench_export(size, Path(tmp_dir) / 'exports')))
+                for name, step in steps:
+                    if name in ('query', 'export') and any(
+                            error['name'] == 'insert' and error['users'] == size for error in report['errors']):
+                        continue
+                    try:
+                        records = step()
+                    except Exception as e:
+                        print(f"{name:<40} {size:>9} 用户  出错: {e}")
+                        report['errors'].append({'name': name, 'users': size, 'error': str(e)})
+                        records = []
+                    for record in records:
+                        print(f"{record['name']:<40} {size:>9} 用户  {record['seconds']:.6f} 秒")
+                        report['results'].append(record)
+                    if output:
+                        save_report(report, output)
+                db_config.close_db_connection()
+    finally:
+        db_config.DB_PATH = original_db_path
+    return report
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """
+    对比两次运行结果
+
+    参数:
+        baseline: 基线结果（run_suite 的返回值或读入的 JSON）
+        current: 本次结果
+        tolerance: 允许的相对变慢比例
+
+    返回:
+        list: 变慢超过 tolerance 的项 [{'name', 'users', 'baseline', 'current', 'change'}, ...]
+    """
+    previous = {(record['name'], record['users']): record['seconds'] for record in baseline['results']}
+    regressions = []
+    for record in current['results']:
+        before = previous.get((record['name'], record['users']))
+        if not before:
+            continue
+        change = record['seconds'] / before - 1
+        if change > tolerance:
+            regressions.append({'name': record['name'], 'users': record['users'], 'baseline': before,
+                                'current': record['seconds'], 'change': round(change, 3)})
+    return regressions
+
+def _parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description='解析、入库、查询、导出基准测试套件')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='逗号分隔的用户规模')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help=f"逗号分隔的基准项: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--page-size', type=int, default=10, help='合成页面每页用户数')
+    parser.add_argument('--repeat', type=int, default=20, help='每个查询重复次数')
+    parser.add_argument('--engine', default=None, help='解析引擎（lxml 或 bs4）')
+    parser.add_argument('--output', default=None, help='结果 JSON 路径，默认为 benchmarks/results/bench_<时间>.json')
+    parser.add_argument('--compare', default=None, help='与之前的结果 JSON 对比')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='允许的相对变慢比例')
+    args = parser.parse_args()
+
+    benchmarks = _parse_list(args.only)
+    unknown = [name for name in benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基准项: {', '.join(unknown)}")
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    report = run_suite(_parse_list(args.sizes, int), benchmarks, args.page_size, args.repeat, args.engine, output)
+    save_report(report, output)
+    print(f"结果已写入: {output}")
+    status = 1 if report['errors'] else 0
+    for error in report['errors']:
+        print(f"出错: {error['name']} @ {error['users']} 用户: {error['error']}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for item in regressions:
+            print(f"回退: {item['name']} @ {item['users']} 用户: {item['baseline']:.6f} -> {item['current']:.6f} 秒 "
+                  f"(+{item['change']:.0%})")
+        if regressions:
+            return 1
+        print(f"没有超过 {args.tolerance:.0%} 的回退")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
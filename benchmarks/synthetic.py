@@ -0,0 +1,181 @@
+"""
+合成测试数据：生成与页面解析结果结构相同的用户数据，以及与 body.txt 结构相同的用户列表页面
+"""
+
+import html
+import random
+import re
+from pathlib import Path
+
+SAMPLE_PATH = Path(__file__).parent.parent / 'downloaded_page' / 'body.txt'
+
+COUNTRIES = ('US', 'CN', 'GB', 'DE', 'FR', 'JP', 'CA', 'AU', 'BR', 'IN')
+EMAIL_DOMAINS = ('gmail.com', '163.com', 'qq.com', 'outlook.com', 'yahoo.com')
+LINK_TYPES = (
+    ('查看订单', 'orders'),
+    ('扫描记录', 'ordersfail'),
+    ('登录记录', 'login/log'),
+    ('操作记录', 'controls/log'),
+    ('充值记录', 'paylog'),
+)
+
+def make_user(user_id, rng=random):
+    """
+    生成一个用户数据字典，字段与 extract_user_data 的输出一致
+
+    参数:
+        user_id: 用户ID
+        rng: 随机数生成器
+    """
+    refund_amount = round(rng.random() * 50, 2) if rng.random() < 0.3 else 0
+    return {
+        'user_id': user_id,
+        'email': f"user{user_id}@{rng.choice(EMAIL_DOMAINS)}",
+        'create_time': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                       f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+        'promotion_count': rng.randint(0, 3),
+        'is_member': rng.choice(('是', '否')),
+        'refund_amount': refund_amount,
+        'last_refund_amount': refund_amount,
+        'last_deductible_amount': 0.0,
+        'credit_balance': float(rng.choice((0, 5, 10, 16.47, 20, 100))),
+        'has_card': rng.choice(('是', '否')),
+        'country': rng.choice(COUNTRIES),
+        'recharge_amount': float(rng.choice((0, 0, 5, 10, 20))),
+        'total_deduction': float(rng.choice((0, 0, 0, 2.5, 10))),
+        'version': rng.choice(('', '1.0.3', '1.1.0')),
+        'terminal_type': rng.choice(('desktop', 'mobile')),
+        'browser_type': rng.choice(('Chrome', 'Edge', 'Safari')),
+        'remark': rng.choice(('暂无', '暂无', '老用户', '退款过多')),
+        'links': [
+            {'link_type': link_type, 'link_url': f"https://api.taskmonkey.ai/api/user/{path}/{user_id}"}
+            for link_type, path in LINK_TYPES
+        ]
+    }
+
+def make_users(count, start_id=1, seed=0):
+    """
+    生成 count 个用户数据字典，user_id 从 start_id 开始连续递增
+
+    参数:
+        count: 用户数
+        start_id: 起始用户ID
+        seed: 随机种子，保证结果可复现
+    """
+    rng = random.Random(seed)
+    return [make_user(user_id, rng) for user_id in range(start_id, start_id + count)]
+
+ROW_TEMPLATE = """<tr>
+                <td>{user_id}</td>
+                <td>{email}</td>
+                <td>{create_time}</td>
+                <td>{promotion_count}</td>
+                <td>{is_member}</td>
+                <td>{refund_amount}</td>
+                <td>{last_refund_amount}</td>
+                <td>{last_deductible_amount}</td>
+                <td>{credit_balance}</td>
+                <td>{has_card}</td>
+                <td>{country}</td>
+                <td>{recharge_amount}</td>
+                <td>{total_deduction}</td>
+                <td>{version}</td>
+                <td>{terminal_type}</td>
+                <td>{browser_type}</td>
+                
+                <td>{links}
+                    <a href="javascript:void(0);" onclick="showInputBox1(&quot;{user_id}&quot;, &quot;{credit_balance}&quot;)">修改积分</a>
+                </td>
+                <td>
+                    <a href="javascript:void(0);" onclick="showInputBox(&quot;{user_id}&quot;, &quot;{remark}&quot;)">{remark}</a>
+                </td>
+              </tr>"""
+
+_page_template = None
+
+def _load_page_template():
+    """从 body.txt 中取出 <tbody> 之前和 </tbody> 之后的部分作为页面模板"""
+    global _page_template
+    if _page_template is None:
+        with open(SAMPLE_PATH, 'r', encoding='utf-8') as f:
+            sample = f.read()
+        head, rest = sample.split('<tbody>', 1)
+        tail = rest.split('</tbody>', 1)[1]
+        _page_template = (head + '<tbody>', '</tbody>' + tail)
+    return _page_template
+
+def _format_amount(value):
+    """按页面格式输出金额：0 显示为 0，其它保留两位小数"""
+    return '0' if not value else f"{value:.2f}"
+
+def render_row(user):
+    """把一个用户数据字典渲染成与 body.txt 相同结构的 <tr>"""
+    values = {key: html.escape(str(value)) for key, value in user.items() if key != 'links'}
+    for key in ('refund_amount', 'last_refund_amount', 'last_deductible_amount',
+                'credit_balance', 'recharge_amount', 'total_deduction'):
+        values[key] = _format_amount(user[key])
+    values['links'] = "\n                    ".join(
+        f'<a href="{html.escape(link["link_url"])}">{html.escape(link["link_type"])}</a>'
+        for link in user['links']
+    )
+    return ROW_TEMPLATE.format(**values)
+
+def render_page(users, total_users=None):
+    """
+    生成与 body.txt 结构相同的用户列表页面
+
+    参数:
+        users: 用户数据字典列表（一页的用户）
+        total_users: 页面上显示的用户总数，默认为 len(users)
+
+    返回:
+        str: 页面HTML
+    """
+    head, tail = _load_page_template()
+    head = re.sub(r'用户总数: \d+', f'用户总数: {total_users if total_users is not None else len(users)}', head)
+    return head + ''.join(render_row(user) for user in users) + tail
+
+def make_site(count, page_size=10, seed=0):
+    """
+    生成一个按 user_id 倒序分页的完整用户列表
+
+    参数:
+        count: 用户总数
+        page_size: 每页用户数
+
+    返回:
+        tuple: (用户数据列表（按 user_id 倒序）, {页码: 页面HTML})
+    """
+    users = sorted(make_users(count, seed=seed), key=lambda user: user['user_id'], reverse=True)
+    pages = {
+        page_num: render_page(users[(page_num - 1) * page_size:page_num * page_size], count)
+        for page_num in range(1, (count + page_size - 1) // page_size + 1)
+    }
+    return users, pages
+
+def iter_user_chunks(count, chunk_size=10000, seed=0):
+    """
+    分块生成 count 个用户（user_id 从 1 开始），内存中只保留当前块，适合百万级数据
+
+    返回:
+        生成器: 每次一个用户数据字典列表
+    """
+    for start_id in range(1, count + 1, chunk_size):
+        yield make_users(min(chunk_size, count + 1 - start_id), start_id=start_id, seed=seed + start_id)
+
+def iter_pages(count, page_size=10, seed=0):
+    """
+    按站点的顺序（user_id 倒序）逐页生成 count 个用户的列表页，内存中只保留当前页
+
+    参数:
+        count: 用户总数
+        page_size: 每页用户数，可以大于站点的 10 个以生成任意大小的页面
+        seed: 随机种子
+
+    返回:
+        生成器: 每次一个 (页码, 该页用户数据列表, 页面HTML)
+    """
+    for page_num, end_id in enumerate(range(count, 0, -page_size), 1):
+        start_id = max(1, end_id - page_size + 1)
+        users = make_users(end_id - start_id + 1, start_id=start_id, seed=seed + page_num)[::-1]
+        yield page_num, users, render_page(users, count)
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from fetch_backend import FetchBackend
+from get_cookie import get_cookie_with_expiry
+
+# cookie 缓存文件
+COOKIE_CACHE_FILE = Path(__file__).parent / 'cookie_cache.json'
+
+# 会话 cookie（没有过期时间）默认的有效秒数
+DEFAULT_TTL = 3600
+
+# 距离过期不足该秒数时提前刷新
+REFRESH_MARGIN = 300
+
+def is_authenticated_page(content):
+    """
+    判断页面是否为登录状态下的用户列表页
+
+    会话失效时站点返回的页面没有用户表格和“用户总数”
+    """
+    return '用户总数' in content
+
+def load_cookies(path=None):
+    """
+    读取缓存的 cookie
+
+    返回:
+        tuple: (cookie 字典, 过期时间戳)；没有缓存或文件损坏时返回 ({}, 0)
+    """
+    path = Path(path or COOKIE_CACHE_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return dict(data['cookies']), float(data['expires_at'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}, 0
+
+def save_cookies(cookies, expires_at, path=None):
+    """
+    保存 cookie 及其过期时间（先写临时文件再替换，文件权限仅限当前用户）
+    """
+    path = Path(path or COOKIE_CACHE_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'cookies': cookies, 'expires_at': expires_at}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+class CookieManager:
+    """
+    带过期时间的 cookie 缓存
+
+    cookie 与过期时间一起保存在磁盘上，跨运行复用；快要过期或页面显示未登录时，
+    调用 bootstrap（访问启用 URL，可能需要启动浏览器）重新获取。
+    同一时刻只有一个协程执行刷新，其它协程等待并复用刷新结果。
+
+    用法:
+        manager = CookieManager(bootstrap=lambda: get_cookie_with_expiry(session))
+        cookies = await manager.get()
+    """
+
+    def __init__(self, bootstrap=get_cookie_with_expiry, path=None, ttl=DEFAULT_TTL, margin=REFRESH_MARGIN,
+                 clock=time.time):
+        """
+        参数:
+            bootstrap: 无参数的异步函数，返回 (cookie 字典, 过期时间戳或 None)
+            path: 缓存文件路径，默认为 COOKIE_CACHE_FILE
+            ttl: 会话 cookie 的有效秒数
+            margin: 提前刷新的秒数
+            clock: 返回当前时间戳的函数
+        """
+        self.bootstrap = bootstrap
+        self.path = Path(path or COOKIE_CACHE_FILE)
+        self.ttl = ttl
+        self.margin = margin
+        self.clock = clock
+        self.cookies, self.expires_at = load_cookies(self.path)
+        # 每刷新一次加 1，用于判断等待锁期间是否已被其它协程刷新
+        self.generation = 0
+        self.refresh_count = 0
+        self._lock = None
+
+    def needs_refresh(self):
+        """没有 cookie 或即将过期时返回 True"""
+        return not self.cookies or self.clock() >= self.expires_at - self.margin
+
+    async def get(self):
+        """
+        返回可用的 cookie，缓存有效时不访问站点
+
+        返回:
+            dict: cookie 字典，获取失败时为空字典
+        """
+        if self.needs_refresh():
+            await self.refresh()
+        return self.cookies
+
+    async def refresh(self, generation=None):
+        """
+        重新获取 cookie 并写入缓存
+
+        参数:
+            generation: 可选，调用方看到的 generation；如果等待期间已被其它协程刷新，直接返回新 cookie
+
+        返回:
+            dict: cookie 字典，获取失败时为空字典
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if generation is not None and generation != self.generation:
+                return self.cookies
+            cookies, expires_at = await self.bootstrap()
+            self.refresh_count += 1
+            self.generation += 1
+            if not cookies:
+                self.cookies, self.expires_at = {}, 0
+                return self.cookies
+            self.cookies = cookies
+            self.expires_at = expires_at or self.clock() + self.ttl
+            save_cookies(self.cookies, self.expires_at, self.path)
+            return self.cookies
+
+class AuthenticatedSession(FetchBackend):
+    """
+    自动维护登录状态的抓取会话
+
+    包装 CrawlSession 或其它 FetchBackend：cookie 即将过期时在请求前主动刷新；
+    页面显示未登录时刷新 cookie 并重试一次，仍未登录则抛出异常（fetch 返回空字符串，
+    由流水线记为失败页）。会话本身的启动和关闭由调用方负责。
+    """
+
+    def __init__(self, session, manager):
+        """
+        参数:
+            session: 被包装的抓取会话
+            manager: CookieManager
+        """
+        self.session = session
+        self.manager = manager
+
+    async def set_cookies(self, cookies):
+        await self.session.set_cookies(cookies)
+
+    async def _refresh(self, generation=None):
+        cookies = await self.manager.refresh(generation)
+        if cookies:
+            await self.session.set_cookies(cookies)
+
+    async def get(self, url):
+        """
+        获取URL内容，必要时刷新 cookie 后重试
+
+        返回:
+            str: 页面HTML内容
+        """
+        if self.manager.needs_refresh():
+            await self._refresh(self.manager.generation)
+
+        generation = self.manager.generation
+        content = await self.session.get(url)
+        if is_authenticated_page(content):
+            return content
+
+        print(f"页面显示未登录，刷新 cookie 后重试: {url}")
+        await self._refresh(generation)
+        content = await self.session.get(url)
+        if not is_authenticated_page(content):
+            raise RuntimeError(f"刷新 cookie 后仍未登录: {url}")
+        return content
@@ -0,0 +1,175 @@
+import asyncio
+import os
+from playwright.async_api import async_playwright
+
+# 站点相关常量
+COOKIE_DOMAIN = 'api.taskmonkey.ai'
+ENABLE_URL = 'https://api.taskmonkey.ai/api/index/enable/update?secret_key=tastAdmin77123'
+USER_LIST_URL = 'https://api.taskmonkey.ai/api/user/index?orderBy=id'
+
+def build_page_url(page_num):
+    """构建用户列表第 page_num 页的URL"""
+    return f"{USER_LIST_URL}&page={page_num}"
+
+def save_content(save_to_file, content):
+    """保存页面内容到文件"""
+    os.makedirs(os.path.dirname(save_to_file), exist_ok=True)
+    with open(save_to_file, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+class FetchBackend:
+    """
+    页面抓取后端基类
+
+    子类只需实现 start / close / set_cookies / get，fetch 负责保存文件和错误处理，
+    浏览器（CrawlSession）和 HTTP（fetch_backend.HttpBackend）后端共用同一个 fetch，行为保持一致。
+    """
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        """初始化后端资源"""
+
+    async def close(self):
+        """释放后端资源"""
+
+    async def set_cookies(self, cookies):
+        """更新后端使用的 cookie"""
+        raise NotImplementedError
+
+    async def get(self, url):
+        """
+        获取URL内容，出错时抛出异常
+
+        返回:
+            str: 页面HTML内容
+        """
+        raise NotImplementedError
+
+    async def fetch(self, url, save_to_file=None):
+        """
+        获取指定URL的页面内容
+
+        参数:
+            url: 要获取内容的URL
+            save_to_file: 可选，保存内容到文件路径
+
+        返回:
+            str: 页面HTML内容，出错时返回空字符串
+        """
+        try:
+            content = await self.get(url)
+
+            # 如果提供了保存路径，则保存内容到文件
+            if save_to_file:
+                save_content(save_to_file, content)
+
+            return content
+        except Exception as e:
+            print(f"获取页面内容时出错: {e}")
+            return ""
+
+class CrawlSession(FetchBackend):
+    """
+    可复用的浏览器爬取会话
+
+    整个爬取过程只启动一次 Chromium，只创建一个 context（cookie 只安装一次），
+    页面对象放在池中循环使用，避免每个URL都冷启动浏览器。
+    实现 FetchBackend.get，fetch（保存文件和错误处理）继承自 FetchBackend。
+
+    用法:
+        async with CrawlSession(cookies) as session:
+            content = await session.fetch(url)
+    """
+
+    def __init__(self, cookies=None, headless=True, max_pages=1):
+        """
+        参数:
+            cookies: 可选，cookie 字典，启动时安装到 context
+            headless: 是否以无头模式启动浏览器
+            max_pages: 页面池大小，即可同时打开的页面数
+        """
+        self.cookies = cookies or {}
+        self.headless = headless
+        self.max_pages = max(1, max_pages)
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        self._idle_pages = None
+        self._pages = []
+
+    async def start(self):
+        """启动浏览器和 context"""
+        if self._context is not None:
+            return
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._context = await self._browser.new_context()
+        self._idle_pages = asyncio.Queue()
+        if self.cookies:
+            await self.set_cookies(self.cookies)
+
+    async def close(self):
+        """关闭浏览器并释放资源"""
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+        finally:
+            if self._playwright is not None:
+                await self._playwright.stop()
+            self._playwright = None
+            self._browser = None
+            self._context = None
+            self._idle_pages = None
+            self._pages = []
+
+    async def set_cookies(self, cookies):
+        """将 cookie 字典安装到 context 中"""
+        self.cookies = dict(cookies)
+        await self._context.add_cookies([{
+            'name': name,
+            'value': value,
+            'domain': COOKIE_DOMAIN,
+            'path': '/'
+        } for name, value in cookies.items()])
+
+    async def get_cookies(self):
+        """
+        返回当前 context 中的 cookie
+
+        返回:
+            list: playwright 格式的 cookie 列表
+        """
+        return await self._context.cookies()
+
+    async def _acquire_page(self):
+        """从页面池中取出一个页面，池为空且未达上限时新建"""
+        if self._idle_pages.empty() and len(self._pages) < self.max_pages:
+            page = await self._context.new_page()
+            self._pages.append(page)
+            return page
+        return await self._idle_pages.get()
+
+    def _release_page(self, page):
+        """将页面放回页面池"""
+        self._idle_pages.put_nowait(page)
+
+    async def get(self, url):
+        """
+        在池中的页面上打开URL并等待加载完成，出错时抛出异常
+
+        返回:
+            str: 页面HTML内容
+        """
+        page = await self._acquire_page()
+        try:
+            await page.goto(url)
+            await page.wait_for_load_state('networkidle')
+            return await page.content()
+        finally:
+            self._release_page(page)
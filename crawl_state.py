@@ -0,0 +1,246 @@
+import math
+import hashlib
+from datetime import datetime
+from db_config import get_db_connection
+
+# 每页显示的用户数
+PAGE_SIZE = 10
+
+# 增量采集默认额外抓取的最近页数（用于更新余额等变化）
+RECENT_PAGES = 3
+
+def get_state(conn, key, default=None):
+    """读取 crawl_state 中的一个值"""
+    row = conn.execute("SELECT value FROM crawl_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def set_state(conn, key, value):
+    """写入 crawl_state 中的一个值（不提交事务）"""
+    conn.execute("""
+    INSERT INTO crawl_state (key, value, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """, (key, str(value), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+def get_watermarks(conn=None):
+    """
+    读取上次采集记录的水位
+    
+    返回:
+        dict: {'max_user_id': 已采集的最大用户ID, 'total_users': 上次的用户总数}，
+              从未记录过时值为 None
+    """
+    conn = conn or get_db_connection()
+    max_user_id = get_state(conn, 'max_user_id')
+    total_users = get_state(conn, 'total_users')
+    return {
+        'max_user_id': int(max_user_id) if max_user_id is not None else None,
+        'total_users': int(total_users) if total_users is not None else None,
+    }
+
+def update_watermarks(max_user_id, total_users, conn=None):
+    """
+    记录本次采集后的水位，max_user_id 只会增大
+    
+    参数:
+        max_user_id: 本次采集到的最大用户ID
+        total_users: 本次页面显示的用户总数
+        conn: 可选，数据库连接
+    """
+    conn = conn or get_db_connection()
+    previous = get_watermarks(conn)['max_user_id']
+    if max_user_id is not None and (previous is None or max_user_id > previous):
+        set_state(conn, 'max_user_id', max_user_id)
+    set_state(conn, 'total_users', total_users)
+    conn.commit()
+
+def stored_max_user_id(conn=None):
+    """数据库中已有的最大用户ID，没有用户时返回 None"""
+    conn = conn or get_db_connection()
+    return conn.execute("SELECT MAX(user_id) FROM users").fetchone()[0]
+
+def plan_incremental_pages(page_total, total_users, watermarks, recent_pages=RECENT_PAGES, page_size=PAGE_SIZE):
+    """
+    计算增量采集需要抓取的页数
+    
+    列表按 user_id 倒序排列，新用户总是出现在最前面的页。
+    需要抓取的页数 = 新增用户占用的页数 + 最近 recent_pages 页（刷新余额等变化）。
+    
+    参数:
+        page_total: 当前总页数
+        total_users: 当前用户总数
+        watermarks: get_watermarks 的返回值
+        recent_pages: 额外抓取的最近页数
+        page_size: 每页用户数
+    
+    返回:
+        int: 从第 1 页起需要抓取的页数；没有水位记录时为 page_total（全量采集）
+    """
+    if watermarks['max_user_id'] is None or watermarks['total_users'] is None:
+        return page_total
+    new_users = max(0, total_users - watermarks['total_users'])
+    pages = math.ceil(new_users / page_size) + max(0, recent_pages)
+    return max(1, min(page_total, pages))
+
+def begin_run(label=None, conn=None):
+    """
+    登记一次新的采集，user_history 中的变化记录都归属于某次采集
+    
+    参数:
+        label: 可选，备注（例如页面存档中的采集ID）
+        conn: 可选，数据库连接
+    
+    返回:
+        int: run_id
+    """
+    conn = conn or get_db_connection()
+    cursor = conn.execute("INSERT INTO crawl_runs (started_at, label) VALUES (?, ?)",
+                          (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), label))
+    conn.commit()
+    return cursor.lastrowid
+
+def page_digest(html_content):
+    """
+    计算页面中用户表格部分的摘要
+    
+    页面头部的用户总数、最后创建时间等每次都会变化，只对 <tbody> 部分计算摘要；
+    找不到表格时对整页计算。
+    
+    返回:
+        str: 32 位十六进制摘要
+    """
+    start = html_content.find('<tbody')
+    end = html_content.find('</tbody>', start)
+    body = html_content[start:end] if start >= 0 and end >= 0 else html_content
+    return hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest()
+
+def load_page_digests(conn=None):
+    """
+    读取上次成功入库的各页摘要
+    
+    返回:
+        dict: {page_num: digest}
+    """
+    conn = conn or get_db_connection()
+    return {row[0]: row[1] for row in conn.execute("SELECT page_num, digest FROM page_digests")}
+
+def save_page_digest(conn, page_num, digest):
+    """记录某页成功入库时的摘要（不提交事务）"""
+    conn.execute("""
+    INSERT INTO page_digests (page_num, digest, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(page_num) DO UPDATE SET digest = excluded.digest, updated_at = excluded.updated_at
+    """, (page_num, digest, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+# 采集任务中页面的状态
+JOB_PENDING = 'pending'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+class CrawlJob:
+    """
+    持久化的采集任务
+    
+    crawl_jobs 表记录本次任务每页的状态、尝试次数和最后一次错误，
+    crawl_state 中的 job_status 记录任务是否完成。程序中断后再次运行时，
+    未完成任务中尚未成功的页会被继续抓取，而不是从第 1 页重新开始。
+    
+    每次调用都使用当前线程的持久连接，可以在流水线的写入线程中调用。
+    
+    用法:
+        job = CrawlJob()
+        page_nums = job.resume() or job.start(range(1, page_total + 1))
+        ...
+        job.mark_done(page_num) / job.mark_failed(page_num, error)
+        if not job.missing_pages():
+            job.finish()
+    """
+    
+    def _conn(self):
+        return get_db_connection()
+    
+    def is_running(self):
+        """是否有未完成的任务"""
+        return get_state(self._conn(), 'job_status') == 'running'
+    
+    def resume(self):
+        """
+        返回未完成任务中尚未成功的页码
+        
+        返回:
+            list: 页码列表；没有未完成的任务时为空列表
+        """
+        if not self.is_running():
+            return []
+        return self.missing_pages()
+    
+    def start(self, page_nums):
+        """
+        开始新任务，清空上一次任务的记录
+        
+        返回:
+            list: 本次任务的页码
+        """
+        page_nums = list(page_nums)
+        conn = self._conn()
+        conn.execute("DELETE FROM crawl_jobs")
+        set_state(conn, 'job_status', 'running')
+        conn.commit()
+        self.add_pages(page_nums)
+        return page_nums
+    
+    def add_pages(self, page_nums):
+        """向当前任务追加待抓取的页（已存在的页保持原状态）"""
+        conn = self._conn()
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany("""
+        INSERT INTO crawl_jobs (page_num, status, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(page_num) DO NOTHING
+        """, [(page_num, JOB_PENDING, now) for page_num in page_nums])
+        conn.commit()
+    
+    def _mark(self, page_num, status, error=None):
+        conn = self._conn()
+        conn.execute("""
+        INSERT INTO crawl_jobs (page_num, status, attempts, last_error, updated_at) VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(page_num) DO UPDATE SET
+            status = excluded.status,
+            attempts = attempts + 1,
+            last_error = excluded.last_error,
+            updated_at = excluded.updated_at
+        """, (page_num, status, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        conn.commit()
+    
+    def mark_done(self, page_num):
+        """记录某页已成功入库（或内容未变化）"""
+        self._mark(page_num, JOB_DONE)
+    
+    def mark_failed(self, page_num, error):
+        """记录某页抓取、解析或入库失败"""
+        self._mark(page_num, JOB_FAILED, str(error))
+    
+    def missing_pages(self):
+        """
+        返回当前任务中尚未成功的页码（按页码排序）
+        """
+        rows = self._conn().execute(
+            "SELECT page_num FROM crawl_jobs WHERE status != ? ORDER BY page_num", (JOB_DONE,)
+        )
+        return [row[0] for row in rows]
+    
+    def failures(self):
+        """
+        返回失败页的详细信息
+        
+        返回:
+            dict: {page_num: (尝试次数, 最后错误)}
+        """
+        rows = self._conn().execute(
+            "SELECT page_num, attempts, last_error FROM crawl_jobs WHERE status = ? ORDER BY page_num",
+            (JOB_FAILED,)
+        )
+        return {row[0]: (row[1], row[2]) for row in rows}
+    
+    def finish(self):
+        """所有页都成功后结束任务"""
+        conn = self._conn()
+        set_state(conn, 'job_status', 'done')
+        conn.commit()
@@ -1,19 +1,99 @@
 import os
 import sqlite3
+import logging
+import threading
 from pathlib import Path
 
+logger = logging.getLogger('taskmonkey.db')
+
 # 数据库路径
 DB_PATH = Path(__file__).parent / 'users.db'
 
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
+# 打开连接时设置的性能相关 PRAGMA，可通过 configure_pragmas 修改
+# WAL 模式下读（查询/导出）和写（爬虫入库）可以同时进行
+DB_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,       # 负数表示 KB，即 64MB
+    'mmap_size': 268435456,     # 256MB
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,       # 毫秒
+}
+
+# 单条 SQL 中 IN (...) 参数的最大个数（低于 SQLite 默认上限 999）
+MAX_SQL_VARIABLES = 900
+
+# 每个线程持有一个持久连接
+_local = threading.local()
+
+# 本进程中已完成表结构初始化的数据库路径
+_initialized_paths = set()
+_init_lock = threading.RLock()
+
+def chunked(items, size=MAX_SQL_VARIABLES):
+    """按 size 切分列表，用于拆分过长的 IN (...) 参数"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def connect(db_path=None):
+    """
+    打开一个新的数据库连接并应用 DB_PRAGMAS
+    
+    参数:
+        db_path: 数据库路径，默认为 DB_PATH
+    
+    返回:
+        sqlite3.Connection: 新连接，由调用方负责关闭
+    """
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=DB_PRAGMAS.get('busy_timeout', 5000) / 1000)
     conn.row_factory = sqlite3.Row
+    for name, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
     return conn
 
-def init_db():
-    """初始化数据库表结构"""
-    conn = get_db_connection()
+def get_db_connection():
+    """
+    获取当前线程的持久数据库连接
+    
+    同一线程内只打开一次，首次打开时应用 PRAGMA 并初始化表结构；
+    DB_PATH 被修改或进程 fork 后会自动重新打开。连接由管理器持有，
+    调用方不要关闭，需要释放时调用 close_db_connection。
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == DB_PATH and _local.pid == os.getpid():
+        return conn
+    
+    close_db_connection()
+    conn = connect(DB_PATH)
+    _local.conn = conn
+    _local.path = DB_PATH
+    _local.pid = os.getpid()
+    init_db()
+    return conn
+
+def close_db_connection():
+    """关闭当前线程持有的持久连接"""
+    conn = getattr(_local, 'conn', None)
+    _local.conn = None
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+
+def configure_pragmas(**pragmas):
+    """
+    修改连接使用的 PRAGMA，例如 configure_pragmas(synchronous='FULL')
+    
+    当前线程的连接会被关闭，下次获取连接时生效
+    """
+    DB_PRAGMAS.update(pragmas)
+    close_db_connection()
+
+def create_tables(conn):
+    """
+    在指定连接上创建表结构（不提交事务）
+    
+    参数:
+        conn: 数据库连接
+    """
     cursor = conn.cursor()
     
     # 创建用户表
@@ -50,9 +130,390 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users (user_id)
     )
     ''')
+
+def _migration_add_indexes(conn):
+    """为高频过滤列添加索引"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_links_user_id ON user_links (user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_country ON users (country)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_is_member ON users (is_member)")
+
+def _migration_crawl_state(conn):
+    """记录采集水位（最大 user_id、用户总数等）的键值表"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS crawl_state (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _migration_change_detection(conn):
+    """用户行指纹列和页面摘要表，用于跳过未变化的用户和页面"""
+    conn.execute("ALTER TABLE users ADD COLUMN row_hash TEXT")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS page_digests (
+        page_num INTEGER PRIMARY KEY,
+        digest TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _migration_crawl_jobs(conn):
+    """记录每页采集状态、尝试次数和最后错误的任务表，用于中断后续跑和失败重试"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS crawl_jobs (
+        page_num INTEGER PRIMARY KEY,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _migration_user_history(conn):
+    """
+    采集批次表和只追加的用户历史表
+    
+    user_history 每个用户每次采集最多一行，只记录余额、充值、扣除和会员状态中变化了的值
+    （未变化的列为 NULL）；主键 (user_id, run_id) 聚簇存储，便于查询单个用户的变化，
+    run_id 上的索引用于查询某次采集的全部变化。已有用户的当前值记为基线采集。
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS crawl_runs (
+        run_id INTEGER PRIMARY KEY,
+        started_at TIMESTAMP NOT NULL,
+        label TEXT
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_history (
+        user_id INTEGER NOT NULL,
+        run_id INTEGER NOT NULL,
+        credit_balance REAL,
+        recharge_amount REAL,
+        total_deduction REAL,
+        is_member TEXT,
+        PRIMARY KEY (user_id, run_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_history_run_id ON user_history (run_id)")
+    
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM users)").fetchone()[0]:
+        cursor = conn.execute("INSERT INTO crawl_runs (started_at, label) VALUES (CURRENT_TIMESTAMP, '基线')")
+        conn.execute("""
+        INSERT INTO user_history (user_id, run_id, credit_balance, recharge_amount, total_deduction, is_member)
+        SELECT user_id, ?, credit_balance, recharge_amount, total_deduction, is_member FROM users
+        """, (cursor.lastrowid,))
+
+def rebuild_stats(conn):
+    """
+    根据 users 表重新计算汇总表（不提交事务）
     
+    正常情况下汇总表由触发器增量维护，只在迁移或怀疑数据不一致时调用
+    """
+    conn.execute("DELETE FROM user_stats")
+    conn.execute("""
+    INSERT INTO user_stats (id, total, members, non_members, recharge_total, deduction_total, credit_total, refund_total)
+    SELECT 1, COUNT(*),
+           COALESCE(SUM(is_member IS '是'), 0), COALESCE(SUM(is_member IS '否'), 0),
+           COALESCE(SUM(recharge_amount), 0), COALESCE(SUM(total_deduction), 0),
+           COALESCE(SUM(credit_balance), 0), COALESCE(SUM(refund_amount), 0)
+    FROM users
+    """)
+    conn.execute("DELETE FROM country_stats")
+    conn.execute("""
+    INSERT INTO country_stats (country, user_count)
+    SELECT country, COUNT(*) FROM users GROUP BY country
+    """)
+
+def _migration_stats_tables(conn):
+    """
+    由触发器增量维护的汇总表，统计查询不再扫描 users 全表
+    
+    user_stats 只有一行：用户总数、会员数、非会员数和金额合计；
+    country_stats 每个国家一行（country 为 NULL 的用户也单独一行）。
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total INTEGER NOT NULL DEFAULT 0,
+        members INTEGER NOT NULL DEFAULT 0,
+        non_members INTEGER NOT NULL DEFAULT 0,
+        recharge_total REAL NOT NULL DEFAULT 0,
+        deduction_total REAL NOT NULL DEFAULT 0,
+        credit_total REAL NOT NULL DEFAULT 0,
+        refund_total REAL NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS country_stats (
+        country TEXT,
+        user_count INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_country_stats_country ON country_stats (country)")
+    
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE user_stats SET
+            total = total + 1,
+            members = members + (NEW.is_member IS '是'),
+            non_members = non_members + (NEW.is_member IS '否'),
+            recharge_total = recharge_total + COALESCE(NEW.recharge_amount, 0),
+            deduction_total = deduction_total + COALESCE(NEW.total_deduction, 0),
+            credit_total = credit_total + COALESCE(NEW.credit_balance, 0),
+            refund_total = refund_total + COALESCE(NEW.refund_amount, 0)
+        WHERE id = 1;
+        UPDATE country_stats SET user_count = user_count + 1 WHERE country IS NEW.country;
+        INSERT INTO country_stats (country, user_count)
+        SELECT NEW.country, 1 WHERE NOT EXISTS (SELECT 1 FROM country_stats WHERE country IS NEW.country);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_stats_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE user_stats SET
+            total = total - 1,
+            members = members - (OLD.is_member IS '是'),
+            non_members = non_members - (OLD.is_member IS '否'),
+            recharge_total = recharge_total - COALESCE(OLD.recharge_amount, 0),
+            deduction_total = deduction_total - COALESCE(OLD.total_deduction, 0),
+            credit_total = credit_total - COALESCE(OLD.credit_balance, 0),
+            refund_total = refund_total - COALESCE(OLD.refund_amount, 0)
+        WHERE id = 1;
+        UPDATE country_stats SET user_count = user_count - 1 WHERE country IS OLD.country;
+        DELETE FROM country_stats WHERE country IS OLD.country AND user_count <= 0;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_stats_update
+    AFTER UPDATE OF is_member, recharge_amount, total_deduction, credit_balance, refund_amount ON users
+    BEGIN
+        UPDATE user_stats SET
+            members = members + (NEW.is_member IS '是') - (OLD.is_member IS '是'),
+            non_members = non_members + (NEW.is_member IS '否') - (OLD.is_member IS '否'),
+            recharge_total = recharge_total + COALESCE(NEW.recharge_amount, 0) - COALESCE(OLD.recharge_amount, 0),
+            deduction_total = deduction_total + COALESCE(NEW.total_deduction, 0) - COALESCE(OLD.total_deduction, 0),
+            credit_total = credit_total + COALESCE(NEW.credit_balance, 0) - COALESCE(OLD.credit_balance, 0),
+            refund_total = refund_total + COALESCE(NEW.refund_amount, 0) - COALESCE(OLD.refund_amount, 0)
+        WHERE id = 1;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_stats_country
+    AFTER UPDATE OF country ON users WHEN OLD.country IS NOT NEW.country
+    BEGIN
+        UPDATE country_stats SET user_count = user_count - 1 WHERE country IS OLD.country;
+        DELETE FROM country_stats WHERE country IS OLD.country AND user_count <= 0;
+        UPDATE country_stats SET user_count = user_count + 1 WHERE country IS NEW.country;
+        INSERT INTO country_stats (country, user_count)
+        SELECT NEW.country, 1 WHERE NOT EXISTS (SELECT 1 FROM country_stats WHERE country IS NEW.country);
+    END
+    """)
+    rebuild_stats(conn)
+
+def _migration_data_version(conn):
+    """数据版本计数器，写入者每次提交用户数据时加 1，查询缓存据此判断是否失效"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+def bump_data_version(conn):
+    """数据版本加 1（不提交事务，应与数据修改在同一事务中执行）"""
+    conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+
+def get_data_version(conn):
+    """读取当前数据版本"""
+    row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+def has_search_index(conn):
+    """数据库中是否有 users_fts 搜索索引（SQLite 不支持 FTS5 trigram 时迁移不会创建）"""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'").fetchone() is not None
+
+def rebuild_search_index(conn):
+    """
+    根据 users 表重建 users_fts 搜索索引（不提交事务），没有搜索索引时不做任何操作
+    """
+    if has_search_index(conn):
+        conn.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+def _migration_search_index(conn):
+    """
+    email 和 remark 的 FTS5 全文索引，按 trigram 分词，支持任意位置的子串和前缀查找
+    
+    users_fts 是 users 表的外部内容索引（只存索引，不重复存储文本），由触发器同步。
+    SQLite 缺少 FTS5 或低于 3.34（不支持 trigram）时跳过（记录警告），query_db.search_users 退化为 LIKE 扫描；
+    之后每次初始化表结构时由 ensure_search_index 重试，SQLite 升级后自动补建。
+    """
+    try:
+        conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            email, remark, content='users', content_rowid='user_id', tokenize='trigram'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"当前 SQLite {sqlite3.sqlite_version} 不支持 FTS5 trigram 分词，"
+                       f"暂不创建搜索索引，search_users 使用 LIKE 扫描: {e}")
+        return
+    
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert AFTER INSERT ON users
+    BEGIN
+        INSERT INTO users_fts (rowid, email, remark) VALUES (NEW.user_id, NEW.email, NEW.remark);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete AFTER DELETE ON users
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, email, remark) VALUES ('delete', OLD.user_id, OLD.email, OLD.remark);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_users_fts_update AFTER UPDATE OF email, remark ON users
+    WHEN OLD.email IS NOT NEW.email OR OLD.remark IS NOT NEW.remark
+    BEGIN
+        INSERT INTO users_fts (users_fts, rowid, email, remark) VALUES ('delete', OLD.user_id, OLD.email, OLD.remark);
+        INSERT INTO users_fts (rowid, email, remark) VALUES (NEW.user_id, NEW.email, NEW.remark);
+    END
+    """)
+    rebuild_search_index(conn)
+
+# 创建搜索索引的迁移版本
+SEARCH_INDEX_VERSION = 8
+
+def ensure_search_index(conn):
+    """
+    补建迁移 8 当时因 SQLite 不支持而跳过的搜索索引（表结构版本已到 8 但没有 users_fts 时）
+    
+    返回:
+        bool: 是否有可用的搜索索引
+    """
+    if has_search_index(conn):
+        return True
+    if get_schema_version(conn) < SEARCH_INDEX_VERSION:
+        return False
+    try:
+        conn.execute("BEGIN")
+        _migration_search_index(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return has_search_index(conn)
+
+def _migration_user_scores(conn):
+    """risk_scoring 写入的用户风险分表，每次评分整体替换"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_scores (
+        user_id INTEGER PRIMARY KEY,
+        refund_ratio REAL NOT NULL,
+        deduction_ratio REAL NOT NULL,
+        refund_z REAL NOT NULL,
+        last_refund_z REAL NOT NULL,
+        recharge_z REAL NOT NULL,
+        deduction_z REAL NOT NULL,
+        credit_z REAL NOT NULL,
+        refund_ratio_pct REAL NOT NULL,
+        deduction_ratio_pct REAL NOT NULL,
+        risk_score REAL NOT NULL,
+        flagged INTEGER NOT NULL,
+        scored_at TIMESTAMP NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_scores_risk_score ON user_scores (risk_score DESC)")
+
+# 版本化的表结构迁移：(版本号, 说明, 迁移函数)
+# 版本号记录在 PRAGMA user_version 中，只能追加，不要修改已发布的迁移
+MIGRATIONS = [
+    (1, '为 user_links.user_id、users.country、users.is_member 添加索引', _migration_add_indexes),
+    (2, '添加 crawl_state 采集水位表', _migration_crawl_state),
+    (3, '添加 users.row_hash 行指纹和 page_digests 页面摘要表', _migration_change_detection),
+    (4, '添加 crawl_jobs 采集任务表', _migration_crawl_jobs),
+    (5, '添加 crawl_runs 采集批次表和 user_history 用户历史表', _migration_user_history),
+    (6, '添加由触发器维护的 user_stats、country_stats 汇总表', _migration_stats_tables),
+    (7, '添加 data_version 数据版本计数器', _migration_data_version),
+    (SEARCH_INDEX_VERSION, '添加 email、remark 的 users_fts 全文搜索索引', _migration_search_index),
+    (9, '添加 user_scores 用户风险分表', _migration_user_scores),
+]
+
+# 当前代码对应的表结构版本
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """读取数据库的表结构版本（PRAGMA user_version）"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """
+    将数据库升级到最新的表结构版本
+    
+    每个迁移在独立事务中执行并同时更新 user_version，
+    失败时回滚，数据库停留在上一个成功的版本。
+    
+    参数:
+        conn: 数据库连接
+    
+    返回:
+        list: 本次执行的迁移版本号
+    """
+    applied = []
+    current = get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"数据库表结构版本 {current} 高于程序支持的版本 {SCHEMA_VERSION}")
+    
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN")
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    
+    return applied
+
+def init_schema(conn):
+    """
+    在指定连接上创建基础表并执行所有迁移
+    
+    参数:
+        conn: 数据库连接
+    """
+    create_tables(conn)
     conn.commit()
-    conn.close()
+    # 本次刚执行过迁移 8 时不再重复尝试
+    if SEARCH_INDEX_VERSION not in migrate(conn):
+        ensure_search_index(conn)
+
+def init_db(force=False):
+    """
+    初始化数据库表结构并执行迁移，每个进程对同一数据库只执行一次
+    
+    参数:
+        force: 是否忽略已初始化标记，强制执行
+    """
+    db_key = str(DB_PATH)
+    with _init_lock:
+        if db_key in _initialized_paths and not force:
+            return
+        # 先标记再获取连接，避免 get_db_connection 中再次初始化
+        _initialized_paths.add(db_key)
+        try:
+            conn = get_db_connection()
+            init_schema(conn)
+        except Exception:
+            _initialized_paths.discard(db_key)
+            raise
 
 if __name__ == "__main__":
     init_db() 
\ No newline at end of file
@@ -3,68 +3,90 @@ import pandas as pd
 from pathlib import Path
 from datetime import datetime
 from db_config import get_db_connection
+from user_record import USER_TABLE_COLUMNS
 
-def export_users_to_excel():
+# 导出文件默认目录
+EXPORT_DIR = Path(__file__).parent / 'exports'
+
+def build_links_summary(users_df, links_df):
+    """
+    为每个用户生成链接信息汇总文本（"类型: URL"，每行一个）
+    
+    对整张链接表做一次 groupby 聚合，耗时与数据量成线性关系
+    
+    参数:
+        users_df: 用户数据 DataFrame
+        links_df: 链接数据 DataFrame（按 id 排序）
+    
+    返回:
+        pd.Series: 与 users_df 对齐的汇总文本，没有链接的用户为空字符串
+    """
+    if links_df.empty:
+        return pd.Series([""] * len(users_df), index=users_df.index, dtype=object)
+    
+    links_text = links_df['link_type'].astype(str) + ': ' + links_df['link_url'].astype(str)
+    summary = links_text.groupby(links_df['user_id'], sort=False).agg("\n".join)
+    return users_df['user_id'].map(summary).fillna("")
+
+def build_stats(users_df):
+    """
+    计算国家分布和会员统计
+    
+    返回:
+        tuple: (国家统计 DataFrame, 会员统计 DataFrame)
+    """
+    country_stats = users_df.groupby('country').size().reset_index(name='用户数量')
+    member_stats = users_df.groupby('is_member').size().reset_index(name='用户数量')
+    return country_stats, member_stats
+
+def export_users_to_excel(output_dir=None):
     """
     将users.db中的用户数据导出到Excel文件
+    
+    参数:
+        output_dir: 可选，输出目录，默认为 exports/
+    
+    返回:
+        Path: 导出文件路径
     """
     conn = get_db_connection()
     
-    try:
-        # 获取用户数据
-        users_df = pd.read_sql_query("SELECT * FROM users ORDER BY user_id DESC", conn)
-        
-        # 获取链接数据
-        links_df = pd.read_sql_query("SELECT * FROM user_links", conn)
-        
-        # 为每个用户创建链接信息汇总列
-        links_summary = {}
-        
-        for user_id in users_df['user_id']:
-            # 获取该用户的所有链接
-            user_links = links_df[links_df['user_id'] == user_id]
-            
-            if not user_links.empty:
-                links_text = []
-                for _, link in user_links.iterrows():
-                    links_text.append(f"{link['link_type']}: {link['link_url']}")
-                
-                links_summary[user_id] = "\n".join(links_text)
-            else:
-                links_summary[user_id] = ""
-        
-        # 将链接信息添加到用户数据中
-        users_df['links_info'] = users_df['user_id'].map(links_summary)
-        
-        # 创建输出目录
-        output_dir = Path(__file__).parent / 'exports'
-        output_dir.mkdir(exist_ok=True)
+    # 获取用户数据
+    users_df = pd.read_sql_query(f"SELECT {', '.join(USER_TABLE_COLUMNS)} FROM users ORDER BY user_id DESC", conn)
+    
+    # 获取链接数据
+    links_df = pd.read_sql_query("SELECT * FROM user_links ORDER BY id", conn)
+    
+    # 为每个用户创建链接信息汇总列，并添加到用户数据中
+    users_df['links_info'] = build_links_summary(users_df, links_df)
+    
+    # 统计表在写文件前一次算好
+    country_stats, member_stats = build_stats(users_df)
+    
+    # 创建输出目录
+    output_dir = Path(output_dir) if output_dir else EXPORT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    # 设置输出文件名
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = output_dir / f"taskmonkey_users_info_{timestamp}.xlsx"
+    
+    # 导出到Excel
+    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+        # 用户数据表
+        users_df.to_excel(writer, sheet_name='用户数据', index=False)
         
-        # 设置输出文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = output_dir / f"taskmonkey_users_info_{timestamp}.xlsx"
+        # 链接数据表
+        links_df.to_excel(writer, sheet_name='链接数据', index=False)
         
-        # 导出到Excel
-        with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
-            # 用户数据表
-            users_df.to_excel(writer, sheet_name='用户数据', index=False)
-            
-            # 链接数据表
-            links_df.to_excel(writer, sheet_name='链接数据', index=False)
-            
-            # 国家统计表
-            country_stats = users_df.groupby('country').size().reset_index(name='用户数量')
-            country_stats.to_excel(writer, sheet_name='国家分布', index=False)
-            
-            # 会员统计表
-            member_stats = users_df.groupby('is_member').size().reset_index(name='用户数量')
-            member_stats.to_excel(writer, sheet_name='会员统计', index=False)
+        # 国家统计表
+        country_stats.to_excel(writer, sheet_name='国家分布', index=False)
         
-        print(f"数据已成功导出到: {output_file}")
-        return output_file
+        # 会员统计表
+        member_stats.to_excel(writer, sheet_name='会员统计', index=False)
     
-    finally:
-        conn.close()
+    print(f"数据已成功导出到: {output_file}")
+    return output_file
 
 if __name__ == "__main__":
     # 检查是否缺少openpyxl库
@@ -0,0 +1,88 @@
+import httpx
+from crawl_session import CrawlSession, FetchBackend, COOKIE_DOMAIN
+
+class HttpBackend(FetchBackend):
+    """
+    直接发送 HTTP 请求的抓取后端
+
+    用户列表页是服务端渲染的HTML表格，不需要浏览器执行脚本。
+    使用带连接池的 keep-alive 客户端，支持 gzip 压缩和连接复用，
+    cookie 来自 get_cookie（浏览器只用于获取 cookie）。
+    """
+
+    def __init__(self, cookies=None, max_connections=10, timeout=30.0, domain=COOKIE_DOMAIN):
+        """
+        参数:
+            cookies: cookie 字典
+            max_connections: 连接池大小（也是 keep-alive 连接数）
+            timeout: 单个请求的超时秒数
+            domain: cookie 所属域名
+        """
+        self.cookies = dict(cookies or {})
+        self.max_connections = max(1, max_connections)
+        self.timeout = timeout
+        self.domain = domain
+        self._client = None
+
+    async def start(self):
+        """创建 HTTP 客户端"""
+        if self._client is not None:
+            return
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections
+        )
+        self._client = httpx.AsyncClient(
+            limits=limits,
+            timeout=self.timeout,
+            headers={'Accept-Encoding': 'gzip, deflate'},
+            follow_redirects=True
+        )
+        await self.set_cookies(self.cookies)
+
+    async def close(self):
+        """关闭 HTTP 客户端及其连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def set_cookies(self, cookies):
+        """将 cookie 字典写入客户端的 cookie jar"""
+        self.cookies = dict(cookies)
+        for name, value in self.cookies.items():
+            self._client.cookies.set(name, value, domain=self.domain, path='/')
+
+    async def get(self, url):
+        """
+        发送 GET 请求获取页面内容
+
+        返回:
+            str: 页面HTML内容
+        """
+        response = await self._client.get(url)
+        response.raise_for_status()
+        return response.text
+
+# 可选的抓取后端
+BACKENDS = {
+    'playwright': CrawlSession,
+    'http': HttpBackend,
+}
+
+def create_backend(name, cookies=None, concurrency=1):
+    """
+    按名称创建抓取后端
+
+    参数:
+        name: 后端名称，见 BACKENDS
+        cookies: cookie 字典
+        concurrency: 并发数，决定页面池/连接池大小
+
+    返回:
+        抓取后端实例（未启动，需配合 async with 使用）
+    """
+    if name == 'playwright':
+        return CrawlSession(cookies, max_pages=concurrency)
+    if name == 'http':
+        return HttpBackend(cookies, max_connections=concurrency)
+    raise ValueError(f"未知的抓取后端: {name}，可选: {', '.join(BACKENDS)}")
@@ -1,37 +1,50 @@
 import asyncio
-from playwright.async_api import async_playwright
+from crawl_session import CrawlSession, ENABLE_URL
 
-async def get_cookie():
+async def get_cookie_with_expiry(session=None):
+    """
+    访问特定 URL 获取 cookie 及其过期时间
+    
+    参数:
+        session: 可选，复用的 CrawlSession；不提供时临时启动一个浏览器
+    
+    返回:
+        tuple: (cookie 字典, 过期时间戳)；会话 cookie 没有过期时间时为 None，出错时返回 ({}, None)
+    """
+    if session is None:
+        async with CrawlSession() as session:
+            return await get_cookie_with_expiry(session)
+    
+    try:
+        # 访问启用 API 的 URL，并等待页面加载完成
+        await session.get(ENABLE_URL)
+        
+        # 获取所有 cookie（已经保存在会话的 context 中，后续请求无需再次安装）
+        cookies = await session.get_cookies()
+        
+        # 转换成字典格式便于使用
+        cookie_dict = {cookie['name']: cookie['value'] for cookie in cookies}
+        session.cookies = cookie_dict
+        
+        # 以最早过期的 cookie 为准，expires 为 -1 表示会话 cookie
+        expires = [cookie['expires'] for cookie in cookies if cookie.get('expires', -1) > 0]
+        return cookie_dict, min(expires) if expires else None
+    except Exception as e:
+        print(f"获取 cookie 时出错: {e}")
+        return {}, None
+
+async def get_cookie(session=None):
     """
     访问特定 URL 获取 cookie
     
+    参数:
+        session: 可选，复用的 CrawlSession；不提供时临时启动一个浏览器
+    
     返回:
         dict: 获取到的 cookie 字典
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
-        page = await context.new_page()
-        
-        try:
-            # 访问启用 API 的 URL
-            await page.goto('https://api.taskmonkey.ai/api/index/enable/update?secret_key=tastAdmin77123')
-            
-            # 等待页面加载完成
-            await page.wait_for_load_state('networkidle')
-            
-            # 获取所有 cookie
-            cookies = await context.cookies()
-            
-            # 转换成字典格式便于使用
-            cookie_dict = {cookie['name']: cookie['value'] for cookie in cookies}
-            
-            return cookie_dict
-        except Exception as e:
-            print(f"获取 cookie 时出错: {e}")
-            return {}
-        finally:
-            await browser.close()
+    cookie_dict, expires_at = await get_cookie_with_expiry(session)
+    return cookie_dict
 
 # 使用同步方式调用异步函数
 def get_cookie_sync():
@@ -48,4 +61,4 @@ if __name__ == "__main__":
         for name, value in cookie_dict.items():
             print(f"{name}: {value}")
     else:
-        print("获取 Cookie 失败") 
\ No newline at end of file
+        print("获取 Cookie 失败")
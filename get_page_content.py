@@ -1,8 +1,8 @@
 import asyncio
-from playwright.async_api import async_playwright
 import os
+from crawl_session import CrawlSession, USER_LIST_URL
 
-async def get_page_content(url, cookies=None, save_to_file=None):
+async def get_page_content(url, cookies=None, save_to_file=None, session=None):
     """
     获取指定URL的页面内容
     
@@ -10,48 +10,16 @@ async def get_page_content(url, cookies=None, save_to_file=None):
         url: 要获取内容的URL
         cookies: cookie 字典
         save_to_file: 可选，保存内容到文件路径
+        session: 可选，复用的 CrawlSession；不提供时临时启动一个浏览器
     
     返回:
         str: 页面HTML内容
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
-        
-        # 如果提供了cookies，则设置它们
-        if cookies:
-            for name, value in cookies.items():
-                await context.add_cookies([{
-                    'name': name,
-                    'value': value,
-                    'domain': 'api.taskmonkey.ai',
-                    'path': '/'
-                }])
-        
-        page = await context.new_page()
-        
-        try:
-            # 访问指定URL
-            await page.goto(url)
-            
-            # 等待页面加载完成
-            await page.wait_for_load_state('networkidle')
-            
-            # 获取页面内容
-            content = await page.content()
-            
-            # 如果提供了保存路径，则保存内容到文件
-            if save_to_file:
-                os.makedirs(os.path.dirname(save_to_file), exist_ok=True)
-                with open(save_to_file, 'w', encoding='utf-8') as f:
-                    f.write(content)
-            
-            return content
-        except Exception as e:
-            print(f"获取页面内容时出错: {e}")
-            return ""
-        finally:
-            await browser.close()
+    if session is not None:
+        return await session.fetch(url, save_to_file)
+    
+    async with CrawlSession(cookies) as session:
+        return await session.fetch(url, save_to_file)
 
 # 同步方式调用异步函数
 def get_page_content_sync(url, cookies=None, save_to_file=None):
@@ -66,7 +34,7 @@ if __name__ == "__main__":
     cookies = get_cookie_sync()
     
     # 测试 URL
-    test_url = 'https://api.taskmonkey.ai/api/user/index?orderBy=id'
+    test_url = USER_LIST_URL
     
     # 获取页面内容并保存到文件
     save_path = os.path.join(os.path.dirname(__file__), 'downloaded_page', 'test_page.html')
@@ -77,4 +45,4 @@ if __name__ == "__main__":
         print(f"页面内容已获取并保存到: {save_path}")
         print(f"内容长度: {len(content)} 字符")
     else:
-        print("获取页面内容失败") 
\ No newline at end of file
+        print("获取页面内容失败")
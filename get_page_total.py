@@ -2,57 +2,38 @@ import asyncio
 import re
 import math
 from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright
+from crawl_session import CrawlSession, USER_LIST_URL
 from get_users_array_from_page import extract_total_users
 
-async def get_page_total(cookies=None):
+async def get_page_total(cookies=None, session=None):
     """
     获取用户列表总页数
     
     参数:
         cookies: cookie 字典
+        session: 可选，复用的 CrawlSession；不提供时临时启动一个浏览器
     
     返回:
         int: 总页数
     """
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
+    if session is None:
+        async with CrawlSession(cookies) as session:
+            return await get_page_total(session=session)
+    
+    try:
+        # 访问用户列表页面，并等待页面加载完成
+        content = await session.get(USER_LIST_URL)
         
-        # 如果提供了cookies，则设置它们
-        if cookies:
-            for name, value in cookies.items():
-                await context.add_cookies([{
-                    'name': name,
-                    'value': value,
-                    'domain': 'api.taskmonkey.ai',
-                    'path': '/'
-                }])
+        # 提取用户总数并计算页数
+        total_users = extract_total_users(content)
         
-        page = await context.new_page()
+        # 一页显示10条记录，计算总页数
+        page_total = math.ceil(total_users / 10)
         
-        try:
-            # 访问用户列表页面
-            await page.goto('https://api.taskmonkey.ai/api/user/index?orderBy=id')
-            
-            # 等待页面加载完成
-            await page.wait_for_load_state('networkidle')
-            
-            # 获取页面内容
-            content = await page.content()
-            
-            # 提取用户总数并计算页数
-            total_users = extract_total_users(content)
-            
-            # 一页显示10条记录，计算总页数
-            page_total = math.ceil(total_users / 10)
-            
-            return page_total, total_users
-        except Exception as e:
-            print(f"获取总页数时出错: {e}")
-            return 0, 0
-        finally:
-            await browser.close()
+        return page_total, total_users
+    except Exception as e:
+        print(f"获取总页数时出错: {e}")
+        return 0, 0
 
 # 同步方式调用异步函数
 def get_page_total_sync(cookies=None):
@@ -73,4 +54,4 @@ if __name__ == "__main__":
         print(f"用户总数: {total_users}")
         print(f"总页数: {page_total}")
     else:
-        print("获取总页数失败") 
\ No newline at end of file
+        print("获取总页数失败")
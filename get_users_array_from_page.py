@@ -1,85 +1,204 @@
 import json
 import re
 from bs4 import BeautifulSoup
+from lxml import html as lxml_html
 from datetime import datetime
+from user_record import UserRecord, as_dict
 
-def extract_user_data(html_content):
+def _to_int(text):
+    return int(text) if text.isdigit() else 0
+
+def _to_float(text):
+    return float(text or '0')
+
+def build_user_record(texts, links, remark):
     """
-    从HTML页面内容中提取用户数据
-    返回: 用户数据字典列表
+    根据单元格文本构建 UserRecord（各解析引擎共用，保证输出一致）
+    
+    参数:
+        texts: 前16列单元格去除空白后的文本
+        links: 操作链接 ((link_type, link_url), ...)
+        remark: 备注
+    
+    返回:
+        UserRecord: 用户记录
+    """
+    return UserRecord(
+        int(texts[0]),          # user_id
+        texts[1],               # email
+        texts[2],               # create_time
+        _to_int(texts[3]),      # promotion_count
+        texts[4],               # is_member
+        _to_float(texts[5]),    # refund_amount
+        _to_float(texts[6]),    # last_refund_amount
+        _to_float(texts[7]),    # last_deductible_amount
+        _to_float(texts[8]),    # credit_balance
+        texts[9],               # has_card
+        texts[10],              # country
+        _to_float(texts[11]),   # recharge_amount
+        _to_float(texts[12]),   # total_deduction
+        texts[13],              # version
+        texts[14],              # terminal_type
+        texts[15],              # browser_type
+        remark,
+        tuple(links),
+    )
+
+def build_user_data(texts, operation_links, remark):
+    """
+    根据单元格文本构建用户数据字典
+    
+    参数:
+        texts: 前16列单元格去除空白后的文本
+        operation_links: 操作链接列表 [{'link_type': ..., 'link_url': ...}, ...]
+        remark: 备注
+    
+    返回:
+        dict: 用户数据字典
+    """
+    links = [(link['link_type'], link['link_url']) for link in operation_links]
+    return as_dict(build_user_record(texts, links, remark))
+
+def iter_rows_bs4(html_content):
+    """
+    使用 BeautifulSoup 构建整页文档树，逐行生成 (前16列文本, 操作链接, 备注)
     """
     soup = BeautifulSoup(html_content, 'lxml')
-    users_data = []
     
     # 获取表格行数据
     table = soup.find('table')
     if not table:
-        return []
+        return
     
-    rows = table.find('tbody').find_all('tr')
-    for row in rows:
+    for row in table.find('tbody').find_all('tr'):
         cells = row.find_all('td')
         if len(cells) < 18:  # 确保行有足够的列
             continue
         
-        # 提取用户基本信息
-        user_id = cells[0].text.strip()
-        email = cells[1].text.strip()
-        create_time = cells[2].text.strip()
-        promotion_count = cells[3].text.strip() or '0'
-        is_member = cells[4].text.strip()
-        refund_amount = cells[5].text.strip() or '0'
-        last_refund_amount = cells[6].text.strip() or '0'
-        last_deductible_amount = cells[7].text.strip() or '0'
-        credit_balance = cells[8].text.strip() or '0'
-        has_card = cells[9].text.strip()
-        country = cells[10].text.strip()
-        recharge_amount = cells[11].text.strip() or '0'
-        total_deduction = cells[12].text.strip() or '0'
-        version = cells[13].text.strip()
-        terminal_type = cells[14].text.strip()
-        browser_type = cells[15].text.strip()
+        texts = [cell.text.strip() for cell in cells[:16]]
         
         # 提取操作链接
-        operation_links = []
-        links = cells[16].find_all('a')
-        for link in links:
-            if 'javascript:void(0);' not in link.get('href', ''):
-                link_text = link.text.strip()
-                link_url = link.get('href', '')
-                operation_links.append({
-                    'link_type': link_text,
-                    'link_url': link_url
-                })
+        links = [
+            (link.text.strip(), link.get('href', ''))
+            for link in cells[16].find_all('a')
+            if 'javascript:void(0);' not in link.get('href', '')
+        ]
         
         # 提取备注
         remark = cells[17].find('a').text.strip() if cells[17].find('a') else ''
         
-        # 构建用户数据字典
-        user_data = {
-            'user_id': int(user_id),
-            'email': email,
-            'create_time': create_time,
-            'promotion_count': int(promotion_count) if promotion_count.isdigit() else 0,
-            'is_member': is_member,
-            'refund_amount': float(refund_amount) if refund_amount and refund_amount != '' else 0,
-            'last_refund_amount': float(last_refund_amount) if last_refund_amount and last_refund_amount != '' else 0,
-            'last_deductible_amount': float(last_deductible_amount) if last_deductible_amount and last_deductible_amount != '' else 0,
-            'credit_balance': float(credit_balance) if credit_balance and credit_balance != '' else 0,
-            'has_card': has_card,
-            'country': country,
-            'recharge_amount': float(recharge_amount) if recharge_amount and recharge_amount != '' else 0,
-            'total_deduction': float(total_deduction) if total_deduction and total_deduction != '' else 0,
-            'version': version,
-            'terminal_type': terminal_type,
-            'browser_type': browser_type,
-            'remark': remark,
-            'links': operation_links
-        }
+        yield texts, links, remark
+
+def iter_rows_lxml(html_content):
+    """
+    快速解析：只截取第一个表格的 <tbody> 部分交给 lxml 解析，
+    跳过页面头部的大段 <script> 和其它无关内容，逐行生成 (前16列文本, 操作链接, 备注)，
+    输出与 bs4 引擎完全一致
+    """
+    table_start = html_content.find('<table')
+    if table_start < 0:
+        return
+    tbody_start = html_content.find('<tbody', table_start)
+    tbody_end = html_content.find('</tbody>', tbody_start)
+    if tbody_start < 0 or tbody_end < 0:
+        return
+    
+    table = lxml_html.fromstring('<table>' + html_content[tbody_start:tbody_end + len('</tbody>')] + '</table>')
+    
+    for row in table.iter('tr'):
+        cells = list(row.iter('td'))
+        if len(cells) < 18:  # 确保行有足够的列
+            continue
+        
+        texts = [cell.text_content().strip() for cell in cells[:16]]
+        
+        # 提取操作链接
+        links = [
+            (link.text_content().strip(), link.get('href', ''))
+            for link in cells[16].iter('a')
+            if 'javascript:void(0);' not in link.get('href', '')
+        ]
+        
+        # 提取备注
+        remark_link = next(cells[17].iter('a'), None)
+        remark = remark_link.text_content().strip() if remark_link is not None else ''
+        
+        # 处理完的行从树中移除，已生成的行不再占用内存
+        row.clear()
         
-        users_data.append(user_data)
+        yield texts, links, remark
+
+# 可选的解析引擎：逐行生成单元格数据的函数
+ROW_ITERATORS = {
+    'bs4': iter_rows_bs4,
+    'lxml': iter_rows_lxml,
+}
+
+# 默认解析引擎
+DEFAULT_ENGINE = 'lxml'
+
+def _row_iterator(engine):
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ROW_ITERATORS:
+        raise ValueError(f"未知的解析引擎: {engine}，可选: {', '.join(ROW_ITERATORS)}")
+    return ROW_ITERATORS[engine]
+
+def iter_user_rows(html_content, engine=None):
+    """
+    从HTML页面内容中逐个生成用户记录（生成器，不构建整页的用户列表）
+    
+    参数:
+        html_content: 页面HTML内容
+        engine: 解析引擎，'lxml'（快速，默认）或 'bs4'
+    
+    返回:
+        生成器: UserRecord，可直接传给 write_users_array / upsert_users_batch
+    """
+    for texts, links, remark in _row_iterator(engine)(html_content):
+        yield build_user_record(texts, links, remark)
+
+def extract_user_records(html_content, engine=None):
+    """
+    从HTML页面内容中提取用户记录列表（需要在进程间传递整页结果时使用，比字典列表小得多）
     
-    return users_data
+    返回: UserRecord 列表
+    """
+    return list(iter_user_rows(html_content, engine))
+
+def extract_user_data_bs4(html_content):
+    """
+    使用 BeautifulSoup 构建整页文档树后提取用户数据
+    返回: 用户数据字典列表
+    """
+    return [as_dict(record) for record in iter_user_rows(html_content, 'bs4')]
+
+def extract_user_data_lxml(html_content):
+    """
+    快速解析（见 iter_rows_lxml），输出与 bs4 引擎完全一致
+    返回: 用户数据字典列表
+    """
+    return [as_dict(record) for record in iter_user_rows(html_content, 'lxml')]
+
+# 可选的解析引擎
+PARSER_ENGINES = {
+    'bs4': extract_user_data_bs4,
+    'lxml': extract_user_data_lxml,
+}
+
+def extract_user_data(html_content, engine=None):
+    """
+    从HTML页面内容中提取用户数据
+    
+    参数:
+        html_content: 页面HTML内容
+        engine: 解析引擎，'lxml'（快速，默认）或 'bs4'
+    
+    返回: 用户数据字典列表
+    """
+    engine = engine or DEFAULT_ENGINE
+    if engine not in PARSER_ENGINES:
+        raise ValueError(f"未知的解析引擎: {engine}，可选: {', '.join(PARSER_ENGINES)}")
+    return PARSER_ENGINES[engine](html_content)
 
 def extract_total_users(html_content):
     """提取用户总数信息"""
@@ -90,12 +209,12 @@ def extract_total_users(html_content):
         return int(users_count_match.group(1))
     return 0
 
-def process_html_file(file_path):
+def process_html_file(file_path, engine=None):
     """处理HTML文件并返回提取的用户数据"""
     with open(file_path, 'r', encoding='utf-8') as f:
         html_content = f.read()
     
-    return extract_user_data(html_content)
+    return extract_user_data(html_content, engine)
 
 if __name__ == "__main__":
     # 测试从文件读取
@@ -1,7 +1,12 @@
 import json
 import sqlite3
+import hashlib
+from itertools import islice
+from collections import namedtuple
 from datetime import datetime
-from db_config import get_db_connection, init_db
+from db_config import get_db_connection, init_db, chunked, bump_data_version, MAX_SQL_VARIABLES
+from crawl_state import save_page_digest
+from user_record import USER_COLUMNS, FIELD_INDEX, user_values, user_links, user_id_of
 
 def insert_or_update_user(conn, user_data):
     """
@@ -9,104 +14,270 @@ def insert_or_update_user(conn, user_data):
     
     参数:
         conn: 数据库连接
-        user_data: 用户数据字典
+        user_data: 用户数据字典或 UserRecord
     
     返回:
         bool: 是否为新插入的用户
     """
     cursor = conn.cursor()
+    user_id = user_id_of(user_data)
     
     # 检查用户是否已存在
-    cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_data['user_id'],))
+    cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
     existing_user = cursor.fetchone()
     
     # 准备用户基本数据
-    user_values = (
-        user_data['user_id'],
-        user_data['email'],
-        user_data['create_time'],
-        user_data['promotion_count'],
-        user_data['is_member'],
-        user_data['refund_amount'],
-        user_data['last_refund_amount'],
-        user_data['last_deductible_amount'],
-        user_data['credit_balance'],
-        user_data['has_card'],
-        user_data['country'],
-        user_data['recharge_amount'],
-        user_data['total_deduction'],
-        user_data['version'],
-        user_data['terminal_type'],
-        user_data['browser_type'],
-        user_data['remark'],
-        datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    )
+    user_values_with_time = user_values(user_data) + (datetime.now().strftime('%Y-%m-%d %H:%M:%S'),)
     
     is_new_user = False
     
     if existing_user:
         # 更新已存在的用户
-        cursor.execute("""
-        UPDATE users SET 
-            email = ?, create_time = ?, promotion_count = ?, is_member = ?,
-            refund_amount = ?, last_refund_amount = ?, last_deductible_amount = ?,
-            credit_balance = ?, has_card = ?, country = ?, recharge_amount = ?,
-            total_deduction = ?, version = ?, terminal_type = ?, browser_type = ?,
-            remark = ?, updated_at = ?
+        cursor.execute(f"""
+        UPDATE users SET {', '.join(f'{column} = ?' for column in USER_COLUMNS[1:])}, updated_at = ?
         WHERE user_id = ?
-        """, user_values[1:] + (user_data['user_id'],))
+        """, user_values_with_time[1:] + (user_id,))
     else:
         # 插入新用户
-        cursor.execute("""
-        INSERT INTO users (
-            user_id, email, create_time, promotion_count, is_member, 
-            refund_amount, last_refund_amount, last_deductible_amount, 
-            credit_balance, has_card, country, recharge_amount, 
-            total_deduction, version, terminal_type, browser_type, 
-            remark, updated_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, user_values)
+        cursor.execute(f"""
+        INSERT INTO users ({', '.join(USER_COLUMNS)}, updated_at)
+        VALUES ({', '.join('?' for _ in USER_COLUMNS)}, ?)
+        """, user_values_with_time)
         is_new_user = True
     
     # 如果有链接数据，先删除旧的再插入新的
-    if 'links' in user_data and user_data['links']:
-        cursor.execute("DELETE FROM user_links WHERE user_id = ?", (user_data['user_id'],))
+    links = user_links(user_data)
+    if links:
+        cursor.execute("DELETE FROM user_links WHERE user_id = ?", (user_id,))
+        cursor.executemany("""
+        INSERT INTO user_links (user_id, link_type, link_url)
+        VALUES (?, ?, ?)
+        """, [(user_id, link_type, link_url) for link_type, link_url in links])
+    
+    return is_new_user
+
+# 每批写入的用户数
+BATCH_SIZE = 500
+
+UPSERT_USER_SQL = f"""
+INSERT INTO users ({', '.join(USER_COLUMNS)}, updated_at, row_hash)
+VALUES ({', '.join('?' for _ in USER_COLUMNS)}, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    {', '.join(f'{column} = excluded.{column}' for column in USER_COLUMNS[1:])},
+    updated_at = excluded.updated_at,
+    row_hash = excluded.row_hash
+"""
+
+# 需要保留历史的列（user_history 中只记录这些列的变化）
+HISTORY_COLUMNS = ('credit_balance', 'recharge_amount', 'total_deduction', 'is_member')
+
+# 历史列在列值元组中的位置
+_HISTORY_INDEXES = tuple(FIELD_INDEX[column] for column in HISTORY_COLUMNS)
+
+INSERT_HISTORY_SQL = f"""
+INSERT INTO user_history (user_id, run_id, {', '.join(HISTORY_COLUMNS)})
+VALUES (?, ?, {', '.join('?' for _ in HISTORY_COLUMNS)})
+ON CONFLICT(user_id, run_id) DO UPDATE SET
+    {', '.join(f'{column} = COALESCE(excluded.{column}, {column})' for column in HISTORY_COLUMNS)}
+"""
+
+# 批量写入结果：新增、内容有变化、内容无变化的用户数
+UpsertResult = namedtuple('UpsertResult', ['new', 'changed', 'unchanged'])
+
+def user_fingerprint(user_data, values=None):
+    """
+    计算用户数据的指纹（全部页面字段加链接列表），用于判断内容是否变化
+    
+    参数:
+        user_data: 用户数据字典或 UserRecord（两种格式的同一用户指纹相同）
+        values: 可选，已取出的列值元组，避免重复构造
+    
+    返回:
+        str: 32 位十六进制摘要
+    """
+    payload = list(values or user_values(user_data))
+    payload.append(user_links(user_data))
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+def fetch_existing_hashes(conn, user_ids):
+    """
+    批量查询已存在用户的指纹
+    
+    参数:
+        conn: 数据库连接
+        user_ids: 用户ID列表
+    
+    返回:
+        dict: {user_id: row_hash}，只包含数据库中已存在的用户，旧数据的 row_hash 为 None
+    """
+    existing = {}
+    for chunk in chunked(list(user_ids), MAX_SQL_VARIABLES):
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(f"SELECT user_id, row_hash FROM users WHERE user_id IN ({placeholders})", chunk)
+        existing.update((row[0], row[1]) for row in rows)
+    return existing
+
+def fetch_history_values(conn, user_ids):
+    """
+    批量查询用户当前的历史列取值
+    
+    返回:
+        dict: {user_id: (credit_balance, recharge_amount, total_deduction, is_member)}
+    """
+    values = {}
+    for chunk in chunked(list(user_ids), MAX_SQL_VARIABLES):
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(
+            f"SELECT user_id, {', '.join(HISTORY_COLUMNS)} FROM users WHERE user_id IN ({placeholders})", chunk
+        )
+        values.update((row[0], tuple(row[1:])) for row in rows)
+    return values
+
+def build_history_rows(conn, written, run_id, known_values):
+    """
+    计算一批写入用户的历史记录（必须在写入 users 之前调用）
+    
+    参数:
+        conn: 数据库连接
+        written: [(用户ID, 列值元组, 是否新用户), ...]，只包含新增或有变化的用户
+        run_id: 采集批次
+        known_values: {user_id: 历史列取值}，本次调用中已处理过的用户，会被更新
+    
+    返回:
+        list: user_history 行；新用户记录全部值，老用户只记录变化的值（未变化的为 None）
+    """
+    lookup = [user_id for user_id, _, is_new in written if not is_new and user_id not in known_values]
+    known_values.update(fetch_history_values(conn, lookup))
+    
+    rows = []
+    for user_id, user_row, is_new in written:
+        values = tuple(user_row[index] for index in _HISTORY_INDEXES)
+        previous = None if is_new else known_values.get(user_id)
+        known_values[user_id] = values
+        if previous is None:
+            rows.append((user_id, run_id) + values)
+            continue
+        changes = tuple(value if value != old else None for value, old in zip(values, previous))
+        if any(change is not None for change in changes):
+            rows.append((user_id, run_id) + changes)
+    return rows
+
+def _batches(items, size):
+    """按 size 切分任意可迭代对象（包括生成器），每次只取出一批"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def upsert_users_batch(conn, users_data, batch_size=BATCH_SIZE, run_id=None):
+    """
+    批量插入或更新用户数据（不负责提交事务）
+    
+    每批用户先用一次 IN 查询取出已存在用户的指纹，指纹相同的用户直接跳过
+    （不更新 updated_at，也不重写链接），其余用一次 executemany + ON CONFLICT 写入，
+    有链接的用户整体删除旧链接后再用一次 executemany 插入新链接。
+    
+    参数:
+        conn: 数据库连接
+        users_data: 用户数据字典或 UserRecord 的可迭代对象（可以是 iter_user_rows 生成器，
+            按批取出，不需要先构建完整列表）
+        batch_size: 每批处理的用户数
+        run_id: 可选，采集批次；提供时把余额、充值、扣除和会员状态的变化追加到 user_history
+    
+    返回:
+        UpsertResult: (新增用户数, 有变化的用户数, 无变化的用户数)
+    """
+    new_users = 0
+    changed_users = 0
+    unchanged_users = 0
+    known_hashes = {}
+    known_values = {}
+    updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
+    for batch in _batches(users_data, batch_size):
+        batch_ids = {user_id_of(user_data) for user_data in batch}
+        known_hashes.update(fetch_existing_hashes(conn, batch_ids - set(known_hashes)))
+        
+        user_rows = []
+        links_by_user = {}
+        written = []
+        for user_data in batch:
+            values = user_values(user_data)
+            user_id = values[0]
+            row_hash = user_fingerprint(user_data, values)
+            if user_id not in known_hashes:
+                new_users += 1
+            elif known_hashes[user_id] == row_hash:
+                unchanged_users += 1
+                continue
+            else:
+                changed_users += 1
+            written.append((user_id, values, user_id not in known_hashes))
+            known_hashes[user_id] = row_hash
+            
+            user_rows.append(values + (updated_at, row_hash))
+            
+            # 同一批中同一用户出现多次时，以最后一次的链接为准
+            links = user_links(user_data)
+            if links:
+                links_by_user[user_id] = links
         
-        for link in user_data['links']:
-            cursor.execute("""
+        history_rows = build_history_rows(conn, written, run_id, known_values) if run_id is not None else []
+        
+        if user_rows:
+            conn.executemany(UPSERT_USER_SQL, user_rows)
+        if history_rows:
+            conn.executemany(INSERT_HISTORY_SQL, history_rows)
+        
+        # 如果有链接数据，先删除旧的再插入新的
+        if links_by_user:
+            for chunk in chunked(list(links_by_user), MAX_SQL_VARIABLES):
+                placeholders = ', '.join('?' for _ in chunk)
+                conn.execute(f"DELETE FROM user_links WHERE user_id IN ({placeholders})", chunk)
+            
+            conn.executemany("""
             INSERT INTO user_links (user_id, link_type, link_url)
             VALUES (?, ?, ?)
-            """, (user_data['user_id'], link['link_type'], link['link_url']))
+            """, [
+                (user_id, link_type, link_url)
+                for user_id, links in links_by_user.items()
+                for link_type, link_url in links
+            ])
     
-    return is_new_user
+    return UpsertResult(new_users, changed_users, unchanged_users)
 
-def insert_users_array(users_data):
+def write_users_array(users_data, page_num=None, page_digest=None, run_id=None):
     """
-    将用户数据数组插入到数据库
+    在一个事务中写入用户数据，可同时记录页面摘要和历史变化
     
     参数:
-        users_data: 用户数据字典列表
+        users_data: 用户数据字典或 UserRecord 的可迭代对象
+        page_num: 可选，数据来源页码
+        page_digest: 可选，页面摘要，与用户数据在同一事务中写入 page_digests
+        run_id: 可选，采集批次，提供时记录 user_history
     
     返回:
-        tuple: (新插入用户数, 更新用户数)
+        UpsertResult: (新增用户数, 有变化的用户数, 无变化的用户数)
     """
-    # 确保数据库表已创建
+    # 确保数据库表已创建（每个进程只执行一次）
     init_db()
     
+    # 当前线程的持久连接，不需要关闭
     conn = get_db_connection()
-    new_users = 0
-    updated_users = 0
     
     try:
         # 开始事务
         conn.execute("BEGIN TRANSACTION")
         
-        for user_data in users_data:
-            is_new = insert_or_update_user(conn, user_data)
-            if is_new:
-                new_users += 1
-            else:
-                updated_users += 1
+        result = upsert_users_batch(conn, users_data, run_id=run_id)
+        # 有数据变化时更新数据版本，使查询缓存失效
+        if result.new or result.changed:
+            bump_data_version(conn)
+        if page_num is not None and page_digest is not None:
+            save_page_digest(conn, page_num, page_digest)
         
         # 提交事务
         conn.commit()
@@ -115,10 +286,21 @@ def insert_users_array(users_data):
         conn.rollback()
         print(f"数据库操作错误: {e}")
         raise
-    finally:
-        conn.close()
     
-    return (new_users, updated_users)
+    return result
+
+def insert_users_array(users_data):
+    """
+    将用户数据数组插入到数据库
+    
+    参数:
+        users_data: 用户数据字典或 UserRecord 的可迭代对象
+    
+    返回:
+        tuple: (新插入用户数, 更新用户数)，更新用户数包含内容无变化而跳过的用户
+    """
+    result = write_users_array(users_data)
+    return (result.new, result.changed + result.unchanged)
 
 if __name__ == "__main__":
     # 测试从文件读取数据并插入数据库
@@ -1,16 +1,25 @@
 import os
-import time
+import asyncio
+import argparse
 import logging
+from collections import namedtuple
 from datetime import datetime
 from pathlib import Path
 
 # 导入自定义模块
-from get_cookie import get_cookie_sync
-from get_page_total import get_page_total_sync
-from get_page_content import get_page_content_sync
-from get_users_array_from_page import extract_user_data
-from insert_users_array_to_db import insert_users_array
+from crawl_session import CrawlSession
+from fetch_backend import BACKENDS, create_backend
+from rate_limiter import RateLimiter, backoff_delay
+from get_cookie import get_cookie_with_expiry
+from cookie_cache import CookieManager, AuthenticatedSession
+from get_page_total import get_page_total
+from pipeline import CrawlPipeline, DOWNLOAD_DIR
+from page_archive import PageArchive
+from metrics import CrawlMetrics, METRICS_DIR, report_progress
+from insert_users_array_to_db import write_users_array
 from db_config import init_db
+from crawl_state import (RECENT_PAGES, CrawlJob, get_watermarks, update_watermarks, plan_incremental_pages,
+                         load_page_digests, stored_max_user_id, begin_run)
 
 # 设置日志
 def setup_logging():
@@ -29,76 +38,369 @@ def setup_logging():
     )
     return logging.getLogger('taskmonkey')
 
-def main():
-    """主程序入口"""
-    logger = setup_logging()
-    logger.info("开始执行用户数据采集")
+class CrawlConfig:
+    """采集参数"""
     
-    # 确保数据库已初始化
-    init_db()
-    logger.info("数据库初始化完成")
+    def __init__(self, concurrency=1, rate=1.0, max_in_flight=None, backend='playwright',
+                 parse_workers=1, incremental=False, recent_pages=RECENT_PAGES,
+                 resume=True, retries=3, retry_delay=1.0, refresh_cookies=False, archive=True, save_raw=False,
+                 metrics_dir=None, progress_interval=0):
+        """
+        参数:
+            concurrency: 并发抓取的 worker 数
+            rate: 每秒最多请求数，<= 0 表示不限速
+            max_in_flight: 同时进行中的请求数上限，默认等于 concurrency
+            backend: 抓取后端，'playwright' 或 'http'
+            parse_workers: 解析进程数
+            incremental: 是否只抓取可能包含新用户的页面和最近几页
+            recent_pages: 增量采集时额外抓取的最近页数
+            resume: 上次任务未完成时是否只抓取其中尚未成功的页
+            retries: 失败页在本轮结束后的最多重试轮数
+            retry_delay: 第一次重试的最大等待秒数，之后每轮翻倍（带随机抖动）
+            refresh_cookies: 是否忽略缓存的 cookie，重新获取
+            archive: 是否把抓取到的页面压缩保存到页面存档（page_archive/）
+            save_raw: 是否同时把原始HTML保存到 downloaded_page/page_N.html
+            metrics_dir: 运行摘要、Prometheus 文本文件和进度快照的目录，默认为 logs/metrics/
+            progress_interval: 每隔多少秒写一次进度快照，<= 0 表示不写
+        """
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.max_in_flight = max_in_flight or self.concurrency
+        self.backend = backend
+        self.parse_workers = max(1, parse_workers)
+        self.incremental = incremental
+        self.recent_pages = recent_pages
+        self.resume = resume
+        self.retries = max(0, retries)
+        self.retry_delay = retry_delay
+        self.refresh_cookies = refresh_cookies
+        self.archive = archive
+        self.save_raw = save_raw
+        self.metrics_dir = Path(metrics_dir) if metrics_dir else METRICS_DIR
+        self.progress_interval = progress_interval
+
+async def run_pipeline(session, page_nums, page_total, logger, concurrency=1, limiter=None, parse_workers=1,
+                       job=None, archive=None, save_dir=DOWNLOAD_DIR, run_id=None, metrics=None):
+    """
+    通过 抓取 → 解析 → 入库 流水线处理指定页码
+    
+    每个页码只会被一个抓取协程取到，入库由单个写入者串行完成，
+    因此每页只会入库一次。表格内容与上次入库时相同的页跳过解析和入库。
+    
+    参数:
+        job: 可选，CrawlJob 采集任务，记录每页的状态
+        archive: 可选，PageArchive 页面存档
+        save_dir: 原始HTML保存目录，None 表示不保存
+        run_id: 可选，采集批次，记录用户余额、会员状态等的变化历史
+        metrics: 可选，CrawlMetrics，同一次运行的多轮流水线共用
+    
+    返回:
+        CrawlPipeline: 已运行完毕的流水线（包含统计、失败页码等）
+    """
+    pipeline = CrawlPipeline(
+        session, logger,
+        concurrency=concurrency,
+        limiter=limiter,
+        parse_workers=parse_workers,
+        writer=write_users_array,
+        page_digests=load_page_digests(),
+        job=job,
+        archive=archive,
+        save_dir=save_dir,
+        run_id=run_id,
+        metrics=metrics
+    )
+    await pipeline.run(page_nums, page_total)
+    logger.info(f"流水线统计: {pipeline.stats.summary()}")
+    if pipeline.unchanged_pages:
+        logger.info(f"内容未变化而跳过的页数: {len(pipeline.unchanged_pages)}")
+    return pipeline
+
+# 采集结果：新增、有变化、未变化的用户数，以及内容未变化而跳过解析和入库的页数
+# （跳过的页中的用户不计入前三项）
+CrawlResult = namedtuple('CrawlResult', ['new_users', 'changed_users', 'unchanged_users', 'skipped_pages'])
+
+class CrawlTotals:
+    """累计多次流水线运行的用户计数、跳过的页数和最大用户ID"""
+    
+    def __init__(self):
+        self.new_users = 0
+        self.changed_users = 0
+        self.unchanged_users = 0
+        self.skipped_pages = 0
+        self.max_user_id = None
+    
+    def add(self, pipeline):
+        self.new_users += pipeline.total_new_users
+        self.changed_users += pipeline.total_changed_users
+        self.unchanged_users += pipeline.total_unchanged_users
+        self.skipped_pages += len(pipeline.unchanged_pages)
+        if pipeline.max_user_id() is not None:
+            self.max_user_id = max(self.max_user_id or 0, pipeline.max_user_id())
+    
+    def result(self):
+        return CrawlResult(self.new_users, self.changed_users, self.unchanged_users, self.skipped_pages)
+
+async def retry_failed_pages(session, job, page_total, logger, config, limiter, totals, **pipeline_options):
+    """
+    在本轮结束后重试失败的页，每次重试前按指数退避加随机抖动等待
+    
+    参数:
+        pipeline_options: 传给 run_pipeline 的其它参数（archive、save_dir、run_id、metrics）
+    
+    返回:
+        list: 重试完仍未成功的页码
+    """
+    missing = job.missing_pages()
+    for attempt in range(1, config.retries + 1):
+        if not missing:
+            break
+        delay = backoff_delay(attempt, base=config.retry_delay)
+        logger.info(f"第 {attempt}/{config.retries} 次重试 {len(missing)} 个失败页，等待 {delay:.1f} 秒: {missing}")
+        metrics = pipeline_options.get('metrics')
+        if metrics is not None:
+            metrics.retry_rounds.inc()
+            metrics.retry_pages.inc(len(missing))
+        await asyncio.sleep(delay)
+        pipeline = await run_pipeline(session, missing, page_total, logger,
+                                      config.concurrency, limiter, config.parse_workers, job, **pipeline_options)
+        totals.add(pipeline)
+        missing = job.missing_pages()
+    return missing
+
+async def crawl_until_watermark(session, page_total, total_users, logger, config, limiter, metrics=None):
+    """
+    按水位采集：全量模式抓取所有页；增量模式只抓取可能包含新用户的页和最近几页，
+    如果最后一页仍全部是新用户（新增数超出预期），继续向后抓取直到遇到已知用户。
+    
+    每页的状态记录在 crawl_jobs 表中：上次任务未完成时只抓取其中尚未成功的页；
+    失败的页在本轮结束后按指数退避重试。全部页面成功入库后更新水位并结束任务，
+    否则在日志中列出仍缺失的页码，下次运行时继续。
+    抓取到的页面默认压缩保存到页面存档中，每次运行记为一次采集（run）。
+    各轮流水线的抓取、解析、入库耗时和重试次数记录在 metrics 中。
+    
+    返回:
+        CrawlResult: (新增用户数, 有变化的用户数, 未变化的用户数, 跳过的页数)
+    """
+    watermarks = get_watermarks()
+    known_max_user_id = watermarks['max_user_id']
+    job = CrawlJob()
+    
+    page_nums = job.resume() if config.resume else []
+    resumed = bool(page_nums)
+    if resumed:
+        logger.info(f"继续上次未完成的采集任务，剩余 {len(page_nums)} 页: {page_nums}")
+    else:
+        if config.incremental:
+            last_page = plan_incremental_pages(page_total, total_users, watermarks, config.recent_pages)
+            logger.info(f"增量采集: 已知最大用户ID {known_max_user_id}, 计划抓取 {last_page}/{page_total} 页")
+        else:
+            last_page = page_total
+        page_nums = job.start(range(1, last_page + 1))
+    
+    archive = PageArchive() if config.archive else None
+    if archive is not None:
+        logger.info(f"页面存档: {archive.root}，本次采集: {archive.begin_run(page_total=page_total)}")
+    run_id = begin_run(archive.run_id if archive is not None else None)
+    pipeline_options = {'archive': archive, 'save_dir': DOWNLOAD_DIR if config.save_raw else None, 'run_id': run_id,
+                        'metrics': metrics}
+    try:
+        return await _crawl_job(session, page_nums, resumed, page_total, total_users, known_max_user_id,
+                                job, logger, config, limiter, pipeline_options)
+    finally:
+        if archive is not None:
+            archive.close()
+
+async def _crawl_job(session, page_nums, resumed, page_total, total_users, known_max_user_id,
+                     job, logger, config, limiter, pipeline_options):
+    """执行采集任务、重试失败页并更新水位，见 crawl_until_watermark"""
+    totals = CrawlTotals()
+    while True:
+        pipeline = await run_pipeline(session, page_nums, page_total, logger,
+                                      config.concurrency, limiter, config.parse_workers, job, **pipeline_options)
+        totals.add(pipeline)
+        
+        # 最后一页的最小用户ID仍大于已知水位，说明后面还有新用户
+        last_page = max(page_nums)
+        last_range = pipeline.page_user_ranges.get(last_page)
+        if (not config.incremental or known_max_user_id is None or last_page >= page_total
+                or last_range is None or last_range[0] <= known_max_user_id):
+            break
+        page_nums = list(range(last_page + 1, min(page_total, last_page + max(1, config.recent_pages)) + 1))
+        job.add_pages(page_nums)
+        logger.info(f"第 {last_page} 页仍全部是新用户，继续抓取到第 {page_nums[-1]} 页")
     
-    # 第一步：获取cookie
-    logger.info("正在获取cookie...")
-    cookies = get_cookie_sync()
+    missing = await retry_failed_pages(session, job, page_total, logger, config, limiter, totals, **pipeline_options)
+    if missing:
+        for page_num, (attempts, error) in job.failures().items():
+            logger.warning(f"第 {page_num} 页尝试 {attempts} 次仍失败: {error}")
+        logger.warning(f"有 {len(missing)} 页仍缺失，不更新采集水位，下次运行时继续: {missing}")
+        if pipeline_options.get('metrics') is not None:
+            pipeline_options['metrics'].info['missing_pages'] = missing
+    else:
+        if resumed:
+            # 上次中断前已入库的页不在本次流水线中，以数据库中的最大用户ID为准
+            totals.max_user_id = max(totals.max_user_id or 0, stored_max_user_id() or 0) or None
+        update_watermarks(totals.max_user_id, total_users)
+        job.finish()
+        logger.info(f"采集水位已更新: 最大用户ID {max(totals.max_user_id or 0, known_max_user_id or 0)}, "
+                    f"用户总数 {total_users}")
+    
+    return totals.result()
+
+async def crawl_with_session(session, cookies, logger, config, limiter, metrics=None):
+    """
+    使用已建立的抓取会话获取总页数并并发采集
+    
+    返回:
+        CrawlResult: (新增用户数, 有变化的用户数, 未变化的用户数, 跳过的页数)，获取cookie或总页数失败时返回 None
+    """
     if not cookies:
         logger.error("获取cookie失败，程序退出")
-        return
+        return None
     logger.info(f"成功获取cookie: {list(cookies.keys())}")
     
     # 第二步：获取总页数
     logger.info("正在获取总页数...")
-    page_total, total_users = get_page_total_sync(cookies)
+    page_total, total_users = await get_page_total(session=session)
     if page_total <= 0:
         logger.error("获取总页数失败，程序退出")
-        return
+        return None
     logger.info(f"用户总数: {total_users}, 总页数: {page_total}")
     
-    # 第三步：逐页获取用户数据并插入数据库
-    total_new_users = 0
-    total_updated_users = 0
+    # 第三步：并发获取用户数据并插入数据库
+    logger.info(f"并发数: {config.concurrency}, 限速: {config.rate} 次/秒")
+    if metrics is not None:
+        metrics.info.update(page_total=page_total, total_users=total_users)
+    return await crawl_until_watermark(session, page_total, total_users, logger, config, limiter, metrics)
+
+async def load_session_cookies(manager, logger, config):
+    """
+    返回本次采集使用的 cookie：缓存有效时直接复用，否则（或指定 --refresh-cookies 时）重新获取
+    """
+    if config.refresh_cookies:
+        return await manager.refresh()
+    cookies = await manager.get()
+    if manager.refresh_count == 0 and cookies:
+        logger.info(f"复用缓存的cookie，剩余有效期 {int(manager.expires_at - manager.clock())} 秒")
+    return cookies
+
+async def crawl(logger, config=None):
+    """
+    获取cookie、总页数并并发采集所有页面
+    
+    运行结束时（包括失败时）把各阶段指标写成 JSON 运行摘要和 Prometheus 文本文件，
+    设置了 progress_interval 时运行期间定期写进度快照。
+    
+    参数:
+        logger: 日志对象
+        config: CrawlConfig 采集参数，默认使用默认参数
     
-    for page_num in range(1, page_total + 1):
+    返回:
+        CrawlResult: (新增用户数, 有变化的用户数, 未变化的用户数, 跳过的页数)，获取cookie或总页数失败时返回 None
+    """
+    config = config or CrawlConfig()
+    metrics = CrawlMetrics()
+    progress = None
+    if config.progress_interval > 0:
+        progress = asyncio.create_task(report_progress(metrics, config.progress_interval, logger, config.metrics_dir))
+    result = None
+    managers = []
+    try:
+        result = await _crawl(logger, config, metrics, managers)
+    finally:
+        if progress is not None:
+            progress.cancel()
+        metrics.cookie_refreshes.set(sum(manager.refresh_count for manager in managers))
+        metrics.finish(config={key: str(value) for key, value in vars(config).items()},
+                       result=result._asdict() if result is not None else {})
         try:
-            logger.info(f"正在处理第 {page_num}/{page_total} 页...")
-            
-            # 构建页面URL
-            page_url = f"https://api.taskmonkey.ai/api/user/index?orderBy=id&page={page_num}"
-            
-            # 获取页面内容
-            save_path = Path(__file__).parent / 'downloaded_page' / f'page_{page_num}.html'
-            content = get_page_content_sync(page_url, cookies, save_path)
-            
-            if not content:
-                logger.error(f"获取第 {page_num} 页内容失败，跳过此页")
-                continue
-            
-            # 解析用户数据
-            users_data = extract_user_data(content)
-            
-            if not users_data:
-                logger.warning(f"第 {page_num} 页未提取到用户数据，跳过此页")
-                continue
-            
-            logger.info(f"第 {page_num} 页提取到 {len(users_data)} 条用户数据")
-            
-            # 插入到数据库
-            new_users, updated_users = insert_users_array(users_data)
-            total_new_users += new_users
-            total_updated_users += updated_users
-            
-            logger.info(f"第 {page_num} 页处理完成，新增用户: {new_users}, 更新用户: {updated_users}")
-            
-            # 添加延时防止请求过快
-            time.sleep(1)
-            
-        except Exception as e:
-            logger.error(f"处理第 {page_num} 页时出错: {e}")
-            continue
+            summary_file, prometheus_file = metrics.write(config.metrics_dir)
+            logger.info(f"运行指标: {metrics.progress_line()}")
+            logger.info(f"运行摘要已写入: {summary_file}, Prometheus 指标: {prometheus_file}")
+        except OSError as e:
+            logger.error(f"写入运行指标失败: {e}")
+    return result
+
+async def _crawl(logger, config, metrics, managers):
+    """见 crawl；managers 收集本次使用的 CookieManager，用于统计刷新次数"""
+    limiter = RateLimiter(rate=config.rate, max_in_flight=config.max_in_flight)
+    
+    # 第一步：获取cookie（磁盘缓存有效时不访问站点）
+    logger.info(f"正在获取cookie... (抓取后端: {config.backend})")
+    if config.backend == 'playwright':
+        # 整个爬取过程只启动一次浏览器，页面池大小与并发数一致，cookie 过期时在同一个浏览器中刷新
+        async with CrawlSession(max_pages=config.concurrency) as browser:
+            manager = CookieManager(bootstrap=lambda: get_cookie_with_expiry(browser))
+            managers.append(manager)
+            cookies = await load_session_cookies(manager, logger, config)
+            if cookies:
+                await browser.set_cookies(cookies)
+            session = AuthenticatedSession(browser, manager)
+            return await crawl_with_session(session, cookies, logger, config, limiter, metrics)
+    
+    # 只在缓存的 cookie 不可用时才临时启动浏览器，页面通过其它后端抓取
+    manager = CookieManager()
+    managers.append(manager)
+    cookies = await load_session_cookies(manager, logger, config)
+    async with create_backend(config.backend, cookies, config.concurrency) as backend:
+        session = AuthenticatedSession(backend, manager)
+        return await crawl_with_session(session, cookies, logger, config, limiter, metrics)
+
+def main(**options):
+    """
+    主程序入口
+    
+    参数:
+        options: 采集参数，见 CrawlConfig
+    """
+    logger = setup_logging()
+    logger.info("开始执行用户数据采集")
+    
+    # 确保数据库已初始化
+    init_db()
+    logger.info("数据库初始化完成")
+    
+    result = asyncio.run(crawl(logger, CrawlConfig(**options)))
+    if result is None:
+        return
+    total_new_users, total_changed_users, total_unchanged_users, skipped_pages = result
     
     logger.info("用户数据采集完成!")
-    logger.info(f"总共处理用户数: {total_new_users + total_updated_users}")
-    logger.info(f"新增用户: {total_new_users}, 更新用户: {total_updated_users}")
+    logger.info(f"总共处理用户数: {total_new_users + total_changed_users + total_unchanged_users}")
+    logger.info(f"新增用户: {total_new_users}, 变化用户: {total_changed_users}, 未变化用户: {total_unchanged_users}")
+    logger.info(f"内容未变化而跳过的页数: {skipped_pages}（其中的用户未计入上述用户数）")
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='TaskMonkey 用户数据采集')
+    parser.add_argument('--concurrency', type=int, default=1, help='并发抓取的 worker 数')
+    parser.add_argument('--rate', type=float, default=1.0, help='每秒最多请求数，<= 0 表示不限速')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='同时进行中的请求数上限，默认等于并发数')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='playwright',
+                        help='抓取后端：playwright 使用无头浏览器，http 直接发送 HTTP 请求')
+    parser.add_argument('--parse-workers', type=int, default=1, help='解析HTML的进程数')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量采集：只抓取可能包含新用户的页和最近几页')
+    parser.add_argument('--recent-pages', type=int, default=RECENT_PAGES,
+                        help='增量采集时额外抓取的最近页数')
+    parser.add_argument('--no-resume', dest='resume', action='store_false',
+                        help='忽略上次未完成的采集任务，重新开始')
+    parser.add_argument('--retries', type=int, default=3, help='失败页的最多重试轮数')
+    parser.add_argument('--retry-delay', type=float, default=1.0,
+                        help='第一次重试的最大等待秒数，之后每轮翻倍')
+    parser.add_argument('--refresh-cookies', action='store_true',
+                        help='忽略缓存的cookie，重新获取')
+    parser.add_argument('--no-archive', dest='archive', action='store_false',
+                        help='不把页面压缩保存到页面存档')
+    parser.add_argument('--save-raw', action='store_true',
+                        help='同时把原始HTML保存到 downloaded_page/page_N.html')
+    parser.add_argument('--metrics-dir', default=None,
+                        help='运行摘要和 Prometheus 指标文件的目录，默认为 logs/metrics/')
+    parser.add_argument('--progress-interval', type=float, default=0,
+                        help='每隔多少秒写一次进度快照（progress.json），0 表示不写')
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    args = parse_args()
+    main(**vars(args)) 
\ No newline at end of file
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from pathlib import Path
+
+# 指标文件默认目录：运行摘要 run_*.json、Prometheus 文本文件和进度快照
+METRICS_DIR = Path(__file__).parent / 'logs' / 'metrics'
+
+# Prometheus textfile collector 读取的文件名（每次运行结束时覆盖）
+PROMETHEUS_FILE = 'taskmonkey.prom'
+
+# 进度快照文件名
+PROGRESS_FILE = 'progress.json'
+
+# 指标名前缀
+PREFIX = 'taskmonkey_'
+
+# 耗时直方图的桶上限（秒）
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# 页面大小直方图的桶上限（字节）
+BYTES_BUCKETS = (1024, 4096, 16384, 32768, 65536, 131072, 262144, 524288, 1048576, 4194304)
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """只增不减的计数器"""
+
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {_format_value(self.value)}"
+
+class Gauge(Counter):
+    """可以任意设置的当前值"""
+
+    kind = 'gauge'
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+class Histogram:
+    """
+    固定桶的直方图：各桶计数、总和、条数和最大值
+
+    分位数由桶边界线性插值估算，精度取决于桶的划分
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """估算分位数 q（0-1），没有数据时返回 None"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                if count and seen + count >= rank:
+                    lower = self.buckets[index - 1] if index > 0 else 0.0
+                    upper = self.buckets[index] if index < len(self.buckets) else self.max
+                    return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+                seen += count
+            return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            yield f"{name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {cumulative}"
+        yield f"{name}_sum{_format_labels(labels)} {_format_value(total)}"
+        yield f"{name}_count{_format_labels(labels)} {count}"
+
+class MetricsRegistry:
+    """
+    指标注册表：按 (名称, 标签) 保存计数器、仪表和直方图，可导出为字典或 Prometheus 文本格式
+
+    各指标内部有锁，可以在事件循环、写入线程等多个线程中同时更新
+    """
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(**kwargs)
+                self._help.setdefault(name, (help_text, cls.kind))
+            return metric
+
+    def counter(self, name, help_text='', labels=None):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', labels=None):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text='', labels=None, buckets=SECONDS_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def snapshot(self):
+        """
+        返回所有指标的当前值
+
+        返回:
+            dict: {名称: 值}，带标签的指标为 {名称: {"标签=值,...": 值}}
+        """
+        with self._lock:
+            items = list(self._metrics.items())
+        result = {}
+        for (name, labels), metric in sorted(items, key=lambda item: item[0]):
+            if labels:
+                result.setdefault(name, {})[','.join(f'{key}={value}' for key, value in labels)] = metric.snapshot()
+            else:
+                result[name] = metric.snapshot()
+        return result
+
+    def to_prometheus(self):
+        """返回 Prometheus 文本格式（textfile collector 可直接读取）"""
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: item[0])
+            help_texts = dict(self._help)
+        lines = []
+        described = set()
+        for (name, labels), metric in items:
+            full_name = self.prefix + name
+            if name not in described:
+                help_text, kind = help_texts[name]
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                described.add(name)
+            lines.extend(metric.samples(full_name, labels))
+        return '\n'.join(lines) + '\n'
+
+def write_atomic(path, text):
+    """先写临时文件再替换，读取方（如 node_exporter）不会读到写了一半的文件"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+class CrawlMetrics:
+    """
+    一次采集运行的各阶段指标
+
+    抓取：单页耗时、页面字节数、成功/失败页数；解析：单页解析耗时（在解析进程中计时）、用户数；
+    入库：单页写入耗时（在写入线程中计时）、新增/变化/未变化行数；以及重试轮数、重试页数和 cookie 刷新次数。
+
+    用法:
+        metrics = CrawlMetrics()
+        pipeline = CrawlPipeline(session, logger, metrics=metrics)
+        ...
+        metrics.finish(result)
+        metrics.write(METRICS_DIR)
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.finished_at = None
+        self.info = {}
+        registry = self.registry
+        self.fetch_seconds = registry.histogram('fetch_seconds', '抓取单页耗时（秒）')
+        self.page_bytes = registry.histogram('page_bytes', '抓取到的页面大小（字节）', buckets=BYTES_BUCKETS)
+        self.pages_fetched = registry.counter('pages_fetched_total', '抓取成功的页数')
+        self.fetch_errors = registry.counter('fetch_errors_total', '抓取失败的页数')
+        self.pages_unchanged = registry.counter('pages_unchanged_total', '内容未变化、跳过解析和入库的页数')
+        self.parse_seconds = registry.histogram('parse_seconds', '解析单页耗时（秒）')
+        self.users_parsed = registry.counter('users_parsed_total', '解析出的用户数')
+        self.parse_errors = registry.counter('parse_errors_total', '解析失败或未提取到用户的页数')
+        self.upsert_seconds = registry.histogram('upsert_seconds', '单页入库事务耗时（秒）')
+        self.rows_written = {
+            result: registry.counter('rows_written_total', '入库的用户行数', {'result': result})
+            for result in ('new', 'changed', 'unchanged')
+        }
+        self.write_errors = registry.counter('write_errors_total', '入库失败的页数')
+        self.retry_rounds = registry.counter('retry_rounds_total', '失败页的重试轮数')
+        self.retry_pages = registry.counter('retry_pages_total', '重试的页数（每轮累计）')
+        self.cookie_refreshes = registry.gauge('cookie_refreshes', '本次运行中刷新 cookie 的次数')
+        self.run_seconds = registry.gauge('run_duration_seconds', '本次运行耗时（秒）')
+        self.last_run = registry.gauge('last_run_timestamp_seconds', '最近一次运行结束的时间戳')
+
+    def record_rows(self, new_users, changed_users, unchanged_users):
+        self.rows_written['new'].inc(new_users)
+        self.rows_written['changed'].inc(changed_users)
+        self.rows_written['unchanged'].inc(unchanged_users)
+
+    def elapsed(self):
+        if self.finished_at is not None:
+            return self.finished_at - self.started_at
+        return time.monotonic() - self._started
+
+    def finish(self, **info):
+        """
+        标记运行结束
+
+        参数:
+            info: 写入运行摘要的附加信息（例如采集参数、结果、缺失页码）
+        """
+        self.info.update(info)
+        elapsed = time.monotonic() - self._started
+        self.finished_at = self.started_at + elapsed
+        self.run_seconds.set(round(elapsed, 3))
+        self.last_run.set(round(self.finished_at, 3))
+
+    def summary(self):
+        """
+        返回运行摘要：各指标的值以及每秒页数、每秒行数、平均每页字节数等派生值
+        """
+        elapsed = self.elapsed()
+        rows = sum(counter.value for counter in self.rows_written.values())
+        pages = self.pages_fetched.value
+        return {
+            'started_at': datetime.fromtimestamp(self.started_at).strftime('%Y-%m-%d %H:%M:%S'),
+            'finished_at': (datetime.fromtimestamp(self.finished_at).strftime('%Y-%m-%d %H:%M:%S')
+                            if self.finished_at is not None else None),
+            'elapsed_seconds': round(elapsed, 3),
+            'pages_per_second': round(pages / elapsed, 3) if elapsed > 0 else 0.0,
+            'rows_per_second': round(rows / elapsed, 3) if elapsed > 0 else 0.0,
+            'bytes_per_page': round(self.page_bytes.sum / pages, 1) if pages else 0.0,
+            'info': self.info,
+            'metrics': self.registry.snapshot(),
+        }
+
+    def progress_line(self):
+        """返回便于写入日志的一行进度"""
+        summary = self.summary()
+        fetch = self.fetch_seconds.snapshot()
+        return (f"已抓取 {self.pages_fetched.value} 页（失败 {self.fetch_errors.value}），"
+                f"入库 {sum(counter.value for counter in self.rows_written.values())} 行，"
+                f"{summary['pages_per_second']} 页/秒，{summary['rows_per_second']} 行/秒，"
+                f"抓取 p95 {fetch['p95'] or 0:.3f} 秒")
+
+    def write(self, metrics_dir=None):
+        """
+        写出 JSON 运行摘要和 Prometheus 文本文件
+
+        参数:
+            metrics_dir: 输出目录，默认为 METRICS_DIR
+
+        返回:
+            tuple: (运行摘要路径, Prometheus 文件路径)
+        """
+        metrics_dir = Path(metrics_dir or METRICS_DIR)
+        timestamp = datetime.fromtimestamp(self.started_at).strftime('%Y%m%d_%H%M%S')
+        summary_file = metrics_dir / f"run_{timestamp}.json"
+        prometheus_file = metrics_dir / PROMETHEUS_FILE
+        write_atomic(summary_file, json.dumps(self.summary(), ensure_ascii=False, indent=2, default=str))
+        write_atomic(prometheus_file, self.registry.to_prometheus())
+        return summary_file, prometheus_file
+
+    def write_progress(self, metrics_dir=None):
+        """写出当前进度快照（覆盖 progress.json）"""
+        path = Path(metrics_dir or METRICS_DIR) / PROGRESS_FILE
+        write_atomic(path, json.dumps(self.summary(), ensure_ascii=False, indent=2, default=str))
+        return path
+
+async def report_progress(metrics, interval, logger, metrics_dir=None):
+    """
+    每 interval 秒写一次进度快照并记录一行日志，直到被取消
+
+    用法:
+        task = asyncio.create_task(report_progress(metrics, 30, logger))
+        ...
+        task.cancel()
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            metrics.write_progress(metrics_dir)
+        except OSError as e:
+            logger.error(f"写入进度快照失败: {e}")
+        logger.info(f"进度: {metrics.progress_line()}")
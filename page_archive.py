@@ -0,0 +1,287 @@
+import os
+import gzip
+import sqlite3
+import hashlib
+import threading
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+# 页面存档默认目录
+ARCHIVE_DIR = Path(__file__).parent / 'page_archive'
+
+def _zstd_codec():
+    """zstd 压缩函数，需要安装 zstandard，未安装时返回 None"""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return (lambda data: zstandard.ZstdCompressor(level=10).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+# 压缩格式：扩展名 -> (压缩函数, 解压函数)
+CODECS = {
+    'gz': (lambda data: gzip.compress(data, compresslevel=6, mtime=0), gzip.decompress),
+}
+if _zstd_codec() is not None:
+    CODECS['zst'] = _zstd_codec()
+
+# 默认压缩格式：安装了 zstandard 时使用 zstd，否则使用 gzip
+DEFAULT_CODEC = 'zst' if 'zst' in CODECS else 'gz'
+
+def blob_hash(data):
+    """内容地址：原始字节的 blake2b 摘要"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def split_page(content):
+    """
+    把页面拆成头部（<tbody> 之前的脚本和样式）和表格两部分
+
+    同一次采集中各页的头部完全相同，单独存储后只占一份空间
+    """
+    index = content.find('<tbody')
+    if index < 0:
+        return '', content
+    return content[:index], content[index:]
+
+def _blob_path(root, digest, ext):
+    return Path(root) / 'objects' / digest[:2] / f"{digest}.{ext}"
+
+def read_blob(root, digest):
+    """
+    按摘要读取并解压一个数据块（可在子进程中调用，不需要打开索引）
+
+    返回:
+        bytes: 原始数据
+    """
+    for ext, (compress, decompress) in CODECS.items():
+        path = _blob_path(root, digest, ext)
+        if path.exists():
+            return decompress(path.read_bytes())
+    raise KeyError(f"存档中没有数据块: {digest}")
+
+def read_snapshot(root, head_hash, body_hash):
+    """按头部和表格两个数据块的摘要还原页面HTML"""
+    return (read_blob(root, head_hash) + read_blob(root, body_hash)).decode('utf-8')
+
+class PageArchive:
+    """
+    压缩、去重的页面存档
+
+    页面按内容寻址存储在 objects/ 下（相同内容只存一份），index.db 记录
+    每次采集（run）每一页对应的数据块，可以保留任意多次采集的历史。
+
+    用法:
+        archive = PageArchive()
+        run_id = archive.begin_run()
+        archive.save_page(page_num, content)
+        content = archive.load_page(run_id, page_num)
+    """
+
+    def __init__(self, root=None, codec=None):
+        """
+        参数:
+            root: 存档目录，默认为 ARCHIVE_DIR
+            codec: 压缩格式（'gz' 或 'zst'），默认为 DEFAULT_CODEC
+        """
+        self.root = Path(root or ARCHIVE_DIR)
+        self.codec = codec or DEFAULT_CODEC
+        if self.codec not in CODECS:
+            raise ValueError(f"不支持的压缩格式: {self.codec}，可选: {', '.join(CODECS)}（zst 需要 pip install zstandard）")
+        self.run_id = None
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        # 抓取协程在多个线程中保存页面，连接由锁保护
+        self._conn = sqlite3.connect(self.root / 'index.db', check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            started_at TIMESTAMP NOT NULL,
+            page_total INTEGER
+        )
+        """)
+        # 旧版本的索引没有 page_total 列
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(runs)")]
+        if 'page_total' not in columns:
+            self._conn.execute("ALTER TABLE runs ADD COLUMN page_total INTEGER")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS snapshots (
+            run_id TEXT NOT NULL,
+            page_num INTEGER NOT NULL,
+            head_hash TEXT NOT NULL,
+            body_hash TEXT NOT NULL,
+            raw_size INTEGER NOT NULL,
+            fetched_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (run_id, page_num)
+        )
+        """)
+        self._conn.commit()
+
+    def close(self):
+        """关闭索引连接"""
+        self._conn.close()
+
+    def begin_run(self, run_id=None, page_total=None):
+        """
+        开始一次新的采集，之后保存的页面都记在这次采集下
+
+        参数:
+            run_id: 可选，默认为当前时间
+            page_total: 可选，站点当时的总页数；记录后 latest_run 才能判断这次采集是否覆盖了全部页面
+
+        返回:
+            str: run_id
+        """
+        run_id = run_id or datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO runs (run_id, started_at) VALUES (?, ?)",
+                               (run_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            if page_total is not None:
+                self._conn.execute("UPDATE runs SET page_total = ? WHERE run_id = ?", (page_total, run_id))
+            self._conn.commit()
+        self.run_id = run_id
+        return run_id
+
+    def put_blob(self, data):
+        """
+        存储一个数据块，已存在时不重复写入
+
+        返回:
+            str: 数据块摘要
+        """
+        digest = blob_hash(data)
+        if any(_blob_path(self.root, digest, ext).exists() for ext in CODECS):
+            return digest
+        path = _blob_path(self.root, digest, self.codec)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再改名，避免并发写入或中断留下不完整的文件
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(CODECS[self.codec][0](data))
+        os.replace(tmp_path, path)
+        return digest
+
+    def save_page(self, page_num, content, run_id=None):
+        """
+        保存一页到当前（或指定）采集
+
+        参数:
+            page_num: 页码
+            content: 页面HTML
+            run_id: 可选，默认为 begin_run 返回的 run_id
+        """
+        run_id = run_id or self.run_id or self.begin_run()
+        head, body = split_page(content)
+        head_hash = self.put_blob(head.encode('utf-8'))
+        body_hash = self.put_blob(body.encode('utf-8'))
+        with self._lock:
+            self._conn.execute("""
+            INSERT OR REPLACE INTO snapshots (run_id, page_num, head_hash, body_hash, raw_size, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, (run_id, page_num, head_hash, body_hash, len(content.encode('utf-8')),
+                  datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            self._conn.commit()
+
+    def runs(self):
+        """返回所有采集的 run_id（从旧到新）"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT run_id FROM runs ORDER BY started_at, run_id")]
+
+    def latest_run(self, complete=True):
+        """
+        返回最近一次采集，没有时返回 None
+
+        参数:
+            complete: 为 True 时只考虑记录了总页数且第 1 到 page_total 页都已保存的采集
+                （增量、续跑或中途失败的采集只包含部分页面，会被跳过）；为 False 时返回最近一次有页面的采集
+        """
+        if complete:
+            sql = """
+            SELECT runs.run_id FROM runs
+            WHERE runs.page_total > 0 AND runs.page_total = (
+                SELECT COUNT(*) FROM snapshots
+                WHERE snapshots.run_id = runs.run_id AND snapshots.page_num BETWEEN 1 AND runs.page_total
+            )
+            ORDER BY runs.started_at DESC, runs.run_id DESC LIMIT 1
+            """
+        else:
+            sql = """
+            SELECT runs.run_id FROM runs JOIN snapshots ON snapshots.run_id = runs.run_id
+            ORDER BY runs.started_at DESC, runs.run_id DESC LIMIT 1
+            """
+        with self._lock:
+            row = self._conn.execute(sql).fetchone()
+        return row[0] if row else None
+
+    def snapshots(self, run_id):
+        """
+        返回某次采集的页面索引
+
+        返回:
+            list: [(页码, 头部摘要, 表格摘要), ...]，按页码排序
+        """
+        with self._lock:
+            return [tuple(row) for row in self._conn.execute(
+                "SELECT page_num, head_hash, body_hash FROM snapshots WHERE run_id = ? ORDER BY page_num",
+                (run_id,)
+            )]
+
+    def load_page(self, run_id, page_num):
+        """
+        读取某次采集的某一页
+
+        返回:
+            str: 页面HTML，没有该页时返回 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT head_hash, body_hash FROM snapshots WHERE run_id = ? AND page_num = ?", (run_id, page_num)
+            ).fetchone()
+        return read_snapshot(self.root, row[0], row[1]) if row else None
+
+    def iter_run(self, run_id):
+        """依次生成某次采集的 (页码, 页面HTML)"""
+        for page_num, head_hash, body_hash in self.snapshots(run_id):
+            yield page_num, read_snapshot(self.root, head_hash, body_hash)
+
+    def stats(self):
+        """
+        返回存档的空间占用统计
+
+        返回:
+            dict: 采集次数、页面快照数、数据块数、原始字节数、实际占用字节数、压缩比
+        """
+        with self._lock:
+            runs, snapshots, raw_bytes = self._conn.execute("""
+            SELECT (SELECT COUNT(*) FROM runs), COUNT(*), COALESCE(SUM(raw_size), 0) FROM snapshots
+            """).fetchone()
+        blobs = [path for path in (self.root / 'objects').glob('*/*') if not path.name.endswith('.tmp')]
+        stored_bytes = sum(path.stat().st_size for path in blobs)
+        return {
+            'runs': runs,
+            'snapshots': snapshots,
+            'blobs': len(blobs),
+            'raw_bytes': raw_bytes,
+            'stored_bytes': stored_bytes,
+            'ratio': round(raw_bytes / stored_bytes, 1) if stored_bytes else 0.0,
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='查看页面存档')
+    parser.add_argument('--root', default=None, help='存档目录，默认为 page_archive/')
+    parser.add_argument('--run', default=None, help='列出某次采集的页码')
+    args = parser.parse_args()
+
+    archive = PageArchive(args.root)
+    try:
+        if args.run:
+            print(f"采集 {args.run} 的页码: {[page_num for page_num, _, _ in archive.snapshots(args.run)]}")
+        else:
+            stats = archive.stats()
+            print(f"采集次数: {stats['runs']}, 页面快照: {stats['snapshots']}, 数据块: {stats['blobs']}")
+            print(f"原始大小: {stats['raw_bytes'] / 1024:.1f} KB, 实际占用: {stats['stored_bytes'] / 1024:.1f} KB, "
+                  f"压缩比: {stats['ratio']}x")
+            for run_id in archive.runs():
+                print(f"  {run_id}")
+    finally:
+        archive.close()
@@ -0,0 +1,407 @@
+import asyncio
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from crawl_session import build_page_url
+from get_users_array_from_page import extract_user_records
+from insert_users_array_to_db import write_users_array
+from crawl_state import page_digest
+from metrics import CrawlMetrics
+from user_record import user_id_of
+
+# 页面保存目录
+DOWNLOAD_DIR = Path(__file__).parent / 'downloaded_page'
+
+# 结束信号
+_DONE = object()
+
+def _timed_call(func, *args):
+    """在执行器（解析进程或写入线程）中计时调用，只统计执行本身，不含排队等待"""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+class StageStats:
+    """单个阶段的计数器：处理条数、出错数、忙碌时间"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    def snapshot(self, elapsed):
+        """
+        返回当前计数的字典
+
+        参数:
+            elapsed: 流水线已运行的秒数，用于计算吞吐量
+        """
+        return {
+            'items': self.items,
+            'errors': self.errors,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'throughput': round(self.items / elapsed, 3) if elapsed > 0 else 0.0,
+        }
+
+class QueueStats:
+    """队列深度计数器：当前深度和运行期间出现过的最大深度"""
+
+    def __init__(self, name, queue):
+        self.name = name
+        self.queue = queue
+        self.max_depth = 0
+
+    def record(self):
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def snapshot(self):
+        return {
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'capacity': self.queue.maxsize,
+        }
+
+class PipelineStats:
+    """流水线整体统计，包含各阶段吞吐量和各队列深度"""
+
+    def __init__(self):
+        self.started_at = None
+        self.finished_at = None
+        self.stages = {name: StageStats(name) for name in ('fetch', 'parse', 'write')}
+        self.queues = {}
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def snapshot(self):
+        """
+        返回可序列化的统计快照
+
+        返回:
+            dict: {'elapsed': 秒, 'stages': {...}, 'queues': {...}}
+        """
+        elapsed = self.elapsed()
+        return {
+            'elapsed': round(elapsed, 3),
+            'stages': {name: stage.snapshot(elapsed) for name, stage in self.stages.items()},
+            'queues': {name: queue.snapshot() for name, queue in self.queues.items()},
+        }
+
+    def summary(self):
+        """返回便于写入日志的一行统计文本"""
+        snapshot = self.snapshot()
+        stages = ', '.join(
+            f"{name}: {stage['items']} 条 / {stage['throughput']} 条每秒 / 忙碌 {stage['busy_seconds']} 秒"
+            for name, stage in snapshot['stages'].items()
+        )
+        queues = ', '.join(
+            f"{name} 最大深度 {queue['max_depth']}/{queue['capacity']}"
+            for name, queue in snapshot['queues'].items()
+        )
+        return f"耗时 {snapshot['elapsed']} 秒; {stages}; {queues}"
+
+class CrawlPipeline:
+    """
+    抓取 → 解析 → 入库 三阶段流水线
+
+    各阶段之间使用有界队列连接，下游处理不过来时上游会被阻塞（背压）:
+        - 抓取：concurrency 个协程并发抓取，受 limiter 限速
+        - 解析：parse_workers 个协程把 HTML 交给进程池解析
+        - 入库：单个写入协程在专用线程中串行写数据库
+
+    用法:
+        pipeline = CrawlPipeline(session, logger, concurrency=4)
+        new_users, changed_users, unchanged_users = await pipeline.run(range(1, page_total + 1), page_total)
+        print(pipeline.stats.snapshot())
+    """
+
+    def __init__(self, session, logger, concurrency=1, limiter=None, parse_workers=1,
+                 queue_size=None, parser=extract_user_records, writer=write_users_array,
+                 parse_executor=None, save_dir=DOWNLOAD_DIR, page_digests=None, job=None, archive=None,
+                 run_id=None, metrics=None):
+        """
+        参数:
+            session: 抓取会话（CrawlSession 或 FetchBackend）
+            logger: 日志对象
+            concurrency: 并发抓取的协程数
+            limiter: 可选，RateLimiter 全局限速器
+            parse_workers: 解析进程数
+            queue_size: 队列容量，默认为 concurrency 的两倍
+            parser: 解析函数，需可被 pickle（在子进程中执行）；默认返回 UserRecord 列表，
+                从解析进程传回主进程时比字典列表小得多
+            writer: 入库函数，接收用户数据列表（字典或 UserRecord）和 page_num、page_digest、run_id 关键字参数，
+                返回 (新增数, 变化数, 未变化数)
+            parse_executor: 可选，自定义解析用的 executor
+            save_dir: 页面保存目录，None 表示不保存
+            page_digests: 可选，上次成功入库的 {页码: 页面摘要}，摘要相同的页跳过解析和入库
+            job: 可选，CrawlJob 采集任务，每页成功或失败后在写入线程中记录状态
+            archive: 可选，PageArchive 页面存档，抓取成功的页面压缩保存到当前采集下
+            run_id: 可选，crawl_runs 中的采集批次，传给 writer 用于记录用户历史
+            metrics: 可选，CrawlMetrics，多次运行（如失败重试）共用时传入同一个对象
+        """
+        self.session = session
+        self.logger = logger
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter
+        self.parse_workers = max(1, parse_workers)
+        self.queue_size = queue_size or self.concurrency * 2
+        self.parser = parser
+        self.writer = writer
+        self.parse_executor = parse_executor
+        self.save_dir = save_dir
+        self.page_digests = page_digests
+        self.job = job
+        self.archive = archive
+        self.run_id = run_id
+        self._write_executor = None
+        self.stats = PipelineStats()
+        self.metrics = metrics or CrawlMetrics()
+        self.total_new_users = 0
+        self.total_changed_users = 0
+        self.total_unchanged_users = 0
+        # 摘要与上次相同、跳过解析和入库的页码
+        self.unchanged_pages = set()
+        # 每页解析出的 (最小, 最大) user_id，用于增量采集判断水位
+        self.page_user_ranges = {}
+        # 抓取、解析或入库失败的页码
+        self.failed_pages = set()
+
+    async def _record_job(self, name, *args):
+        # 任务状态与用户数据一样由单个写入线程写入数据库
+        if self.job is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._write_executor, getattr(self.job, name), *args)
+        except Exception as e:
+            self.logger.error(f"记录第 {args[0]} 页采集状态时出错: {e}")
+
+    async def _archive_page(self, page_num, content):
+        # 压缩和写文件放到线程池中，存档失败不影响入库
+        if self.archive is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.archive.save_page, page_num, content)
+        except Exception as e:
+            self.logger.error(f"存档第 {page_num} 页时出错: {e}")
+
+    async def _page_failed(self, page_num, error):
+        self.failed_pages.add(page_num)
+        await self._record_job('mark_failed', page_num, error)
+
+    async def _page_done(self, page_num):
+        self.failed_pages.discard(page_num)
+        await self._record_job('mark_done', page_num)
+
+    async def _fetch_page(self, page_num):
+        page_url = build_page_url(page_num)
+        save_path = self.save_dir / f'page_{page_num}.html' if self.save_dir else None
+        if self.limiter is not None:
+            async with self.limiter:
+                return await self._timed_fetch(page_url, save_path)
+        return await self._timed_fetch(page_url, save_path)
+
+    async def _timed_fetch(self, page_url, save_path):
+        # 只统计请求本身的耗时，不含等待限速器的时间
+        started = time.monotonic()
+        try:
+            return await self.session.fetch(page_url, save_to_file=save_path)
+        finally:
+            self.metrics.fetch_seconds.observe(time.monotonic() - started)
+
+    async def _fetch_worker(self, page_queue, parse_queue, page_total):
+        stage = self.stats.stages['fetch']
+        while True:
+            try:
+                page_num = page_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            self.logger.info(f"正在处理第 {page_num}/{page_total} 页...")
+            started = time.monotonic()
+            try:
+                content = await self._fetch_page(page_num)
+            except Exception as e:
+                stage.errors += 1
+                self.metrics.fetch_errors.inc()
+                self.logger.error(f"处理第 {page_num} 页时出错: {e}")
+                await self._page_failed(page_num, e)
+                continue
+            finally:
+                stage.busy_seconds += time.monotonic() - started
+
+            if not content:
+                stage.errors += 1
+                self.metrics.fetch_errors.inc()
+                self.logger.error(f"获取第 {page_num} 页内容失败，跳过此页")
+                await self._page_failed(page_num, "获取页面内容失败")
+                continue
+
+            stage.items += 1
+            self.metrics.pages_fetched.inc()
+            self.metrics.page_bytes.observe(len(content.encode('utf-8')))
+            await self._archive_page(page_num, content)
+            digest = page_digest(content)
+            if self.page_digests is not None and self.page_digests.get(page_num) == digest:
+                self.unchanged_pages.add(page_num)
+                self.metrics.pages_unchanged.inc()
+                self.logger.info(f"第 {page_num} 页内容与上次相同，跳过解析和入库")
+                await self._page_done(page_num)
+                continue
+            await parse_queue.put((page_num, content, digest))
+            self.stats.queues['parse'].record()
+
+    async def _parse_worker(self, parse_queue, write_queue, executor):
+        stage = self.stats.stages['parse']
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await parse_queue.get()
+            if item is _DONE:
+                return
+
+            page_num, content, digest = item
+            started = time.monotonic()
+            try:
+                users_data, seconds = await loop.run_in_executor(executor, _timed_call, self.parser, content)
+            except Exception as e:
+                stage.errors += 1
+                self.metrics.parse_errors.inc()
+                self.logger.error(f"处理第 {page_num} 页时出错: {e}")
+                await self._page_failed(page_num, e)
+                continue
+            finally:
+                stage.busy_seconds += time.monotonic() - started
+
+            self.metrics.parse_seconds.observe(seconds)
+            if not users_data:
+                self.metrics.parse_errors.inc()
+                self.logger.warning(f"第 {page_num} 页未提取到用户数据，跳过此页")
+                await self._page_failed(page_num, "未提取到用户数据")
+                continue
+
+            stage.items += 1
+            self.metrics.users_parsed.inc(len(users_data))
+            user_ids = [user_id_of(user_data) for user_data in users_data]
+            self.page_user_ranges[page_num] = (min(user_ids), max(user_ids))
+            self.logger.info(f"第 {page_num} 页提取到 {len(users_data)} 条用户数据")
+            await write_queue.put((page_num, users_data, digest))
+            self.stats.queues['write'].record()
+
+    async def _write_worker(self, write_queue, executor):
+        stage = self.stats.stages['write']
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await write_queue.get()
+            if item is _DONE:
+                return
+
+            page_num, users_data, digest = item
+            started = time.monotonic()
+            try:
+                write = partial(self.writer, users_data, page_num=page_num, page_digest=digest, run_id=self.run_id)
+                (new_users, changed_users, unchanged_users), seconds = await loop.run_in_executor(
+                    executor, _timed_call, write)
+            except Exception as e:
+                stage.errors += 1
+                self.metrics.write_errors.inc()
+                self.logger.error(f"处理第 {page_num} 页时出错: {e}")
+                await self._page_failed(page_num, e)
+                continue
+            finally:
+                stage.busy_seconds += time.monotonic() - started
+
+            stage.items += 1
+            self.metrics.upsert_seconds.observe(seconds)
+            self.metrics.record_rows(new_users, changed_users, unchanged_users)
+            await self._page_done(page_num)
+            self.total_new_users += new_users
+            self.total_changed_users += changed_users
+            self.total_unchanged_users += unchanged_users
+            self.logger.info(f"第 {page_num} 页处理完成，新增用户: {new_users}, "
+                             f"变化用户: {changed_users}, 未变化用户: {unchanged_users}")
+
+    @property
+    def total_updated_users(self):
+        """已存在的用户数（有变化和未变化之和）"""
+        return self.total_changed_users + self.total_unchanged_users
+
+    def max_user_id(self):
+        """本次运行中成功解析的最大 user_id，没有时返回 None"""
+        if not self.page_user_ranges:
+            return None
+        return max(high for low, high in self.page_user_ranges.values())
+
+    async def _drain(self, fetchers, parsers, writer, parse_queue, write_queue):
+        # 抓取结束后依次通知解析和写入协程退出
+        await asyncio.gather(*fetchers)
+        for _ in parsers:
+            await parse_queue.put(_DONE)
+        await asyncio.gather(*parsers)
+        await write_queue.put(_DONE)
+        await writer
+
+    async def run(self, page_nums, page_total):
+        """
+        运行流水线直到所有页面处理完毕
+
+        任一抓取、解析或写入协程意外退出（逐页错误之外的异常）时，立即取消其余协程并抛出该异常，
+        避免其它协程阻塞在已满的队列上导致采集挂起
+
+        参数:
+            page_nums: 要抓取的页码序列
+            page_total: 总页数（用于日志）
+
+        返回:
+            tuple: (新增用户数, 有变化的用户数, 未变化的用户数)
+        """
+        page_queue = asyncio.Queue()
+        for page_num in page_nums:
+            page_queue.put_nowait(page_num)
+        parse_queue = asyncio.Queue(maxsize=self.queue_size)
+        write_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.stats.queues = {
+            'parse': QueueStats('parse', parse_queue),
+            'write': QueueStats('write', write_queue),
+        }
+
+        parse_executor = self.parse_executor or ProcessPoolExecutor(max_workers=self.parse_workers)
+        # 单线程执行器保证只有一个数据库写入者
+        write_executor = ThreadPoolExecutor(max_workers=1)
+        self._write_executor = write_executor
+        self.stats.started_at = time.monotonic()
+        tasks = []
+
+        try:
+            fetchers = [asyncio.create_task(self._fetch_worker(page_queue, parse_queue, page_total))
+                        for _ in range(self.concurrency)]
+            parsers = [asyncio.create_task(self._parse_worker(parse_queue, write_queue, parse_executor))
+                       for _ in range(self.parse_workers)]
+            writer = asyncio.create_task(self._write_worker(write_queue, write_executor))
+            drain = asyncio.create_task(self._drain(fetchers, parsers, writer, parse_queue, write_queue))
+            tasks = fetchers + parsers + [writer, drain]
+
+            pending = set(tasks)
+            while drain in pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    if not task.cancelled() and task.exception() is not None:
+                        self.logger.error(f"流水线协程异常退出，停止采集: {task.exception()!r}")
+                        raise task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # 等待被取消的协程结束，并取回其异常，避免 "exception was never retrieved" 警告
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.stats.finished_at = time.monotonic()
+            write_executor.shutdown(wait=True)
+            if self.parse_executor is None:
+                parse_executor.shutdown(wait=True)
+
+        return self.total_new_users, self.total_changed_users, self.total_unchanged_users
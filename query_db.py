@@ -1,102 +1,418 @@
 import sqlite3
 import json
+import time
+import functools
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from db_config import get_db_connection
+import db_config
+from db_config import get_db_connection, chunked, get_data_version, has_search_index
+from user_record import USER_TABLE_COLUMNS
 
-def query_users(limit=10):
+class QueryCache:
     """
-    查询用户数据
+    查询结果缓存（LRU + TTL）
+    
+    每个条目记录写入时的数据版本（data_version 表，写入者每次提交用户数据时加 1），
+    版本变化后旧条目立即失效，因此爬虫提交后不会读到旧结果；
+    TTL 用于兜底（例如手工修改了数据库而没有更新版本）。
+    """
+    
+    def __init__(self, maxsize=256, ttl=300.0):
+        """
+        参数:
+            maxsize: 最多缓存的条目数，超出时淘汰最久未使用的条目
+            ttl: 条目的最长存活秒数，<= 0 表示不缓存
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, version):
+        """
+        返回 (是否命中, 缓存值)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, value = entry
+                if entry_version == version and time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+    
+    def put(self, key, version, value):
+        """写入一个条目"""
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """清空缓存和命中统计"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+    
+    def info(self):
+        """返回命中次数、未命中次数和当前条目数"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+# 本进程共享的查询缓存
+QUERY_CACHE = QueryCache()
+
+def _freeze(value):
+    """把列表参数转换为元组，使其可以作为缓存键"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _copy_result(value):
+    """
+    复制查询结果中的列表和字典（查询结果只包含这两种容器和不可变的标量），
+    比 copy.deepcopy 快得多，缓存命中不会比直接查询数据库还慢
+    """
+    if isinstance(value, list):
+        return [_copy_result(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _copy_result(item) for key, item in value.items()}
+    return value
+
+def cached_query(func):
+    """
+    查询函数的缓存装饰器：以 (函数名, 参数) 为键，以当前数据版本校验
+    
+    返回结果的副本，调用方修改返回值不会影响缓存
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, _freeze(args), tuple(sorted((name, _freeze(value)) for name, value in kwargs.items())))
+        # 数据库路径也作为版本的一部分，切换数据库后不会读到另一个库的结果
+        version = (str(db_config.DB_PATH), get_data_version(get_db_connection()))
+        hit, value = QUERY_CACHE.get(key, version)
+        if not hit:
+            value = func(*args, **kwargs)
+            QUERY_CACHE.put(key, version, value)
+        return _copy_result(value)
+    return wrapper
+
+# 查询结果中 users 表的列（不含内部的 row_hash）
+_USER_SELECT = ', '.join(f'u.{column}' for column in USER_TABLE_COLUMNS)
+
+def fetch_links(conn, user_ids):
+    """
+    一次性查询一批用户的链接并按用户分组
+    
+    参数:
+        conn: 数据库连接
+        user_ids: 用户ID列表
+    
+    返回:
+        dict: {user_id: [{'link_type': ..., 'link_url': ...}, ...]}
+    """
+    links_by_user = {user_id: [] for user_id in user_ids}
+    for chunk in chunked(list(links_by_user)):
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(f"""
+        SELECT user_id, link_type, link_url FROM user_links
+        WHERE user_id IN ({placeholders})
+        ORDER BY user_id, id
+        """, chunk)
+        for row in rows:
+            links_by_user[row['user_id']].append({'link_type': row['link_type'], 'link_url': row['link_url']})
+    return links_by_user
+
+@cached_query
+def query_users(limit=10, after_user_id=None, columns=None, include_links=True):
+    """
+    查询用户数据（按 user_id 倒序）
     
     参数:
         limit: 限制返回结果数量
+        after_user_id: 可选，键集分页游标，只返回 user_id 小于该值的用户；
+            传入上一页最后一个用户的 user_id 即可取下一页，每页耗时恒定
+        columns: 可选，只返回指定的列（user_id 总是包含在内）
+        include_links: 是否附带链接列表
         
     返回:
         用户数据列表
     """
+    if columns:
+        unknown = [column for column in columns if column not in USER_TABLE_COLUMNS]
+        if unknown:
+            raise ValueError(f"未知的列: {', '.join(unknown)}")
+        selected = ['user_id'] + [column for column in columns if column != 'user_id']
+    else:
+        selected = list(USER_TABLE_COLUMNS)
+    
     conn = get_db_connection()
     
-    try:
-        # 查询用户基本信息
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT * FROM users 
-        ORDER BY user_id DESC
+    # 查询用户基本信息
+    where = "WHERE user_id < ?" if after_user_id is not None else ""
+    params = (after_user_id, limit) if after_user_id is not None else (limit,)
+    cursor = conn.execute(f"""
+    SELECT {', '.join(selected)} FROM users
+    {where}
+    ORDER BY user_id DESC
+    LIMIT ?
+    """, params)
+    users = [dict(user_row) for user_row in cursor.fetchall()]
+    
+    # 一次查询出整页用户的链接，在内存中拼接
+    if include_links:
+        links_by_user = fetch_links(conn, [user_data['user_id'] for user_data in users])
+        for user_data in users:
+            user_data['links'] = links_by_user[user_data['user_id']]
+    
+    return users
+
+# trigram 索引只能查找至少 3 个字符的片段
+MIN_INDEXED_TERM = 3
+
+def _like_pattern(term):
+    """把搜索词转换为 LIKE 子串模式（转义 %、_ 和转义符本身）"""
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def _fts_phrase(term):
+    """把搜索词转换为 FTS5 短语（双引号内按原样匹配，不解析 FTS5 查询语法）"""
+    return '"' + term.replace('"', '""') + '"'
+
+# 参与排序的候选数：命中很多用户的宽泛查询只在最新的这么多个命中中排序，耗时与命中总数无关
+SEARCH_WINDOW = 1000
+
+@cached_query
+def search_users(query, limit=20):
+    """
+    按邮箱或备注的片段搜索用户（例如邮箱前缀、"@gmail.com"、备注中的文字）
+    
+    查询按空白拆分为多个词，每个词都要在 email 或 remark 中作为子串出现（不区分大小写）。
+    不少于 3 个字符的词走 users_fts 全文索引，更短的词在索引命中上用 LIKE 过滤；
+    所有词都短于 3 个字符或数据库没有搜索索引时退化为扫描 users 表。
+    
+    排序：邮箱等于第一个词、邮箱用户名等于第一个词、邮箱以第一个词开头的依次优先，
+    其次是在邮箱中命中的词多的、邮箱短的（更接近完整匹配），最后按 user_id 倒序。
+    满足全部条件的用户超过 SEARCH_WINDOW 个时只对最新的 SEARCH_WINDOW 个排序（短词过滤在截断前完成，
+    满足条件的用户足够时总能返回 limit 个），宽泛的查询（如 "gmail.com"）也能在毫秒级返回；
+    扫描时直接按 user_id 倒序。
+    
+    参数:
+        query: 搜索文本
+        limit: 最多返回的用户数
+    
+    返回:
+        list: 用户字典列表（USER_TABLE_COLUMNS 中的全部列）
+    """
+    terms = query.split()
+    if not terms or limit <= 0:
+        return []
+    
+    conn = get_db_connection()
+    indexed = [term for term in terms if len(term) >= MIN_INDEXED_TERM] if has_search_index(conn) else []
+    filtered = [term for term in terms if term not in indexed]
+    
+    where = []
+    params = []
+    for term in filtered:
+        where.append("(u.email LIKE ? ESCAPE '\\' OR u.remark LIKE ? ESCAPE '\\')")
+        params.extend([_like_pattern(term)] * 2)
+    
+    # 排序表达式：邮箱与第一个词完全相同、邮箱用户名与第一个词相同、邮箱以第一个词开头，
+    # 然后是邮箱中命中的词数
+    prefix = _like_pattern(terms[0])[1:-1]
+    order_params = [prefix, f"{prefix}@%", f"{prefix}%"] + [_like_pattern(term) for term in terms]
+    email_hits = ' + '.join("(u.email LIKE ? ESCAPE '\\')" for _ in terms)
+    order_by = f"""
+        CASE WHEN u.email LIKE ? ESCAPE '\\' THEN 0 WHEN u.email LIKE ? ESCAPE '\\' THEN 1
+             WHEN u.email LIKE ? ESCAPE '\\' THEN 2 ELSE 3 END,
+        {email_hits} DESC, length(u.email), u.user_id DESC"""
+    
+    if indexed:
+        # 按 rowid 倒序读取索引命中可以提前结束，不需要读出全部命中；
+        # 另外单独查出邮箱用户名等于第一个词的用户，避免宽泛的查询把完全匹配挤出候选窗口。
+        # 短词的 LIKE 条件在窗口截断之前应用，候选窗口中只包含满足全部条件的用户，
+        # 因此满足条件的用户不少于 limit 个时一定返回 limit 个
+        match = ' '.join(_fts_phrase(term) for term in indexed)
+        exact_match = ' '.join(_fts_phrase(term + '@' if term == terms[0] else term) for term in indexed)
+        window = max(SEARCH_WINDOW, limit)
+        filters = ''.join(f" AND {condition}" for condition in where)
+        hits_sql = f"""
+                SELECT users_fts.rowid AS user_id FROM users_fts
+                {'JOIN users u ON u.user_id = users_fts.rowid' if where else ''}
+                WHERE users_fts MATCH ?{filters}
+                ORDER BY users_fts.rowid DESC LIMIT ?"""
+        cursor = conn.execute(f"""
+        WITH hits AS (
+            SELECT * FROM ({hits_sql})
+            UNION
+            SELECT * FROM ({hits_sql})
+        )
+        SELECT {_USER_SELECT} FROM hits JOIN users u ON u.user_id = hits.user_id
+        ORDER BY {order_by}
         LIMIT ?
-        """, (limit,))
-        
-        users = []
-        for user_row in cursor.fetchall():
-            user_data = dict(user_row)
-            
-            # 查询关联的链接
-            link_cursor = conn.cursor()
-            link_cursor.execute("""
-            SELECT link_type, link_url FROM user_links
-            WHERE user_id = ?
-            """, (user_data['user_id'],))
-            
-            links = [dict(link) for link in link_cursor.fetchall()]
-            user_data['links'] = links
-            
-            users.append(user_data)
-            
-        return users
-    finally:
-        conn.close()
+        """, [match] + params + [window, exact_match] + params + [window] + order_params + [limit])
+    else:
+        # 没有可用索引时从最新用户开始扫描，找够 limit 个即停止
+        cursor = conn.execute(f"""
+        SELECT {_USER_SELECT} FROM users u
+        WHERE {' AND '.join(where)}
+        ORDER BY u.user_id DESC
+        LIMIT ?
+        """, params + [limit])
+    
+    return [dict(row) for row in cursor.fetchall()]
 
+@cached_query
 def count_users():
     """
-    统计用户数量
+    统计用户数量（读取由触发器维护的 user_stats 汇总表，耗时与用户数无关）
     
     返回:
         总用户数、会员数、非会员数
     """
     conn = get_db_connection()
     
-    try:
-        cursor = conn.cursor()
-        
-        # 总用户数
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total = cursor.fetchone()[0]
-        
-        # 会员数
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_member = '是'")
-        members = cursor.fetchone()[0]
-        
-        # 非会员数
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_member = '否'")
-        non_members = cursor.fetchone()[0]
-        
-        return total, members, non_members
-    finally:
-        conn.close()
+    row = conn.execute("SELECT total, members, non_members FROM user_stats WHERE id = 1").fetchone()
+    if row is None:
+        return 0, 0, 0
+    
+    return row['total'], row['members'], row['non_members']
 
+@cached_query
 def get_country_stats():
     """
-    获取国家分布统计
+    获取国家分布统计（读取由触发器维护的 country_stats 汇总表）
     
     返回:
         国家分布字典
     """
     conn = get_db_connection()
     
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-        SELECT country, COUNT(*) as count
-        FROM users
-        GROUP BY country
-        ORDER BY count DESC
-        """)
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT country, user_count as count
+    FROM country_stats
+    ORDER BY count DESC
+    """)
+    
+    country_stats = {}
+    for row in cursor.fetchall():
+        country_stats[row['country']] = row['count']
         
-        country_stats = {}
-        for row in cursor.fetchall():
-            country_stats[row['country']] = row['count']
-            
-        return country_stats
-    finally:
-        conn.close()
+    return country_stats
+
+@cached_query
+def get_revenue_stats():
+    """
+    获取金额合计（读取由触发器维护的 user_stats 汇总表）
+    
+    返回:
+        dict: 充值总额、扣除总额、积分余额合计、退款总额
+    """
+    conn = get_db_connection()
+    
+    row = conn.execute("""
+    SELECT recharge_total, deduction_total, credit_total, refund_total FROM user_stats WHERE id = 1
+    """).fetchone()
+    if row is None:
+        return {'recharge_total': 0.0, 'deduction_total': 0.0, 'credit_total': 0.0, 'refund_total': 0.0}
+    
+    return dict(row)
+
+@cached_query
+def get_top_risk_users(limit=20, flagged_only=False):
+    """
+    查询风险分最高的用户（读取 risk_scoring 写入的 user_scores 表）
+    
+    参数:
+        limit: 限制返回结果数量
+        flagged_only: 是否只返回被标记为可疑的用户
+    
+    返回:
+        list: 用户字典列表，包含邮箱、金额列和全部评分列，按风险分从高到低排列
+    """
+    conn = get_db_connection()
+    
+    cursor = conn.execute(f"""
+    SELECT u.user_id, u.email, u.country, u.refund_amount, u.last_refund_amount, u.recharge_amount,
+           u.total_deduction, u.credit_balance, s.*
+    FROM user_scores s JOIN users u ON u.user_id = s.user_id
+    {'WHERE s.flagged = 1' if flagged_only else ''}
+    ORDER BY s.risk_score DESC, s.user_id DESC
+    LIMIT ?
+    """, (limit,))
+    
+    return [dict(row) for row in cursor.fetchall()]
+
+# user_history 中记录变化的列
+HISTORY_COLUMNS = ('credit_balance', 'recharge_amount', 'total_deduction', 'is_member')
+
+@cached_query
+def get_user_history(user_id):
+    """
+    查询单个用户在历次采集中的取值
+    
+    user_history 只保存变化的列，这里按采集顺序把未变化的列补成上一次的值
+    
+    参数:
+        user_id: 用户ID
+    
+    返回:
+        list: [{'run_id', 'started_at', 'credit_balance', 'recharge_amount', 'total_deduction', 'is_member',
+                'changed': 本次变化的列名列表}, ...]，按采集顺序排列
+    """
+    conn = get_db_connection()
+    
+    cursor = conn.execute(f"""
+    SELECT h.run_id, r.started_at, {', '.join(f'h.{column}' for column in HISTORY_COLUMNS)}
+    FROM user_history h JOIN crawl_runs r ON r.run_id = h.run_id
+    WHERE h.user_id = ?
+    ORDER BY h.run_id
+    """, (user_id,))
+    
+    history = []
+    current = dict.fromkeys(HISTORY_COLUMNS)
+    for row in cursor.fetchall():
+        changed = [column for column in HISTORY_COLUMNS if row[column] is not None]
+        current.update((column, row[column]) for column in changed)
+        history.append(dict(current, run_id=row['run_id'], started_at=row['started_at'], changed=changed))
+    return history
+
+@cached_query
+def get_run_changes(run_id):
+    """
+    查询某次采集中所有发生变化的用户
+    
+    参数:
+        run_id: 采集批次
+    
+    返回:
+        list: [{'user_id', 变化的列: 新值, ...}, ...]，按 user_id 排序，只包含变化的列
+    """
+    conn = get_db_connection()
+    
+    cursor = conn.execute(f"""
+    SELECT user_id, {', '.join(HISTORY_COLUMNS)} FROM user_history
+    WHERE run_id = ?
+    ORDER BY user_id
+    """, (run_id,))
+    
+    return [
+        dict({'user_id': row['user_id']}, **{column: row[column] for column in HISTORY_COLUMNS
+                                            if row[column] is not None})
+        for row in cursor.fetchall()
+    ]
 
 if __name__ == "__main__":
     # 统计用户数量
@@ -113,6 +429,12 @@ if __name__ == "__main__":
         print(f"  {country}: {count}")
     print()
     
+    # 金额合计
+    revenue = get_revenue_stats()
+    print(f"充值总额: {revenue['recharge_total']:.2f}, 扣除总额: {revenue['deduction_total']:.2f}, "
+          f"积分余额合计: {revenue['credit_total']:.2f}, 退款总额: {revenue['refund_total']:.2f}")
+    print()
+    
     # 查询最新用户
     users = query_users(5)
     print(f"最新 {len(users)} 条用户数据:")
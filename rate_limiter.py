@@ -0,0 +1,92 @@
+import asyncio
+import random
+import time
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    计算第 attempt 次重试前的等待秒数（指数退避 + 随机抖动）
+
+    等待时间在 [0, min(cap, base * 2 ** (attempt - 1))] 之间均匀分布，
+    避免多个失败请求在同一时刻集中重试。
+
+    参数:
+        attempt: 第几次重试，从 1 开始
+        base: 第一次重试的最大等待秒数
+        cap: 等待秒数上限
+    """
+    return random.uniform(0, min(cap, base * 2 ** (max(1, attempt) - 1)))
+
+class RateLimiter:
+    """
+    全局令牌桶限速器
+
+    同时限制两个维度:
+        - 每秒请求数（令牌桶，允许 burst 个请求的突发）
+        - 同时进行中的请求数上限（max_in_flight）
+
+    用法:
+        limiter = RateLimiter(rate=2, max_in_flight=4)
+        async with limiter:
+            await session.fetch(url)
+    """
+
+    def __init__(self, rate=1.0, burst=1, max_in_flight=None):
+        """
+        参数:
+            rate: 每秒允许的请求数，<= 0 表示不限速
+            burst: 令牌桶容量，即允许的最大突发请求数
+            max_in_flight: 同时进行中的请求数上限，None 表示不限制
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_in_flight = max_in_flight
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = None
+        self._in_flight = None
+
+    def _ensure_primitives(self):
+        # asyncio 原语需要在事件循环中创建
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            if self.max_in_flight:
+                self._in_flight = asyncio.Semaphore(self.max_in_flight)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def _take_token(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                # 等待下一个令牌生成
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    async def acquire(self):
+        """获取一次请求许可（先占用并发名额，再取令牌）"""
+        self._ensure_primitives()
+        if self._in_flight is not None:
+            await self._in_flight.acquire()
+        try:
+            await self._take_token()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        """请求结束后释放并发名额"""
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,238 @@
+import os
+import re
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import db_config
+from db_config import connect, init_schema, bump_data_version
+from get_users_array_from_page import extract_user_records
+from insert_users_array_to_db import upsert_users_batch, BATCH_SIZE
+from crawl_state import get_watermarks
+from pipeline import DOWNLOAD_DIR
+from page_archive import PageArchive, read_snapshot
+
+# 抓取时保存的页面文件名
+ARCHIVE_PATTERN = 'page_*.html'
+
+# 每处理多少个文件输出一次进度
+PROGRESS_EVERY = 500
+
+# 重建后的用户数至少要达到预期用户数的这个比例才提交，避免从不完整的数据来源重建
+REBUILD_MIN_COVERAGE = 0.99
+
+def _expected_users(conn):
+    """重建前预期的用户数：上次完整采集记录的用户总数，没有记录时为重建前 users 表的用户数"""
+    total_users = get_watermarks(conn)['total_users']
+    if total_users is not None:
+        return total_users
+    return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+def _page_number(path):
+    match = re.search(r'(\d+)', path.stem)
+    return int(match.group(1)) if match else 0
+
+def scan_archive(archive_dir=None, pattern=ARCHIVE_PATTERN):
+    """
+    列出存档目录中的页面文件
+
+    按修改时间从旧到新排序（同一用户出现在多个文件中时以最新保存的为准），
+    修改时间相同时按页码排序。
+
+    参数:
+        archive_dir: 存档目录，默认为 downloaded_page/
+        pattern: 文件名匹配模式
+
+    返回:
+        list: Path 列表
+    """
+    archive_dir = Path(archive_dir or DOWNLOAD_DIR)
+    return sorted(archive_dir.glob(pattern), key=lambda path: (path.stat().st_mtime, _page_number(path)))
+
+def scan_snapshots(run_id='latest', archive_root=None):
+    """
+    列出页面存档中某次采集的所有页
+
+    参数:
+        run_id: 采集ID，'latest' 表示最近一次覆盖了全部页面的采集
+        archive_root: 存档目录，默认为 page_archive/
+
+    返回:
+        list: [(存档目录, 页码, 头部摘要, 表格摘要), ...]
+    """
+    archive = PageArchive(archive_root)
+    try:
+        if run_id == 'latest':
+            run_id = archive.latest_run()
+        if run_id is None:
+            return []
+        return [(str(archive.root), page_num, head_hash, body_hash)
+                for page_num, head_hash, body_hash in archive.snapshots(run_id)]
+    finally:
+        archive.close()
+
+def _parse_file(source, engine=None):
+    """
+    在子进程中解析一个文件或一页存档快照，出错时返回错误信息而不是抛出异常
+
+    参数:
+        source: 文件路径，或 scan_snapshots 返回的 (存档目录, 页码, 头部摘要, 表格摘要)
+
+    返回:
+        tuple: (来源标签, UserRecord 列表, 错误信息)；记录以元组传回主进程，比字典列表小得多
+    """
+    label = f"{source[0]}#page_{source[1]}" if isinstance(source, tuple) else str(source)
+    try:
+        if isinstance(source, tuple):
+            root, page_num, head_hash, body_hash = source
+            return label, extract_user_records(read_snapshot(root, head_hash, body_hash), engine), None
+        with open(source, 'r', encoding='utf-8') as f:
+            return label, extract_user_records(f.read(), engine), None
+    except Exception as e:
+        return label, [], str(e)
+
+def _write_batch(conn, users_data, totals):
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        result = upsert_users_batch(conn, users_data)
+        if result.new or result.changed:
+            bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    totals['new'] += result.new
+    totals['changed'] += result.changed
+    totals['unchanged'] += result.unchanged
+
+def _write_rebuild_batch(conn, users_data, totals):
+    # 重建时所有批次在同一个事务中写入，结束时统一提交或回滚
+    result = upsert_users_batch(conn, users_data)
+    totals['new'] += result.new
+    totals['changed'] += result.changed
+    totals['unchanged'] += result.unchanged
+
+def reingest(archive_dir=None, workers=None, engine=None, batch_size=BATCH_SIZE, rebuild=False,
+             pattern=ARCHIVE_PATTERN, db_path=None, run_id=None, min_coverage=REBUILD_MIN_COVERAGE):
+    """
+    离线重新导入已保存的页面，不访问网络
+
+    文件在进程池中并行解析，解析结果按完成顺序流入批量写入（每 batch_size 个用户一个事务）。
+
+    参数:
+        archive_dir: 存档目录；读取 HTML 文件时为页面目录（如 downloaded_page/），
+            读取页面存档时为 page_archive/。既没有指定目录也没有指定 run_id 时读取页面存档中
+            最近一次覆盖了全部页面的采集（rebuild 时不允许省略数据来源）
+        workers: 解析进程数，默认为 CPU 核数
+        engine: 解析引擎，见 get_users_array_from_page.PARSER_ENGINES
+        batch_size: 每个事务写入的用户数
+        rebuild: 是否重建用户数据：在一个事务中清空 users 和 user_links 后重新导入，
+            只有全部页面解析成功、至少有一页有效数据，且重建后的用户数达到预期用户数的 min_coverage 时
+            才提交，否则回滚、保留原数据；采集记录、用户历史、页面摘要、风险分等其它表不受影响
+        pattern: 文件名匹配模式
+        db_path: 目标数据库路径，默认为 DB_PATH
+        run_id: 可选，从页面存档中读取该次采集（'latest' 表示最近一次覆盖了全部页面的采集），而不是读取 HTML 文件；
+            只指定 archive_dir 时读取其中的 HTML 文件
+        min_coverage: 重建时要求的覆盖比例，预期用户数见 _expected_users
+
+    返回:
+        dict: 文件数、用户数、新增/变化/未变化数、出错文件、耗时和每秒页数；
+            重建时 rebuilt 表示是否已提交，expected_users、rebuilt_users 为预期和重建后的用户数
+    """
+    db_path = Path(db_path or db_config.DB_PATH)
+    # 默认只保存压缩存档（--save-raw 才写 downloaded_page/），因此默认从最近一次完整采集的存档导入；
+    # 重建会清空用户数据，必须明确指定数据来源
+    if run_id is None and archive_dir is None:
+        if rebuild:
+            raise ValueError("重建需要明确指定数据来源（run_id 或 archive_dir，命令行为 --run 或 --archive-dir）")
+        run_id = 'latest'
+    files = scan_snapshots(run_id, archive_dir) if run_id else scan_archive(archive_dir, pattern)
+
+    totals = {'files': len(files), 'pages': 0, 'empty': 0, 'users': 0,
+              'new': 0, 'changed': 0, 'unchanged': 0, 'errors': {}}
+    write_batch = _write_rebuild_batch if rebuild else _write_batch
+    started = time.monotonic()
+    conn = connect(db_path)
+    try:
+        init_schema(conn)
+        if rebuild:
+            # 其它连接在提交前仍读到原数据（WAL），提交后一次性看到重建结果
+            conn.execute("BEGIN IMMEDIATE")
+            totals['expected_users'] = _expected_users(conn)
+            conn.execute("DELETE FROM user_links")
+            conn.execute("DELETE FROM users")
+        pending = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(files) // ((workers or os.cpu_count() or 1) * 4))
+            results = executor.map(_parse_file, files, [engine] * len(files), chunksize=chunksize)
+            for done, (path, users_data, error) in enumerate(results, 1):
+                if error:
+                    totals['errors'][path] = error
+                elif not users_data:
+                    totals['empty'] += 1
+                else:
+                    totals['pages'] += 1
+                    totals['users'] += len(users_data)
+                    pending.extend(users_data)
+
+                if len(pending) >= batch_size:
+                    write_batch(conn, pending, totals)
+                    pending = []
+
+                if done % PROGRESS_EVERY == 0:
+                    elapsed = time.monotonic() - started
+                    print(f"已处理 {done}/{len(files)} 个文件，{done / elapsed:.1f} 页/秒")
+
+        if pending:
+            write_batch(conn, pending, totals)
+        if rebuild:
+            totals['rebuilt_users'] = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            covered = totals['rebuilt_users'] >= totals['expected_users'] * min_coverage
+            totals['rebuilt'] = not totals['errors'] and totals['pages'] > 0 and covered
+            if totals['rebuilt']:
+                bump_data_version(conn)
+                conn.commit()
+            else:
+                conn.rollback()
+                print(f"重建未完成（出错 {len(totals['errors'])} 个，有效页面 {totals['pages']} 个，"
+                      f"用户 {totals['rebuilt_users']}/{totals['expected_users']}），已保留原数据")
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+
+    totals['elapsed'] = round(time.monotonic() - started, 3)
+    totals['pages_per_second'] = round(len(files) / totals['elapsed'], 1) if totals['elapsed'] > 0 else 0.0
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='离线重新导入保存的页面：默认读取页面存档（page_archive/）中最近一次覆盖全部页面的采集，'
+                    '指定 --archive-dir 时读取该目录中的 HTML 文件（如 --save-raw 保存的 downloaded_page/）')
+    parser.add_argument('--archive-dir', default=None,
+                        help='HTML 文件目录（如 downloaded_page）；与 --run 同时指定时为页面存档目录')
+    parser.add_argument('--run', default=None,
+                        help="从页面存档读取某次采集，'latest' 表示最近一次覆盖全部页面的采集"
+                             "（未指定 --archive-dir 时的默认值）")
+    parser.add_argument('--pattern', default=ARCHIVE_PATTERN, help='文件名匹配模式')
+    parser.add_argument('--workers', type=int, default=None, help='解析进程数，默认为 CPU 核数')
+    parser.add_argument('--engine', default=None, help='解析引擎（lxml 或 bs4）')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='每个事务写入的用户数')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='清空用户数据后重新导入（全部成功才提交，否则保留原数据；需同时指定 --run 或 --archive-dir）')
+    parser.add_argument('--min-coverage', type=float, default=REBUILD_MIN_COVERAGE,
+                        help='重建后的用户数至少达到预期用户数（上次采集的用户总数或重建前的用户数）的比例')
+    args = parser.parse_args()
+    if args.rebuild and args.run is None and args.archive_dir is None:
+        parser.error('--rebuild 需要明确指定 --run 或 --archive-dir')
+
+    result = reingest(args.archive_dir, args.workers, args.engine, args.batch_size, args.rebuild, args.pattern,
+                      run_id=args.run, min_coverage=args.min_coverage)
+    print(f"处理完成! 文件: {result['files']}, 有效页面: {result['pages']}, 空页面: {result['empty']}, "
+          f"出错: {len(result['errors'])}")
+    print(f"用户: {result['users']}, 新增: {result['new']}, 变化: {result['changed']}, "
+          f"未变化: {result['unchanged']}")
+    print(f"耗时 {result['elapsed']} 秒, {result['pages_per_second']} 页/秒")
+    for path, error in result['errors'].items():
+        print(f"  {path}: {error}")
@@ -0,0 +1,199 @@
+import time
+import argparse
+from datetime import datetime
+import numpy as np
+from db_config import get_db_connection, bump_data_version
+
+# 参与评分的 users 列
+SOURCE_COLUMNS = ('refund_amount', 'last_refund_amount', 'recharge_amount', 'total_deduction', 'credit_balance')
+
+# 没有充值却有退款（或扣除）时比值记为该上限，比值也不会超过该上限
+RATIO_CAP = 10.0
+
+# 综合风险分中各指标百分位排名的权重（和为 1）
+RISK_WEIGHTS = {
+    'refund_ratio': 0.4,
+    'refund_amount': 0.25,
+    'last_refund_amount': 0.15,
+    'deduction_ratio': 0.2,
+}
+
+# 风险分（0-100）达到该值时标记为可疑
+RISK_THRESHOLD = 90.0
+
+# 退款金额或退款/充值比的 z-score 达到该值时也标记为可疑
+Z_THRESHOLD = 3.0
+
+# user_scores 表的列（user_id 之后），与 compute_scores 返回的键一致
+SCORE_COLUMNS = (
+    'refund_ratio', 'deduction_ratio',
+    'refund_z', 'last_refund_z', 'recharge_z', 'deduction_z', 'credit_z',
+    'refund_ratio_pct', 'deduction_ratio_pct',
+    'risk_score', 'flagged',
+)
+
+def load_score_inputs(conn=None):
+    """
+    一次扫描 users 表，把评分用到的列读入 NumPy 数组
+
+    参数:
+        conn: 可选，数据库连接，默认为当前线程的持久连接
+
+    返回:
+        tuple: (user_id 数组, {列名: float64 数组})，NULL 按 0 处理
+    """
+    conn = conn or get_db_connection()
+    dtype = np.dtype([('user_id', np.int64)] + [(column, np.float64) for column in SOURCE_COLUMNS])
+    # 游标直接返回元组（不经过 sqlite3.Row），逐行填入结构化数组，不生成中间列表；
+    # 不预先 COUNT(*)：单条 SELECT 读取的是一致的快照，而两条语句之间爬虫可能写入新用户
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"""
+    SELECT user_id, {', '.join(f'COALESCE({column}, 0)' for column in SOURCE_COLUMNS)}
+    FROM users ORDER BY user_id
+    """)
+    records = np.fromiter(cursor, dtype=dtype)
+    return records['user_id'], {column: np.ascontiguousarray(records[column]) for column in SOURCE_COLUMNS}
+
+def safe_ratio(numerator, denominator, cap=RATIO_CAP):
+    """
+    逐元素计算 numerator / denominator
+
+    分母为 0 时：分子大于 0 记为 cap，否则记为 0；结果不超过 cap
+    """
+    ratio = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+    ratio[(denominator <= 0) & (numerator > 0)] = cap
+    return np.minimum(ratio, cap)
+
+def zscore(values):
+    """标准分 (x - 均值) / 标准差，标准差为 0 时全部为 0"""
+    if values.size == 0:
+        return np.zeros_like(values)
+    std = values.std()
+    if std == 0:
+        return np.zeros_like(values)
+    return (values - values.mean()) / std
+
+def percentile_rank(values):
+    """
+    百分位排名（0-100）：取值严格小于该用户的用户所占比例
+
+    取值相同的用户排名相同，大多数用户为 0 的列（如退款）中这些用户的排名也为 0
+    """
+    if values.size == 0:
+        return np.zeros_like(values)
+    ordered = np.sort(values)
+    return np.searchsorted(ordered, values, side='left') * (100.0 / values.size)
+
+def compute_scores(columns):
+    """
+    向量化计算所有用户的比值、标准分、百分位排名和综合风险分（没有逐用户的 Python 循环）
+
+    参数:
+        columns: {列名: float64 数组}，见 load_score_inputs
+
+    返回:
+        dict: {SCORE_COLUMNS 中的列名: 数组}，flagged 为 0/1 整数数组
+    """
+    refund = columns['refund_amount']
+    recharge = columns['recharge_amount']
+    deduction = columns['total_deduction']
+
+    scores = {
+        'refund_ratio': safe_ratio(refund, recharge),
+        'deduction_ratio': safe_ratio(deduction, recharge),
+        'refund_z': zscore(refund),
+        'last_refund_z': zscore(columns['last_refund_amount']),
+        'recharge_z': zscore(recharge),
+        'deduction_z': zscore(deduction),
+        'credit_z': zscore(columns['credit_balance']),
+    }
+    scores['refund_ratio_pct'] = percentile_rank(scores['refund_ratio'])
+    scores['deduction_ratio_pct'] = percentile_rank(scores['deduction_ratio'])
+
+    ranks = {
+        'refund_ratio': scores['refund_ratio_pct'],
+        'deduction_ratio': scores['deduction_ratio_pct'],
+        'refund_amount': percentile_rank(refund),
+        'last_refund_amount': percentile_rank(columns['last_refund_amount']),
+    }
+    risk_score = np.zeros_like(refund)
+    for name, weight in RISK_WEIGHTS.items():
+        risk_score += weight * ranks[name]
+    scores['risk_score'] = risk_score
+
+    flagged = (risk_score >= RISK_THRESHOLD) | (scores['refund_z'] >= Z_THRESHOLD)
+    flagged |= zscore(scores['refund_ratio']) >= Z_THRESHOLD
+    scores['flagged'] = flagged.astype(np.int64)
+    return scores
+
+def write_scores(conn, user_ids, scores, scored_at=None):
+    """
+    用本次评分整体替换 user_scores 表（单个事务，批量写入）
+
+    参数:
+        conn: 数据库连接
+        user_ids: user_id 数组
+        scores: compute_scores 的返回值
+        scored_at: 评分时间，默认为当前时间
+
+    返回:
+        int: 写入的行数
+    """
+    scored_at = scored_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # tolist 一次性转换为 Python 数值，比逐个元素转换快得多
+    rows = zip(user_ids.tolist(), *(scores[column].tolist() for column in SCORE_COLUMNS),
+               [scored_at] * len(user_ids))
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        conn.execute("DELETE FROM user_scores")
+        conn.executemany(f"""
+        INSERT INTO user_scores (user_id, {', '.join(SCORE_COLUMNS)}, scored_at)
+        VALUES (?, {', '.join('?' for _ in SCORE_COLUMNS)}, ?)
+        """, rows)
+        bump_data_version(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(user_ids)
+
+def score_users(conn=None):
+    """
+    为全部用户评分并写入 user_scores 表
+
+    参数:
+        conn: 可选，数据库连接，默认为当前线程的持久连接
+
+    返回:
+        dict: 用户数、可疑用户数，以及读取、计算、写入各阶段耗时（秒）
+    """
+    conn = conn or get_db_connection()
+    started = time.perf_counter()
+    user_ids, columns = load_score_inputs(conn)
+    loaded = time.perf_counter()
+    scores = compute_scores(columns)
+    computed = time.perf_counter()
+    write_scores(conn, user_ids, scores)
+    written = time.perf_counter()
+    return {
+        'users': int(user_ids.size),
+        'flagged': int(scores['flagged'].sum()),
+        'load_seconds': round(loaded - started, 3),
+        'compute_seconds': round(computed - loaded, 3),
+        'write_seconds': round(written - computed, 3),
+    }
+
+if __name__ == "__main__":
+    from query_db import get_top_risk_users
+
+    parser = argparse.ArgumentParser(description='计算用户风险分并写入 user_scores 表')
+    parser.add_argument('--top', type=int, default=20, help='输出风险分最高的用户数')
+    args = parser.parse_args()
+
+    result = score_users()
+    print(f"评分完成! 用户: {result['users']}, 可疑: {result['flagged']}")
+    print(f"读取 {result['load_seconds']} 秒, 计算 {result['compute_seconds']} 秒, 写入 {result['write_seconds']} 秒")
+    for user in get_top_risk_users(args.top):
+        print(f"  ID: {user['user_id']}, 邮箱: {user['email']}, 风险分: {user['risk_score']:.1f}, "
+              f"退款/充值: {user['refund_ratio']:.2f}, 退款: {user['refund_amount']}, 充值: {user['recharge_amount']}")
@@ -0,0 +1,233 @@
+import csv
+import gzip
+import json
+import argparse
+from itertools import islice
+from pathlib import Path
+from datetime import datetime
+from db_config import get_db_connection
+from user_record import USER_TABLE_COLUMNS
+
+# 导出文件默认目录
+EXPORT_DIR = Path(__file__).parent / 'exports'
+
+# 每次从数据库读取的行数
+CHUNK_SIZE = 5000
+
+# Excel 单个工作表的最大行数（含表头）
+XLSX_MAX_ROWS = 1048576
+
+# 与 export_users_to_excel 相同的四个工作表：(工作表名, 文件名, 查询语句)
+# 用户数据表的 links_info 列在 _iter_users_rows 中流式拼接
+SHEETS = (
+    ('用户数据', 'users', None),
+    ('链接数据', 'links', "SELECT * FROM user_links ORDER BY id"),
+    ('国家分布', 'country_stats', """
+        SELECT country, COUNT(*) AS 用户数量 FROM users
+        WHERE country IS NOT NULL
+        GROUP BY country ORDER BY country
+    """),
+    ('会员统计', 'member_stats', """
+        SELECT is_member, COUNT(*) AS 用户数量 FROM users
+        WHERE is_member IS NOT NULL
+        GROUP BY is_member ORDER BY is_member
+    """),
+)
+
+def _iter_cursor(cursor, chunk_size):
+    """分块读取游标，避免一次性 fetchall，每行转换为元组"""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        for row in rows:
+            yield tuple(row)
+
+def _iter_users_rows(conn, chunk_size):
+    """
+    流式读取用户数据并拼接 links_info 列
+
+    用户按 user_id 倒序读取，链接按 (user_id 倒序, id 正序) 读取，
+    两个游标做归并连接，内存中只保留当前用户的链接。
+
+    返回:
+        tuple: (列名列表, 行生成器)
+    """
+    users = conn.execute(f"SELECT {', '.join(USER_TABLE_COLUMNS)} FROM users ORDER BY user_id DESC")
+    columns = [description[0] for description in users.description] + ['links_info']
+    user_id_index = columns.index('user_id')
+
+    def rows():
+        links = conn.execute("""
+        SELECT user_id, link_type, link_url FROM user_links
+        ORDER BY user_id DESC, id
+        """)
+        links = _iter_cursor(links, chunk_size)
+        pending = next(links, None)
+        for user in _iter_cursor(users, chunk_size):
+            user_id = user[user_id_index]
+            # 跳过没有对应用户的链接
+            while pending is not None and pending[0] > user_id:
+                pending = next(links, None)
+            links_text = []
+            while pending is not None and pending[0] == user_id:
+                links_text.append(f"{pending[1]}: {pending[2]}")
+                pending = next(links, None)
+            yield user + ("\n".join(links_text),)
+
+    return columns, rows()
+
+def _iter_chunks(rows, chunk_size):
+    """把行生成器按块切分；没有数据时也生成一个空块，以便写出表结构"""
+    chunk = list(islice(rows, chunk_size))
+    yield chunk
+    while chunk:
+        chunk = list(islice(rows, chunk_size))
+        if chunk:
+            yield chunk
+
+def iter_sheets(conn, chunk_size=CHUNK_SIZE):
+    """
+    依次生成四个工作表的数据
+
+    返回:
+        生成器，每项为 (工作表名, 文件名, 列名列表, 行生成器)
+    """
+    for title, name, sql in SHEETS:
+        if sql is None:
+            columns, rows = _iter_users_rows(conn, chunk_size)
+        else:
+            cursor = conn.execute(sql)
+            columns = [description[0] for description in cursor.description]
+            rows = _iter_cursor(cursor, chunk_size)
+        yield title, name, columns, rows
+
+def _write_xlsx(output_path, sheets, chunk_size):
+    """
+    使用 openpyxl 只写模式逐行写入，内存占用不随行数增长
+
+    只写模式不检查 Excel 的单表行数上限，超过 XLSX_MAX_ROWS（含表头）的工作表
+    续写到 "链接数据_2"、"链接数据_3" 等续表中，每个续表重复表头
+    """
+    from openpyxl import Workbook
+
+    output_file = output_path.with_suffix('.xlsx')
+    workbook = Workbook(write_only=True)
+    for title, name, columns, rows in sheets:
+        worksheet = workbook.create_sheet(title)
+        worksheet.append(columns)
+        sheet_rows = 1
+        part = 1
+        for row in rows:
+            if sheet_rows >= XLSX_MAX_ROWS:
+                part += 1
+                worksheet = workbook.create_sheet(f"{title}_{part}")
+                worksheet.append(columns)
+                sheet_rows = 1
+            worksheet.append(row)
+            sheet_rows += 1
+    workbook.save(output_file)
+    return output_file
+
+def _write_csv(output_path, sheets, chunk_size):
+    """每个工作表写成一个 CSV 文件（UTF-8 BOM，便于 Excel 打开）"""
+    output_path.mkdir(parents=True, exist_ok=True)
+    for title, name, columns, rows in sheets:
+        with open(output_path / f"{name}.csv", 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+    return output_path
+
+def _write_jsonl_gz(output_path, sheets, chunk_size):
+    """每个工作表写成一个 gzip 压缩的 JSON Lines 文件"""
+    output_path.mkdir(parents=True, exist_ok=True)
+    for title, name, columns, rows in sheets:
+        with gzip.open(output_path / f"{name}.jsonl.gz", 'wt', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                f.write("\n")
+    return output_path
+
+def _write_parquet(output_path, sheets, chunk_size):
+    """每个工作表写成一个 Parquet 文件，按块写入 row group（需要 pyarrow）"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("导出 Parquet 需要 pyarrow，请先执行 pip install pyarrow")
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    for title, name, columns, rows in sheets:
+        writer = None
+        try:
+            for chunk in _iter_chunks(rows, chunk_size):
+                data = {column: [row[i] for row in chunk] for i, column in enumerate(columns)}
+                if writer is None:
+                    # 以第一块推断列类型，全为空的列按字符串处理
+                    inferred = pa.table(data).schema
+                    schema = pa.schema([
+                        pa.field(field.name, pa.string() if pa.types.is_null(field.type) else field.type)
+                        for field in inferred
+                    ])
+                    writer = pq.ParquetWriter(output_path / f"{name}.parquet", schema)
+                writer.write_table(pa.table(data, schema=schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    return output_path
+
+# 支持的导出格式
+EXPORT_FORMATS = {
+    'xlsx': _write_xlsx,
+    'csv': _write_csv,
+    'parquet': _write_parquet,
+    'jsonl.gz': _write_jsonl_gz,
+}
+
+def export_users_streaming(fmt='xlsx', output_dir=None, chunk_size=CHUNK_SIZE):
+    """
+    流式导出用户数据，内存占用与数据量无关
+
+    与 export_users_to_excel 输出相同的四个工作表（用户数据、链接数据、国家分布、会员统计）。
+    xlsx 格式输出一个工作簿文件（超过 Excel 行数上限的工作表拆分为续表），
+    其它格式输出一个目录，每个工作表一个文件。
+    所有工作表在同一个读事务中读取，来自同一个 WAL 快照，导出期间的写入不会造成表间不一致。
+
+    参数:
+        fmt: 导出格式，见 EXPORT_FORMATS
+        output_dir: 可选，输出目录，默认为 exports/
+        chunk_size: 每次从数据库读取的行数
+
+    返回:
+        Path: 导出文件（xlsx）或目录路径
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"未知的导出格式: {fmt}，可选: {', '.join(EXPORT_FORMATS)}")
+
+    output_dir = Path(output_dir) if output_dir else EXPORT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_path = output_dir / f"taskmonkey_users_info_{timestamp}"
+
+    conn = get_db_connection()
+    # 显式开启读事务，四个工作表的查询共用同一个快照
+    conn.execute("BEGIN")
+    try:
+        output = EXPORT_FORMATS[fmt](output_path, iter_sheets(conn, chunk_size), chunk_size)
+    finally:
+        # 只读事务，结束时回滚即可
+        conn.rollback()
+
+    print(f"数据已成功导出到: {output}")
+    return output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='流式导出用户数据')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='xlsx', help='导出格式')
+    parser.add_argument('--output-dir', default=None, help='输出目录，默认为 exports/')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='每次从数据库读取的行数')
+    args = parser.parse_args()
+
+    export_users_streaming(args.format, args.output_dir, args.chunk_size)
@@ -156,6 +156,1366 @@ def test_insert_users_array(init_test_db, sample_html_content):
     
     print("数据库插入和更新测试通过")
 
+def test_rate_limiter_limits_in_flight_and_rate():
+    """测试令牌桶限速器同时限制速率和并发数"""
+    import asyncio
+    import time
+    from rate_limiter import RateLimiter
+    
+    limiter = RateLimiter(rate=50, burst=1, max_in_flight=2)
+    state = {'in_flight': 0, 'max_in_flight': 0}
+    
+    async def request():
+        async with limiter:
+            state['in_flight'] += 1
+            state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+            await asyncio.sleep(0.01)
+            state['in_flight'] -= 1
+    
+    async def run():
+        await asyncio.gather(*(request() for _ in range(10)))
+    
+    start = time.monotonic()
+    asyncio.run(run())
+    elapsed = time.monotonic() - start
+    
+    assert state['max_in_flight'] <= 2
+    # 10 个请求、每秒 50 个令牌、桶容量 1，至少需要 9 个令牌间隔
+    assert elapsed >= 9 / 50 * 0.9
+
+def test_pipeline_processes_each_page_once(monkeypatch, sample_html_content):
+    """测试并发抓取时每页只入库一次且汇总数正确"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    import asyncio
+    import logging
+    import main
+    
+    class FakeSession:
+        def __init__(self):
+            self.urls = []
+        
+        async def fetch(self, url, save_to_file=None):
+            self.urls.append(url)
+            await asyncio.sleep(0)
+            return sample_html_content
+    
+    inserted_pages = []
+    
+    def fake_write(users_data, page_num=None, page_digest=None, run_id=None):
+        inserted_pages.append(users_data)
+        return 1, len(users_data) - 1, 0
+    
+    monkeypatch.setattr(main, 'write_users_array', fake_write)
+    monkeypatch.setattr(main, 'load_page_digests', dict)
+    
+    session = FakeSession()
+    pipeline = asyncio.run(main.run_pipeline(
+        session, range(1, 8), 7, logging.getLogger('test'), concurrency=3, save_dir=None
+    ))
+    new_users, updated_users = pipeline.total_new_users, pipeline.total_updated_users
+    
+    assert len(session.urls) == 7
+    assert len(set(session.urls)) == 7
+    assert len(inserted_pages) == 7
+    assert new_users == 7
+    assert new_users + updated_users == sum(len(page) for page in inserted_pages)
+
+@pytest.fixture
+def stub_server(sample_html_content):
+    """启动本地 HTTP 桩服务器，返回示例页面（支持 gzip 和 keep-alive）"""
+    import gzip
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    body = sample_html_content.encode('utf-8')
+    requests_log = []
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        
+        def do_GET(self):
+            requests_log.append({
+                'path': self.path,
+                'client_port': self.client_address[1],
+                'cookie': self.headers.get('Cookie', ''),
+                'accept_encoding': self.headers.get('Accept-Encoding', ''),
+            })
+            payload = body
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                payload = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    yield f"http://127.0.0.1:{server.server_address[1]}", requests_log
+    
+    server.shutdown()
+    server.server_close()
+
+def test_http_backend_against_stub_server(stub_server, sample_html_content):
+    """测试 HTTP 抓取后端：带 cookie、gzip 解压并复用连接"""
+    import asyncio
+    from fetch_backend import HttpBackend
+    
+    base_url, requests_log = stub_server
+    
+    async def run():
+        backend = HttpBackend({'session': 'abc'}, max_connections=2, domain='127.0.0.1')
+        async with backend:
+            return await asyncio.gather(*(
+                backend.fetch(f"{base_url}/api/user/index?orderBy=id&page={n}") for n in range(1, 9)
+            ))
+    
+    contents = asyncio.run(run())
+    
+    assert all(content == sample_html_content for content in contents)
+    assert len(extract_user_data(contents[0])) == len(extract_user_data(sample_html_content))
+    assert len(requests_log) == 8
+    assert all('session=abc' in request['cookie'] for request in requests_log)
+    assert all('gzip' in request['accept_encoding'] for request in requests_log)
+    # keep-alive：8 个请求最多使用连接池中的 2 个连接
+    assert len({request['client_port'] for request in requests_log}) <= 2
+
+def test_http_backend_returns_empty_on_error():
+    """测试 HTTP 抓取后端出错时返回空字符串"""
+    import asyncio
+    from fetch_backend import HttpBackend
+    
+    async def run():
+        async with HttpBackend(timeout=1.0) as backend:
+            return await backend.fetch("http://127.0.0.1:1/unreachable")
+    
+    assert asyncio.run(run()) == ""
+
+def test_crawl_session_shares_fetch_backend():
+    """测试浏览器会话是 FetchBackend 子类，与 HTTP 后端共用 fetch 的保存和错误处理"""
+    import asyncio
+    from crawl_session import CrawlSession
+    from fetch_backend import FetchBackend, create_backend
+
+    assert issubclass(CrawlSession, FetchBackend)
+    assert CrawlSession.fetch is FetchBackend.fetch
+    assert isinstance(create_backend('playwright', concurrency=2), CrawlSession)
+
+    # 不启动浏览器，只替换 get 验证继承来的 fetch 行为
+    class FailingSession(CrawlSession):
+        async def get(self, url):
+            raise RuntimeError("boom")
+
+    assert asyncio.run(FailingSession().fetch("http://example.invalid")) == ""
+
+def test_pipeline_stats_and_backpressure(sample_html_content):
+    """测试流水线各阶段计数和队列深度不超过容量"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    import asyncio
+    import logging
+    from pipeline import CrawlPipeline
+    
+    class FakeSession:
+        async def fetch(self, url, save_to_file=None):
+            await asyncio.sleep(0)
+            return "" if url.endswith("page=3") else sample_html_content
+    
+    written = []
+    
+    def slow_writer(users_data, page_num=None, page_digest=None, run_id=None):
+        import time
+        time.sleep(0.01)
+        written.append(len(users_data))
+        return len(users_data), 0, 0
+    
+    pipeline = CrawlPipeline(
+        FakeSession(), logging.getLogger('test'),
+        concurrency=4, queue_size=1, writer=slow_writer, save_dir=None
+    )
+    new_users, changed_users, unchanged_users = asyncio.run(pipeline.run(range(1, 11), 10))
+    
+    snapshot = pipeline.stats.snapshot()
+    assert snapshot['stages']['fetch']['items'] == 9
+    assert snapshot['stages']['fetch']['errors'] == 1
+    assert snapshot['stages']['parse']['items'] == 9
+    assert snapshot['stages']['write']['items'] == 9
+    assert new_users == sum(written)
+    for queue in snapshot['queues'].values():
+        assert queue['max_depth'] <= queue['capacity'] == 1
+
+def test_pipeline_fails_fast_when_worker_crashes(sample_html_content):
+    """测试解析协程在逐页错误处理之外出错时，流水线立即抛出异常而不是阻塞在已满的队列上"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    import asyncio
+    import logging
+    from concurrent.futures import ThreadPoolExecutor
+    from pipeline import CrawlPipeline
+    
+    class FakeSession:
+        async def fetch(self, url, save_to_file=None):
+            await asyncio.sleep(0)
+            return sample_html_content
+    
+    def bad_parser(html_content):
+        # 缺少 user_id 的行使解析后的统计代码出错
+        return [{'email': 'broken@example.com'}]
+    
+    pipeline = CrawlPipeline(
+        FakeSession(), logging.getLogger('test'), concurrency=2, queue_size=1,
+        parser=bad_parser, parse_executor=ThreadPoolExecutor(max_workers=1), save_dir=None
+    )
+    with pytest.raises(KeyError):
+        asyncio.run(asyncio.wait_for(pipeline.run(range(1, 21), 20), timeout=10))
+
+def test_parser_engines_produce_identical_output(sample_html_content):
+    """测试 lxml 快速解析引擎与 bs4 引擎输出完全一致"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    bs4_users = extract_user_data(sample_html_content, engine='bs4')
+    lxml_users = extract_user_data(sample_html_content, engine='lxml')
+    
+    assert len(bs4_users) > 0
+    assert lxml_users == bs4_users
+    assert all(user['remark'] for user in lxml_users)
+    assert all(user['links'] for user in lxml_users)
+    assert extract_user_data("<html><body></body></html>", engine='lxml') == []
+    
+    with pytest.raises(ValueError):
+        extract_user_data(sample_html_content, engine='unknown')
+
+def _new_memory_db():
+    """创建带完整表结构的内存数据库"""
+    from db_config import init_schema
+    
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    init_schema(conn)
+    return conn
+
+def _dump_db(conn):
+    """导出用户和链接数据（忽略 updated_at、row_hash 和链接自增ID）用于比较"""
+    from insert_users_array_to_db import USER_COLUMNS
+    
+    users = [tuple(row) for row in conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY user_id")]
+    links = [tuple(row) for row in conn.execute(
+        "SELECT user_id, link_type, link_url FROM user_links ORDER BY user_id, id"
+    )]
+    return users, links
+
+def test_upsert_users_batch_matches_row_by_row(sample_html_content):
+    """测试批量写入与逐条写入的结果和计数一致"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    from insert_users_array_to_db import insert_or_update_user, upsert_users_batch
+    
+    users_data = extract_user_data(sample_html_content)
+    changed = [dict(user, remark="测试更新", links=user['links'][:2]) for user in users_data[:4]]
+    # 同一批次中重复出现的用户：第一次算新增，第二次算更新
+    rounds = [users_data[:6], users_data + changed]
+    
+    row_conn = _new_memory_db()
+    batch_conn = _new_memory_db()
+    
+    for users in rounds:
+        row_counts = [0, 0]
+        for user_data in users:
+            row_counts[0 if insert_or_update_user(row_conn, user_data) else 1] += 1
+        row_conn.commit()
+        
+        batch_counts = upsert_users_batch(batch_conn, users, batch_size=3)
+        batch_conn.commit()
+        
+        assert row_counts == [batch_counts.new, batch_counts.changed + batch_counts.unchanged]
+        assert _dump_db(row_conn) == _dump_db(batch_conn)
+    
+    row_conn.close()
+    batch_conn.close()
+
+def test_upsert_users_batch_skips_unchanged_rows():
+    """测试指纹相同的用户不会被重写，只有内容变化的用户才更新"""
+    from insert_users_array_to_db import upsert_users_batch
+    from benchmarks.synthetic import make_users
+    
+    users_data = make_users(30)
+    conn = _new_memory_db()
+    assert upsert_users_batch(conn, users_data) == (30, 0, 0)
+    conn.commit()
+    
+    # 完全相同的数据不产生任何写入
+    before = conn.total_changes
+    assert upsert_users_batch(conn, users_data) == (0, 0, 30)
+    assert conn.total_changes == before
+    
+    # 只有字段或链接变化的用户被更新
+    users_data[0] = dict(users_data[0], credit_balance=999.0)
+    users_data[1] = dict(users_data[1], links=[{'link_type': '查看订单', 'link_url': '/orders/new'}])
+    assert upsert_users_batch(conn, users_data) == (0, 2, 28)
+    conn.commit()
+    
+    row = conn.execute("SELECT credit_balance FROM users WHERE user_id = ?", (users_data[0]['user_id'],)).fetchone()
+    assert row[0] == 999.0
+    links = conn.execute("SELECT link_url FROM user_links WHERE user_id = ?", (users_data[1]['user_id'],)).fetchall()
+    assert [link[0] for link in links] == ['/orders/new']
+    conn.close()
+
+def test_upsert_users_batch_large_replay(sample_html_content):
+    """测试批量写入大量用户时计数准确"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    from insert_users_array_to_db import upsert_users_batch
+    
+    template = extract_user_data(sample_html_content)[0]
+    users_data = [
+        dict(template, user_id=user_id, links=[{'link_type': '查看订单', 'link_url': f'/orders/{user_id}'}])
+        for user_id in range(1, 20001)
+    ]
+    
+    conn = _new_memory_db()
+    assert upsert_users_batch(conn, users_data) == (20000, 0, 0)
+    assert upsert_users_batch(conn, users_data[:15000] + [dict(template, user_id=20001)]) == (1, 0, 15000)
+    conn.commit()
+    
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 20001
+    assert conn.execute("SELECT COUNT(*) FROM user_links").fetchone()[0] == 20000 + len(template['links'])
+    conn.close()
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """将 DB_PATH 和页面存档目录指向临时目录"""
+    import db_config
+    import page_archive
+    
+    db_config.close_db_connection()
+    db_path = tmp_path / 'users.db'
+    monkeypatch.setattr(db_config, 'DB_PATH', db_path)
+    monkeypatch.setattr(page_archive, 'ARCHIVE_DIR', tmp_path / 'page_archive')
+    yield db_path
+    db_config.close_db_connection()
+
+def test_connection_manager_reuses_connection(temp_db, monkeypatch, sample_html_content):
+    """测试连接管理器：连接复用、WAL 模式、表结构只初始化一次"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    import db_config
+    
+    init_calls = []
+    original_create_tables = db_config.create_tables
+    
+    def counting_create_tables(conn):
+        init_calls.append(conn)
+        original_create_tables(conn)
+    
+    monkeypatch.setattr(db_config, 'create_tables', counting_create_tables)
+    
+    users_data = extract_user_data(sample_html_content)
+    assert insert_users_array(users_data) == (len(users_data), 0)
+    assert insert_users_array(users_data) == (0, len(users_data))
+    
+    conn = get_db_connection()
+    assert conn is get_db_connection()
+    assert len(init_calls) == 1
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+
+def test_reader_not_blocked_by_writer(temp_db):
+    """测试 WAL 模式下写事务未提交时其它连接仍可读取"""
+    import threading
+    import db_config
+    
+    writer = get_db_connection()
+    writer.execute("INSERT INTO users (user_id, email, create_time) VALUES (1, 'a@b.c', '2025-01-01')")
+    writer.commit()
+    
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("INSERT INTO users (user_id, email, create_time) VALUES (2, 'd@e.f', '2025-01-01')")
+    
+    counts = []
+    
+    def read():
+        reader = db_config.connect()
+        counts.append(reader.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+        reader.close()
+    
+    thread = threading.Thread(target=read)
+    thread.start()
+    thread.join(timeout=5)
+    writer.commit()
+    
+    assert counts == [1]
+
+def _query_plan(conn, sql, params=()):
+    """返回 EXPLAIN QUERY PLAN 的描述文本"""
+    return ' | '.join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+def test_migrations_upgrade_existing_db(tmp_path, sample_html_content):
+    """测试迁移能升级已有的旧版本数据库且数据不丢失"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    from db_config import create_tables, get_schema_version, migrate, SCHEMA_VERSION
+    from insert_users_array_to_db import insert_or_update_user
+    
+    # 模拟迁移机制出现之前创建的 users.db
+    conn = sqlite3.connect(tmp_path / 'users.db')
+    create_tables(conn)
+    users_data = extract_user_data(sample_html_content)
+    for user_data in users_data:
+        insert_or_update_user(conn, user_data)
+    conn.commit()
+    assert get_schema_version(conn) == 0
+    
+    assert migrate(conn)[-1] == SCHEMA_VERSION
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    assert migrate(conn) == []
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == len(users_data)
+    # 已有用户的当前值作为历史基线
+    assert conn.execute("SELECT COUNT(*) FROM user_history").fetchone()[0] == len(users_data)
+    conn.close()
+
+def test_query_plans_use_indexes():
+    """查询计划回归测试：高频过滤条件必须走索引"""
+    conn = _new_memory_db()
+    
+    plan = _query_plan(conn, "SELECT link_type, link_url FROM user_links WHERE user_id = ?", (1,))
+    assert 'idx_user_links_user_id' in plan
+    
+    plan = _query_plan(conn, "DELETE FROM user_links WHERE user_id IN (?, ?)", (1, 2))
+    assert 'idx_user_links_user_id' in plan
+    
+    plan = _query_plan(conn, "SELECT COUNT(*) FROM users WHERE is_member = '是'")
+    assert 'idx_users_is_member' in plan
+    
+    plan = _query_plan(conn, "SELECT country, COUNT(*) FROM users GROUP BY country")
+    assert 'idx_users_country' in plan
+    assert 'TEMP B-TREE' not in plan
+    conn.close()
+
+def test_query_users_batches_links_and_pages(temp_db, sample_html_content):
+    """测试 query_users 一次查询链接、键集分页和列投影"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    from query_db import query_users
+    
+    users_data = extract_user_data(sample_html_content)
+    insert_users_array(users_data)
+    expected = {user['user_id']: user for user in users_data}
+    
+    statements = []
+    get_db_connection().set_trace_callback(statements.append)
+    users = query_users(limit=len(users_data))
+    get_db_connection().set_trace_callback(None)
+    
+    # 除缓存的数据版本检查外，一次查用户，一次查链接，不再每个用户查一次
+    statements = [sql for sql in statements if 'data_version' not in sql]
+    assert len(statements) == 2
+    assert [user['user_id'] for user in users] == sorted(expected, reverse=True)
+    for user in users:
+        assert user['links'] == expected[user['user_id']]['links']
+        assert user['email'] == expected[user['user_id']]['email']
+    
+    # 键集分页：逐页取完所有用户，无重复无遗漏
+    paged = []
+    after_user_id = None
+    while True:
+        page = query_users(limit=3, after_user_id=after_user_id, include_links=False)
+        if not page:
+            break
+        paged.extend(user['user_id'] for user in page)
+        after_user_id = page[-1]['user_id']
+    assert paged == sorted(expected, reverse=True)
+    
+    # 列投影
+    projected = query_users(limit=2, columns=['email', 'country'])
+    assert set(projected[0]) == {'user_id', 'email', 'country', 'links'}
+    with pytest.raises(ValueError):
+        query_users(columns=['password'])
+
+def test_build_links_summary_matches_per_user_loop():
+    """测试向量化链接汇总与逐用户过滤的旧实现结果一致"""
+    import pandas as pd
+    from export_to_excel import build_links_summary
+    
+    users_df = pd.DataFrame({'user_id': [5, 4, 3, 2, 1]})
+    links_df = pd.DataFrame({
+        'id': [1, 2, 3, 4, 5],
+        'user_id': [1, 3, 1, 5, 3],
+        'link_type': ['查看订单', '查看订单', '登录记录', '充值记录', '扫描记录'],
+        'link_url': ['/orders/1', '/orders/3', '/login/1', '/paylog/5', '/fail/3'],
+    })
+    
+    expected = []
+    for user_id in users_df['user_id']:
+        user_links = links_df[links_df['user_id'] == user_id]
+        expected.append("\n".join(f"{link['link_type']}: {link['link_url']}" for _, link in user_links.iterrows()))
+    
+    assert build_links_summary(users_df, links_df).tolist() == expected
+    assert build_links_summary(users_df, links_df.iloc[0:0]).tolist() == [""] * 5
+
+def test_streaming_export_matches_excel_export(temp_db, tmp_path, monkeypatch):
+    """测试流式导出与 export_users_to_excel 的四个工作表内容一致"""
+    import gzip
+    import pandas as pd
+    from export_to_excel import export_users_to_excel
+    from stream_export import export_users_streaming
+    from benchmarks.synthetic import make_users
+    
+    users_data = make_users(50)
+    users_data[3]['links'] = []
+    insert_users_array(users_data)
+    
+    expected = pd.read_excel(export_users_to_excel(tmp_path / 'pandas'), sheet_name=None)
+    actual = pd.read_excel(export_users_streaming('xlsx', tmp_path / 'stream', chunk_size=7), sheet_name=None)
+    
+    assert list(actual) == ['用户数据', '链接数据', '国家分布', '会员统计']
+    for sheet_name, expected_df in expected.items():
+        pd.testing.assert_frame_equal(actual[sheet_name], expected_df, check_dtype=False)
+    
+    csv_dir = export_users_streaming('csv', tmp_path / 'csv', chunk_size=7)
+    users_csv = pd.read_csv(csv_dir / 'users.csv', encoding='utf-8-sig', keep_default_na=False)
+    assert users_csv['links_info'].tolist() == expected['用户数据']['links_info'].fillna('').tolist()
+    
+    jsonl_dir = export_users_streaming('jsonl.gz', tmp_path / 'jsonl', chunk_size=7)
+    with gzip.open(jsonl_dir / 'links.jsonl.gz', 'rt', encoding='utf-8') as f:
+        assert sum(1 for _ in f) == len(expected['链接数据'])
+    
+    # 超过单表行数上限时拆分为续表，每个续表重复表头，数据不丢失
+    import stream_export
+    monkeypatch.setattr(stream_export, 'XLSX_MAX_ROWS', 40)
+    split = pd.read_excel(export_users_streaming('xlsx', tmp_path / 'split', chunk_size=7), sheet_name=None)
+    link_sheets = [name for name in split if name.startswith('链接数据')]
+    assert link_sheets[:2] == ['链接数据', '链接数据_2']
+    assert all(len(split[name]) <= 39 for name in split)
+    pd.testing.assert_frame_equal(pd.concat([split[name] for name in link_sheets], ignore_index=True),
+                                  expected['链接数据'], check_dtype=False)
+    
+    pytest.importorskip('pyarrow')
+    parquet_dir = export_users_streaming('parquet', tmp_path / 'parquet', chunk_size=7)
+    users_parquet = pd.read_parquet(parquet_dir / 'users.parquet')
+    assert users_parquet['user_id'].tolist() == expected['用户数据']['user_id'].tolist()
+
+def test_streaming_export_reads_one_snapshot(temp_db, tmp_path, monkeypatch):
+    """测试流式导出的所有工作表来自同一个快照，导出期间的写入不会混入后面的工作表"""
+    import threading
+    import pandas as pd
+    import stream_export
+    from benchmarks.synthetic import make_users
+
+    insert_users_array(make_users(30))
+
+    def write_during_export(output_path, sheets, chunk_size):
+        # 写完用户数据表后，由另一个线程（另一个连接）插入新用户
+        def consume():
+            for index, (title, name, columns, rows) in enumerate(sheets):
+                yield title, name, columns, rows
+                if index == 0:
+                    writer = threading.Thread(target=insert_users_array, args=(make_users(10, start_id=1000),))
+                    writer.start()
+                    writer.join()
+        return stream_export._write_csv(output_path, consume(), chunk_size)
+
+    monkeypatch.setitem(stream_export.EXPORT_FORMATS, 'csv', write_during_export)
+    csv_dir = stream_export.export_users_streaming('csv', tmp_path / 'csv')
+
+    users = pd.read_csv(csv_dir / 'users.csv', encoding='utf-8-sig')
+    country = pd.read_csv(csv_dir / 'country_stats.csv', encoding='utf-8-sig')
+    links = pd.read_csv(csv_dir / 'links.csv', encoding='utf-8-sig')
+    assert len(users) == 30
+    assert country['用户数量'].sum() == users['country'].notna().sum()
+    assert set(links['user_id']) <= set(users['user_id'])
+    # 新用户已提交，导出结束后可见
+    assert get_db_connection().execute("SELECT COUNT(*) FROM users").fetchone()[0] == 40
+
+def test_exports_and_queries_hide_internal_columns(temp_db, tmp_path):
+    """测试导出文件和查询结果只包含公开列，不包含内部的 row_hash 指纹列"""
+    import pandas as pd
+    from export_to_excel import export_users_to_excel
+    from stream_export import export_users_streaming
+    from query_db import query_users, search_users
+    from user_record import USER_TABLE_COLUMNS
+    from benchmarks.synthetic import make_users
+    
+    insert_users_array(make_users(20))
+    assert get_db_connection().execute("SELECT COUNT(row_hash) FROM users").fetchone()[0] == 20
+    
+    public = list(USER_TABLE_COLUMNS) + ['links_info']
+    excel = pd.read_excel(export_users_to_excel(tmp_path / 'pandas'), sheet_name='用户数据')
+    assert list(excel.columns) == public
+    stream = pd.read_excel(export_users_streaming('xlsx', tmp_path / 'stream'), sheet_name='用户数据')
+    assert list(stream.columns) == public
+    csv_dir = export_users_streaming('csv', tmp_path / 'csv')
+    assert list(pd.read_csv(csv_dir / 'users.csv', encoding='utf-8-sig').columns) == public
+    
+    users = query_users(limit=5) + search_users('user1') + search_users('@')
+    assert users
+    for user in users:
+        assert 'row_hash' not in user
+        assert set(USER_TABLE_COLUMNS) <= set(user)
+
+class FakeSiteSession:
+    """按页码返回合成页面的假抓取会话，记录抓取过的页码"""
+    
+    def __init__(self, pages, failures=None):
+        """
+        参数:
+            pages: {页码: 页面HTML}
+            failures: 可选，{页码: 前几次抓取失败的次数}
+        """
+        self.pages = pages
+        self.failures = dict(failures or {})
+        self.fetched = []
+    
+    async def fetch(self, url, save_to_file=None):
+        import asyncio
+        from urllib.parse import parse_qs, urlparse
+        
+        await asyncio.sleep(0)
+        page_num = int(parse_qs(urlparse(url).query)['page'][0])
+        self.fetched.append(page_num)
+        if self.failures.get(page_num, 0) > 0:
+            self.failures[page_num] -= 1
+            return ""
+        return self.pages.get(page_num, "")
+
+def test_incremental_crawl_stops_at_known_users(temp_db):
+    """测试增量采集只抓取包含新用户的页和最近几页，并在遇到已知用户时停止"""
+    import asyncio
+    import logging
+    import main
+    from benchmarks.synthetic import make_site
+    from crawl_state import get_watermarks, update_watermarks
+    
+    logger = logging.getLogger('test')
+    config = main.CrawlConfig(incremental=True, recent_pages=1, rate=0)
+    
+    def crawl(count):
+        users, pages = make_site(count)
+        session = FakeSiteSession(pages)
+        result = asyncio.run(main.crawl_until_watermark(session, len(pages), count, logger, config, None))
+        return sorted(session.fetched), result
+    
+    # 没有水位记录时全量采集
+    fetched, (new_users, changed_users, unchanged_users, skipped_pages) = crawl(55)
+    assert fetched == [1, 2, 3, 4, 5, 6]
+    assert new_users == 55
+    assert get_watermarks() == {'max_user_id': 55, 'total_users': 55}
+    
+    # 新增 23 个用户：3 页新用户 + 1 页最近页
+    fetched, (new_users, changed_users, unchanged_users, skipped_pages) = crawl(78)
+    assert fetched == [1, 2, 3, 4]
+    assert new_users == 23
+    assert get_watermarks() == {'max_user_id': 78, 'total_users': 78}
+    
+    # 用户总数估计偏低时，继续向后抓取直到遇到已知用户
+    update_watermarks(78, 100)
+    fetched, (new_users, changed_users, unchanged_users, skipped_pages) = crawl(100)
+    assert fetched == [1, 2, 3]
+    assert new_users == 22
+    assert get_watermarks()['max_user_id'] == 100
+
+def test_unchanged_pages_skip_parse_and_write(temp_db):
+    """测试页面表格内容与上次入库时相同时跳过解析和入库"""
+    import asyncio
+    import logging
+    import main
+    from benchmarks.synthetic import make_site, render_page
+    
+    logger = logging.getLogger('test')
+    users, pages = make_site(30)
+    
+    def run(pages):
+        return asyncio.run(main.run_pipeline(FakeSiteSession(pages), range(1, 4), 3, logger))
+    
+    pipeline = run(pages)
+    assert (pipeline.total_new_users, pipeline.unchanged_pages) == (30, set())
+    
+    # 页面头部（总数等）变化不影响摘要
+    pipeline = run({page_num: render_page(users[(page_num - 1) * 10:page_num * 10], 31) for page_num in pages})
+    assert pipeline.unchanged_pages == {1, 2, 3}
+    assert pipeline.stats.stages['parse'].items == 0
+    
+    # 只修改第 2 页中一个用户的备注
+    users[15]['remark'] = '已修改备注'
+    pages[2] = render_page(users[10:20], 30)
+    pipeline = run(pages)
+    assert pipeline.unchanged_pages == {1, 3}
+    assert (pipeline.total_new_users, pipeline.total_changed_users, pipeline.total_unchanged_users) == (0, 1, 9)
+    
+    # 采集汇总中单独统计跳过的页数
+    totals = main.CrawlTotals()
+    totals.add(pipeline)
+    assert totals.result() == (0, 1, 9, 2)
+
+def test_failed_pages_retried_and_resumed(temp_db):
+    """测试失败页按退避重试，仍失败的页被记录下来并在下次运行时续跑"""
+    import asyncio
+    import logging
+    import main
+    from benchmarks.synthetic import make_site
+    from crawl_state import CrawlJob, get_watermarks
+    
+    logger = logging.getLogger('test')
+    users, pages = make_site(60)
+    
+    def crawl(failures, retries):
+        config = main.CrawlConfig(rate=0, retries=retries, retry_delay=0)
+        session = FakeSiteSession(pages, failures)
+        result = asyncio.run(main.crawl_until_watermark(session, len(pages), 60, logger, config, None))
+        return session.fetched, result
+    
+    # 第 2 页失败两次后在重试中成功；第 5 页始终失败
+    fetched, (new_users, changed_users, unchanged_users, skipped_pages) = crawl({2: 2, 5: 99}, retries=2)
+    assert sorted(fetched) == [1, 2, 2, 2, 3, 4, 5, 5, 5, 6]
+    assert new_users == 50
+    job = CrawlJob()
+    assert job.is_running()
+    assert job.missing_pages() == [5]
+    assert job.failures()[5][0] == 3
+    assert get_watermarks()['max_user_id'] is None
+    
+    # 下次运行只抓取缺失的页，成功后结束任务并更新水位
+    fetched, (new_users, changed_users, unchanged_users, skipped_pages) = crawl({}, retries=2)
+    assert fetched == [5]
+    assert new_users == 10
+    assert not job.is_running()
+    assert job.missing_pages() == []
+    assert get_watermarks() == {'max_user_id': 60, 'total_users': 60}
+
+def test_crawl_metrics_summary_and_prometheus(temp_db, tmp_path):
+    """测试各阶段指标：抓取、解析、入库和重试都被计数，运行结束写出 JSON 摘要和 Prometheus 文本"""
+    import re
+    import json
+    import asyncio
+    import logging
+    import main
+    from metrics import CrawlMetrics, Histogram
+    from benchmarks.synthetic import make_site
+    
+    users, pages = make_site(60)
+    metrics = CrawlMetrics()
+    config = main.CrawlConfig(rate=0, retries=1, retry_delay=0)
+    session = FakeSiteSession(pages, {2: 1, 5: 99})
+    asyncio.run(main.crawl_until_watermark(session, len(pages), 60, logging.getLogger('test'), config, None,
+                                           metrics))
+    
+    # 第 2 页在重试中成功，第 5 页两次都失败
+    assert metrics.fetch_seconds.count == len(session.fetched) == 8
+    assert metrics.pages_fetched.value == 5
+    assert metrics.fetch_errors.value == 3
+    assert metrics.page_bytes.count == 5 and metrics.page_bytes.sum == sum(
+        len(pages[page_num].encode('utf-8')) for page_num in (1, 2, 3, 4, 6))
+    assert metrics.parse_seconds.count == metrics.upsert_seconds.count == 5
+    assert metrics.users_parsed.value == 50
+    assert metrics.rows_written['new'].value == 50
+    assert metrics.retry_rounds.value == 1 and metrics.retry_pages.value == 2
+    assert metrics.info['missing_pages'] == [5]
+    
+    metrics.finish(result={'new_users': 50})
+    summary_file, prometheus_file = metrics.write(tmp_path)
+    summary = json.loads(summary_file.read_text(encoding='utf-8'))
+    assert summary['metrics']['rows_written_total']['result=new'] == 50
+    assert summary['metrics']['fetch_seconds']['count'] == 8
+    assert summary['bytes_per_page'] == round(metrics.page_bytes.sum / 5, 1)
+    
+    text = prometheus_file.read_text(encoding='utf-8')
+    assert '# TYPE taskmonkey_fetch_seconds histogram' in text
+    assert 'taskmonkey_fetch_seconds_bucket{le="+Inf"} 8' in text
+    assert 'taskmonkey_rows_written_total{result="new"} 50' in text
+    for line in text.splitlines():
+        assert line.startswith('# ') or re.match(r'^taskmonkey_\w+(\{[^}]*\})? [-+\w.]+$', line), line
+    
+    # 分位数按桶插值估算
+    histogram = Histogram(buckets=(1, 2, 3, 4))
+    for value in (0.5, 1.5, 2.5, 3.5):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == pytest.approx(2.0)
+    assert histogram.snapshot()['max'] == 3.5
+    assert Histogram().quantile(0.5) is None
+
+def test_cookie_manager_reuses_cache_until_expiry(tmp_path):
+    """测试 cookie 缓存跨运行复用，快过期时才重新获取"""
+    import asyncio
+    from cookie_cache import CookieManager
+    
+    now = [1000.0]
+    calls = []
+    
+    async def bootstrap():
+        calls.append(now[0])
+        return {'token': f'v{len(calls)}'}, now[0] + 3600
+    
+    def manager():
+        return CookieManager(bootstrap, path=tmp_path / 'cookies.json', margin=300, clock=lambda: now[0])
+    
+    assert asyncio.run(manager().get()) == {'token': 'v1'}
+    
+    # 新的运行直接读取磁盘缓存
+    now[0] += 3000
+    assert asyncio.run(manager().get()) == {'token': 'v1'}
+    assert len(calls) == 1
+    
+    # 进入提前刷新窗口后重新获取
+    now[0] += 400
+    assert asyncio.run(manager().get()) == {'token': 'v2'}
+    assert len(calls) == 2
+
+def test_authenticated_session_refreshes_once_when_logged_out(tmp_path, sample_html_content):
+    """测试页面显示未登录时只刷新一次 cookie，并重试所有受影响的请求"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    import asyncio
+    from cookie_cache import CookieManager, AuthenticatedSession
+    
+    class ExpiringSession:
+        def __init__(self):
+            self.cookies = {'token': 'old'}
+        
+        async def set_cookies(self, cookies):
+            self.cookies = dict(cookies)
+        
+        async def get(self, url):
+            await asyncio.sleep(0)
+            if self.cookies.get('token') == 'old':
+                return "<html><body>请先登录</body></html>"
+            return sample_html_content
+    
+    refreshes = []
+    
+    async def bootstrap():
+        await asyncio.sleep(0.01)
+        refreshes.append(1)
+        return {'token': 'new'}, None
+    
+    async def run():
+        manager = CookieManager(bootstrap, path=tmp_path / 'cookies.json')
+        manager.cookies, manager.expires_at = {'token': 'old'}, float('inf')
+        session = AuthenticatedSession(ExpiringSession(), manager)
+        return await asyncio.gather(*(session.fetch(f"https://example.com/?page={i}") for i in range(5)))
+    
+    contents = asyncio.run(run())
+    assert contents == [sample_html_content] * 5
+    assert len(refreshes) == 1
+    assert (tmp_path / 'cookies.json').exists()
+
+def test_reingest_rebuilds_db_from_archive(temp_db, tmp_path):
+    """测试离线重新导入：并行解析存档页面并重建数据库"""
+    from db_config import get_db_connection
+    from reingest import reingest
+    from benchmarks.synthetic import make_site, make_users
+    
+    users, pages = make_site(55)
+    archive_dir = tmp_path / 'archive'
+    archive_dir.mkdir()
+    for page_num, html in pages.items():
+        (archive_dir / f'page_{page_num}.html').write_text(html, encoding='utf-8')
+    (archive_dir / 'page_99.html').write_text("<html>请先登录</html>", encoding='utf-8')
+    
+    # 重建前库中有一个存档里没有的用户，以及用户数据之外的采集记录和历史
+    from crawl_state import begin_run
+    from insert_users_array_to_db import write_users_array
+    
+    write_users_array(make_users(1, start_id=1000), run_id=begin_run('before'))
+    conn = get_db_connection()
+    
+    # 没有可导入的页面或有页面出错时不提交，原数据保留
+    empty_dir = tmp_path / 'empty'
+    empty_dir.mkdir()
+    assert reingest(empty_dir, workers=1, rebuild=True)['rebuilt'] is False
+    (archive_dir / 'page_100.html').write_bytes(b'\xff\xfe')
+    result = reingest(archive_dir, workers=2, batch_size=20, rebuild=True)
+    assert (result['rebuilt'], len(result['errors'])) == (False, 1)
+    assert [row[0] for row in conn.execute("SELECT user_id FROM users")] == [1000]
+    (archive_dir / 'page_100.html').unlink()
+    
+    version = conn.execute("SELECT version FROM data_version").fetchone()[0]
+    result = reingest(archive_dir, workers=2, batch_size=20, rebuild=True)
+    assert (result['files'], result['pages'], result['empty'], result['errors']) == (7, 6, 1, {})
+    assert (result['users'], result['new'], result['rebuilt']) == (55, 55, True)
+    assert result['pages_per_second'] > 0
+    
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 55
+    assert conn.execute("SELECT COUNT(*) FROM users WHERE user_id = 1000").fetchone()[0] == 0
+    assert conn.execute("SELECT version FROM data_version").fetchone()[0] > version
+    # 重建只替换用户数据，采集记录和用户历史保留
+    assert conn.execute("SELECT COUNT(*) FROM crawl_runs").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM user_history WHERE user_id = 1000").fetchone()[0] == 1
+    
+    # 再次导入到现有数据库时全部未变化
+    result = reingest(archive_dir, workers=2)
+    assert (result['new'], result['changed'], result['unchanged']) == (0, 0, 55)
+
+def test_page_archive_deduplicates_and_reingests(temp_db, tmp_path):
+    """测试页面存档压缩去重、按采集和页码读回，并可从存档重新导入"""
+    from page_archive import PageArchive
+    from reingest import reingest
+    from benchmarks.synthetic import make_site
+    
+    users, pages = make_site(55)
+    archive = PageArchive(tmp_path / 'archive', codec='gz')
+    first_run = archive.begin_run('run1', page_total=len(pages))
+    for page_num, html in pages.items():
+        archive.save_page(page_num, html)
+    blobs_after_first_run = archive.stats()['blobs']
+    
+    # 第二次采集内容相同，只新增索引不新增数据块
+    archive.begin_run('run2', page_total=len(pages))
+    for page_num, html in pages.items():
+        archive.save_page(page_num, html)
+    
+    stats = archive.stats()
+    assert (stats['runs'], stats['snapshots'], stats['blobs']) == (2, 12, blobs_after_first_run)
+    # 同一次采集的页面头部只存一份
+    assert blobs_after_first_run == len(pages) + 1
+    assert stats['ratio'] > 5
+    assert archive.load_page(first_run, 3) == pages[3]
+    assert dict(archive.iter_run('run2')) == pages
+    assert archive.latest_run() == 'run2'
+    
+    # 只抓取了部分页面的采集（增量、续跑）不算作最近一次完整采集
+    archive.begin_run('run3', page_total=len(pages))
+    archive.save_page(1, pages[1])
+    archive.save_page(2, pages[2])
+    assert archive.latest_run() == 'run2'
+    assert archive.latest_run(complete=False) == 'run3'
+    archive.close()
+    
+    result = reingest(tmp_path / 'archive', workers=1, run_id='latest')
+    assert (result['files'], result['new'], result['errors']) == (6, 55, {})
+    
+    # 不指定目录和采集时默认读取默认页面存档中最近一次完整采集
+    default_archive = PageArchive()
+    default_archive.begin_run('run3', page_total=len(pages))
+    for page_num, html in pages.items():
+        default_archive.save_page(page_num, html)
+    default_archive.begin_run('run4', page_total=len(pages))
+    default_archive.save_page(1, pages[1])
+    default_archive.close()
+    result = reingest(workers=1)
+    assert (result['files'], result['unchanged'], result['errors']) == (6, 55, {})
+    
+    # 重建会清空用户数据，不允许省略数据来源
+    with pytest.raises(ValueError):
+        reingest(workers=1, rebuild=True)
+
+def test_reingest_rebuild_rejects_partial_source(temp_db, tmp_path):
+    """测试从只包含部分页面的采集重建时回滚，users 表保持不变"""
+    from db_config import get_db_connection
+    from page_archive import PageArchive
+    from crawl_state import update_watermarks
+    from reingest import reingest
+    from benchmarks.synthetic import make_site
+    
+    users, pages = make_site(60)
+    archive = PageArchive()
+    archive.begin_run('full', page_total=len(pages))
+    for page_num, html in pages.items():
+        archive.save_page(page_num, html)
+    archive.begin_run('partial', page_total=len(pages))
+    archive.save_page(1, pages[1])
+    archive.save_page(2, pages[2])
+    archive.close()
+    
+    assert reingest(workers=1)['new'] == 60
+    conn = get_db_connection()
+    before = [tuple(row) for row in conn.execute("SELECT * FROM users ORDER BY user_id")]
+    
+    # 没有采集水位时以重建前的用户数为准
+    result = reingest(workers=1, rebuild=True, run_id='partial')
+    assert (result['rebuilt'], result['rebuilt_users'], result['expected_users']) == (False, 20, 60)
+    assert [tuple(row) for row in conn.execute("SELECT * FROM users ORDER BY user_id")] == before
+    
+    # 有采集水位时以上次采集的用户总数为准
+    update_watermarks(60, 70)
+    assert reingest(workers=1, rebuild=True, run_id='full')['rebuilt'] is False
+    assert reingest(workers=1, rebuild=True, run_id='full', min_coverage=0.8)['rebuilt'] is True
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 60
+
+def test_user_history_records_only_changes(temp_db):
+    """测试用户历史只追加变化的值，并能按用户和按采集查询"""
+    from db_config import get_db_connection
+    from crawl_state import begin_run
+    from insert_users_array_to_db import write_users_array
+    from query_db import get_user_history, get_run_changes
+    from benchmarks.synthetic import make_users
+    
+    users_data = make_users(30)
+    first_run = begin_run()
+    write_users_array(users_data, run_id=first_run)
+    
+    # 第二次采集：一个用户余额变化，一个用户只改了备注（不记录历史），其余不变
+    second_run = begin_run()
+    users_data[5] = dict(users_data[5], credit_balance=users_data[5]['credit_balance'] + 10)
+    users_data[6] = dict(users_data[6], remark='新备注')
+    write_users_array(users_data, run_id=second_run)
+    
+    # 第三次采集没有任何变化
+    write_users_array(users_data, run_id=begin_run())
+    
+    conn = get_db_connection()
+    assert conn.execute("SELECT COUNT(*) FROM user_history").fetchone()[0] == 31
+    
+    user_id = users_data[5]['user_id']
+    assert get_run_changes(second_run) == [{'user_id': user_id, 'credit_balance': users_data[5]['credit_balance']}]
+    
+    history = get_user_history(user_id)
+    assert [entry['run_id'] for entry in history] == [first_run, second_run]
+    assert history[1]['changed'] == ['credit_balance']
+    assert history[1]['credit_balance'] == history[0]['credit_balance'] + 10
+    assert history[1]['is_member'] == history[0]['is_member'] == users_data[5]['is_member']
+    
+    # 两种查询都走索引
+    assert 'PRIMARY KEY' in _query_plan(conn, "SELECT * FROM user_history WHERE user_id = ?", (1,))
+    assert 'idx_user_history_run_id' in _query_plan(conn, "SELECT * FROM user_history WHERE run_id = ?", (1,))
+
+def test_stats_tables_match_full_scans(temp_db):
+    """测试触发器维护的汇总表在插入、更新、删除后与全表统计一致"""
+    import random
+    from db_config import get_db_connection, bump_data_version
+    from insert_users_array_to_db import insert_or_update_user
+    from query_db import count_users, get_country_stats, get_revenue_stats
+    from benchmarks.synthetic import make_users
+    
+    def full_scan(conn):
+        total, members, non_members = conn.execute("""
+        SELECT COUNT(*), SUM(is_member = '是'), SUM(is_member = '否') FROM users
+        """).fetchone()
+        countries = dict(tuple(row) for row in conn.execute("SELECT country, COUNT(*) FROM users GROUP BY country"))
+        revenue = tuple(conn.execute("""
+        SELECT SUM(recharge_amount), SUM(total_deduction), SUM(credit_balance), SUM(refund_amount) FROM users
+        """).fetchone())
+        return (total, members or 0, non_members or 0), countries, revenue
+    
+    def assert_consistent(conn):
+        counts, countries, revenue = full_scan(conn)
+        assert count_users() == counts
+        assert get_country_stats() == countries
+        assert tuple(get_revenue_stats().values()) == pytest.approx(tuple(value or 0 for value in revenue))
+    
+    rng = random.Random(1)
+    users_data = make_users(200)
+    for user_data in users_data[::7]:
+        user_data['country'] = None
+    insert_users_array(users_data)
+    conn = get_db_connection()
+    assert_consistent(conn)
+    
+    # 批量更新：改国家、会员状态和金额
+    for user_data in rng.sample(users_data, 60):
+        user_data.update(country=rng.choice(['中国', '美国', None, '新国家']),
+                         is_member=rng.choice(['是', '否', None]),
+                         recharge_amount=rng.randint(0, 500) / 10)
+    insert_users_array(users_data)
+    assert_consistent(conn)
+    
+    # 逐条写入和删除同样维护汇总表（绕过写入函数修改数据时需要自行更新数据版本）
+    for user_data in make_users(5, start_id=1000):
+        insert_or_update_user(conn, user_data)
+    conn.execute("DELETE FROM users WHERE user_id % 3 = 0")
+    bump_data_version(conn)
+    conn.commit()
+    assert_consistent(conn)
+    
+    # 汇总查询不扫描 users 表
+    assert 'users' not in _query_plan(conn, "SELECT total, members, non_members FROM user_stats WHERE id = 1")
+
+def test_query_cache_invalidated_by_writer(temp_db):
+    """测试查询缓存：重复读取命中内存，写入者提交后立即失效，容量有上限"""
+    import threading
+    from query_db import QUERY_CACHE, QueryCache, count_users, query_users
+    from insert_users_array_to_db import write_users_array
+    from benchmarks.synthetic import make_users
+    
+    QUERY_CACHE.clear()
+    users_data = make_users(20)
+    write_users_array(users_data)
+    
+    assert count_users()[0] == 20
+    first = query_users(limit=5)
+    first[0]['links'].clear()  # 修改返回值不影响缓存
+    assert query_users(limit=5)[0]['links'] == users_data[-1]['links']
+    assert count_users()[0] == 20
+    assert QUERY_CACHE.info()['hits'] == 2
+    
+    # 在另一个线程（另一个连接）中提交新数据后，读者立即看到新结果
+    writer = threading.Thread(target=write_users_array, args=(make_users(3, start_id=100),))
+    writer.start()
+    writer.join()
+    assert count_users()[0] == 23
+    assert query_users(limit=1)[0]['user_id'] == 102
+    
+    # 内容未变化的写入不使缓存失效
+    hits = QUERY_CACHE.info()['hits']
+    write_users_array(users_data)
+    count_users()
+    assert QUERY_CACHE.info()['hits'] == hits + 1
+    
+    # LRU 淘汰最久未使用的条目
+    cache = QueryCache(maxsize=2)
+    cache.put('a', 1, 'A')
+    cache.put('b', 1, 'B')
+    cache.get('a', 1)
+    cache.put('c', 1, 'C')
+    assert cache.get('b', 1) == (False, None)
+    assert cache.get('a', 1) == (True, 'A')
+    assert cache.get('a', 2) == (False, None)
+
+def test_search_users_uses_fts_index(temp_db):
+    """测试搜索：邮箱片段、域名、备注文字和短词都能找到，索引随写入和删除同步"""
+    from db_config import get_db_connection, has_search_index, bump_data_version
+    from query_db import search_users
+    from insert_users_array_to_db import write_users_array
+    from benchmarks.synthetic import make_users
+    
+    users_data = make_users(50)
+    users_data[9]['remark'] = '退款 100% 需复核'
+    write_users_array(users_data)
+    conn = get_db_connection()
+    assert has_search_index(conn)
+    
+    # 邮箱用户名完全相同的排在前缀匹配之前
+    results = search_users('USER1', limit=20)
+    assert results[0]['user_id'] == 1
+    assert {user['user_id'] for user in results} == {1} | set(range(10, 20))
+    
+    domain = users_data[0]['email'].split('@')[1]
+    expected = {user['user_id'] for user in users_data if user['email'].endswith('@' + domain)}
+    assert {user['user_id'] for user in search_users('@' + domain, limit=100)} == expected
+    
+    # 备注中的中文和 LIKE 通配符按字面匹配；短于 3 个字符的词用 LIKE 过滤
+    assert [user['user_id'] for user in search_users('100%')] == [10]
+    assert [user['user_id'] for user in search_users('需复核 10')] == [10]
+    assert search_users('1_0') == []
+    assert search_users('"') == [] and search_users('   ') == []
+    
+    # 修改邮箱和删除用户后索引同步
+    changed = dict(users_data[4], email='renamed@example.org')
+    write_users_array([changed])
+    assert [user['user_id'] for user in search_users('example.org')] == [5]
+    assert search_users('user5@') == []
+    conn.execute("DELETE FROM users WHERE user_id = 5")
+    bump_data_version(conn)
+    conn.commit()
+    assert search_users('example.org') == []
+    # 索引与 users 表不一致时 integrity-check 会抛出异常
+    conn.execute("INSERT INTO users_fts (users_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_search_users_filters_before_candidate_window(temp_db, monkeypatch):
+    """测试短词过滤在候选窗口截断之前应用：命中很多时仍能找到较早的满足条件的用户"""
+    import query_db
+    from query_db import search_users
+    from insert_users_array_to_db import write_users_array
+    from benchmarks.synthetic import make_users
+    
+    users_data = make_users(60)
+    for user in users_data:
+        user['remark'] = '需复核'
+    for user in users_data[:8]:
+        user['remark'] = '需复核 VIP'
+    write_users_array(users_data)
+    
+    # 候选窗口只有 5 个，而最新的 52 个命中都不满足短词条件
+    monkeypatch.setattr(query_db, 'SEARCH_WINDOW', 5)
+    results = search_users('需复核 VIP', limit=20)
+    assert sorted(user['user_id'] for user in results) == list(range(1, 9))
+    assert len(search_users('需复核 VIP', limit=3)) == 3
+    # limit 大于窗口时不被窗口截断
+    assert len(search_users('需复核', limit=30)) == 30
+
+def test_search_index_created_later_when_trigram_was_unavailable(caplog):
+    """测试迁移时 SQLite 不支持 trigram 则记录警告并跳过，之后初始化表结构时补建搜索索引"""
+    import logging
+    import db_config
+    from db_config import init_schema, has_search_index, get_schema_version, SCHEMA_VERSION
+    from insert_users_array_to_db import upsert_users_batch
+    from benchmarks.synthetic import make_users
+    
+    class NoTrigramConnection:
+        """创建 FTS5 虚拟表时报错的连接，模拟不支持 trigram 的旧版 SQLite"""
+        def __init__(self, conn):
+            self.conn = conn
+        
+        def execute(self, sql, *args):
+            if 'VIRTUAL TABLE' in sql:
+                raise sqlite3.OperationalError("no such tokenizer: trigram")
+            return self.conn.execute(sql, *args)
+    
+    conn = _new_memory_db()
+    for name in ('trg_users_fts_insert', 'trg_users_fts_delete', 'trg_users_fts_update'):
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.execute("DROP TABLE users_fts")
+    with caplog.at_level(logging.WARNING, logger='taskmonkey.db'):
+        db_config._migration_search_index(NoTrigramConnection(conn))
+    assert 'trigram' in caplog.text
+    assert not has_search_index(conn)
+    
+    upsert_users_batch(conn, make_users(10))
+    conn.commit()
+    init_schema(conn)
+    assert get_schema_version(conn) == SCHEMA_VERSION
+    assert has_search_index(conn)
+    matches = conn.execute("SELECT rowid FROM users_fts WHERE users_fts MATCH '\"user3\"'").fetchall()
+    assert [row[0] for row in matches] == [3]
+    conn.close()
+
+def test_risk_scores_match_naive_computation(temp_db):
+    """测试风险评分：向量化结果与逐用户计算一致，写入 user_scores 后可按风险分查询"""
+    import statistics
+    from risk_scoring import score_users, load_score_inputs, compute_scores, RATIO_CAP
+    from query_db import get_top_risk_users
+    from insert_users_array_to_db import write_users_array
+    from benchmarks.synthetic import make_users
+    from db_config import get_db_connection
+    
+    users_data = make_users(200)
+    users_data[0].update(refund_amount=500.0, last_refund_amount=500.0, recharge_amount=0.0)
+    write_users_array(users_data)
+    
+    result = score_users()
+    assert result['users'] == 200
+    assert result['flagged'] >= 1
+    
+    user_ids, columns = load_score_inputs()
+    scores = compute_scores(columns)
+    refunds = [user['refund_amount'] for user in users_data]
+    ratios = [min(user['refund_amount'] / user['recharge_amount'], RATIO_CAP) if user['recharge_amount'] > 0
+              else (RATIO_CAP if user['refund_amount'] > 0 else 0.0) for user in users_data]
+    mean, std = statistics.mean(refunds), statistics.pstdev(refunds)
+    for index, user in enumerate(users_data):
+        assert user_ids[index] == user['user_id']
+        assert scores['refund_ratio'][index] == pytest.approx(ratios[index])
+        assert scores['refund_z'][index] == pytest.approx((user['refund_amount'] - mean) / std)
+        below = sum(1 for ratio in ratios if ratio < ratios[index])
+        assert scores['refund_ratio_pct'][index] == pytest.approx(below * 100 / len(ratios))
+    
+    # 写入的表与计算结果一致，退款异常的用户被标记
+    top = get_top_risk_users(5)
+    assert top[0]['risk_score'] == pytest.approx(scores['risk_score'].max())
+    assert [user['risk_score'] for user in top] == sorted((user['risk_score'] for user in top), reverse=True)
+    assert get_db_connection().execute("SELECT COUNT(*) FROM user_scores").fetchone()[0] == 200
+    # 风险分索引由迁移建立，评分写入不会删除重建
+    assert get_db_connection().execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = 'idx_user_scores_risk_score'"
+    ).fetchone()[0] == 1
+    flagged = get_top_risk_users(200, flagged_only=True)
+    assert len(flagged) == result['flagged']
+    assert 1 in {user['user_id'] for user in flagged}
+    
+    # 空库评分不报错
+    get_db_connection().execute("DELETE FROM users")
+    get_db_connection().commit()
+    assert score_users()['users'] == 0
+
+def test_bench_suite_reports_and_compares(temp_db, tmp_path, monkeypatch):
+    """测试基准套件：逐页生成的页面可被解析，结果可序列化为 JSON，对比时能发现回退"""
+    import json
+    import db_config
+    from benchmarks.bench_suite import run_suite, compare
+    from benchmarks.synthetic import iter_pages
+    from get_users_array_from_page import extract_user_data
+    
+    pages = list(iter_pages(25, page_size=10))
+    assert [page_num for page_num, _, _ in pages] == [1, 2, 3]
+    assert [len(users) for _, users, _ in pages] == [10, 10, 5]
+    assert extract_user_data(pages[0][2])[0]['user_id'] == 25
+    assert extract_user_data(pages[-1][2])[-1]['user_id'] == 1
+    
+    db_path = db_config.DB_PATH
+    report = json.loads(json.dumps(run_suite([30], ['extract', 'insert', 'query'], repeat=1)))
+    assert db_config.DB_PATH == db_path
+    names = {record['name'] for record in report['results']}
+    assert {'extract_user_data[default]', 'insert_users_array[new]', 'query_db.search_users[email]'} <= names
+    assert all(record['users'] == 30 and record['seconds'] >= 0 for record in report['results'])
+    
+    slower = {'results': [dict(record, seconds=record['seconds'] * 2 + 1) for record in report['results']]}
+    assert compare(report, report) == []
+    regressions = compare(report, slower, tolerance=0.2)
+    assert {item['name'] for item in regressions} == {record['name'] for record in report['results']
+                                                       if record['seconds'] > 0}
+    
+    # 单项出错时记录到 errors 并继续运行其余各项，每完成一项就写入结果文件
+    import benchmarks.bench_suite as bench_suite
+    
+    def broken_query(size, repeat):
+        raise RuntimeError("查询失败")
+    
+    monkeypatch.setattr(bench_suite, 'bench_query', broken_query)
+    output = tmp_path / 'bench.json'
+    report = run_suite([20], ['insert', 'query', 'export'], repeat=1, output=output)
+    assert report['errors'] == [{'name': 'query', 'users': 20, 'error': '查询失败'}]
+    names = {record['name'] for record in report['results']}
+    assert {'insert_users_array[new]', 'export_users_to_excel', 'export_users_streaming[csv]'} <= names
+    assert json.loads(output.read_text(encoding='utf-8')) == json.loads(json.dumps(report))
+    
+    # 链接数超过 Excel 单表上限时跳过 pandas 导出，只计时流式 CSV 导出
+    monkeypatch.setattr(bench_suite, 'XLSX_MAX_ROWS', 10)
+    report = run_suite([20], ['export'], repeat=1)
+    assert [record['name'] for record in report['results']] == ['export_users_streaming[csv]']
+
+def test_user_records_stream_and_match_dicts(sample_html_content):
+    """测试 iter_user_rows 逐行生成 UserRecord，记录与字典两种格式写入结果和指纹一致"""
+    if not sample_html_content:
+        pytest.skip("没有测试数据，跳过测试")
+    
+    import pickle
+    import types
+    from get_users_array_from_page import iter_user_rows, extract_user_records
+    from insert_users_array_to_db import insert_or_update_user, upsert_users_batch, user_fingerprint
+    from user_record import UserRecord, as_dict, as_record
+    
+    users_data = extract_user_data(sample_html_content)
+    rows = iter_user_rows(sample_html_content)
+    assert isinstance(rows, types.GeneratorType)
+    records = list(rows)
+    assert all(isinstance(record, UserRecord) for record in records)
+    for engine in ('bs4', 'lxml'):
+        assert [as_dict(record) for record in iter_user_rows(sample_html_content, engine)] == users_data
+    assert [as_record(user_data) for user_data in users_data] == records
+    assert extract_user_records(sample_html_content) == records
+    assert len(pickle.dumps(records)) < len(pickle.dumps(users_data))
+    assert [user_fingerprint(record) for record in records] == [user_fingerprint(user) for user in users_data]
+    
+    # 逐条写入记录与写入字典结果一致
+    dict_conn = _new_memory_db()
+    record_conn = _new_memory_db()
+    for user_data, record in zip(users_data, records):
+        assert insert_or_update_user(dict_conn, user_data) == insert_or_update_user(record_conn, record)
+    assert _dump_db(dict_conn) == _dump_db(record_conn)
+    
+    # 批量写入可直接消费生成器；之后以字典或混合格式重写时全部识别为未变化
+    conn = _new_memory_db()
+    assert upsert_users_batch(conn, iter_user_rows(sample_html_content), batch_size=3) == (len(records), 0, 0)
+    assert _dump_db(conn) == _dump_db(dict_conn)
+    mixed = [user_data if index % 2 else record for index, (user_data, record) in enumerate(zip(users_data, records))]
+    assert upsert_users_batch(conn, mixed, batch_size=4) == (0, 0, len(records))
+    changed = records[0]._replace(remark="测试更新", links=records[0].links[:1])
+    assert upsert_users_batch(conn, [changed] + users_data[1:]) == (0, 1, len(records) - 1)
+    links = conn.execute("SELECT link_type, link_url FROM user_links WHERE user_id = ?", (changed.user_id,)).fetchall()
+    assert [tuple(link) for link in links] == list(changed.links)
+    
+    for db in (dict_conn, record_conn, conn):
+        db.close()
+
 if __name__ == "__main__":
     # 运行测试
     pytest.main(["-v", __file__]) 
\ No newline at end of file
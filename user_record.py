@@ -0,0 +1,59 @@
+from collections import namedtuple
+
+# users 表中由页面数据提供的列（不含 updated_at），顺序即 UserRecord 前 17 个字段的顺序
+USER_COLUMNS = (
+    'user_id', 'email', 'create_time', 'promotion_count', 'is_member',
+    'refund_amount', 'last_refund_amount', 'last_deductible_amount',
+    'credit_balance', 'has_card', 'country', 'recharge_amount',
+    'total_deduction', 'version', 'terminal_type', 'browser_type', 'remark'
+)
+
+# users 表对外公开的全部列（row_hash 等内部列不导出、不返回给查询调用方）
+USER_TABLE_COLUMNS = USER_COLUMNS + ('updated_at',)
+
+# 紧凑的用户记录：一个元组，前 17 个字段与 USER_COLUMNS 一一对应，
+# links 为 ((link_type, link_url), ...)。没有每个实例的 __dict__，可直接作为 SQL 参数（切片）传给 executemany，
+# 在解析进程和主进程之间传递时也比字典小得多
+UserRecord = namedtuple('UserRecord', USER_COLUMNS + ('links',))
+
+# 列名在 UserRecord 中的位置
+FIELD_INDEX = {column: index for index, column in enumerate(USER_COLUMNS)}
+
+_COLUMN_COUNT = len(USER_COLUMNS)
+
+def user_values(user):
+    """
+    返回用户的 17 个列值（按 USER_COLUMNS 顺序），用户可以是 UserRecord 或用户数据字典
+
+    返回:
+        tuple: 列值
+    """
+    if isinstance(user, tuple):
+        return user[:_COLUMN_COUNT]
+    return tuple(user[column] for column in USER_COLUMNS)
+
+def user_links(user):
+    """
+    返回用户的链接 [(link_type, link_url), ...]，用户可以是 UserRecord 或用户数据字典
+    """
+    if isinstance(user, tuple):
+        return list(user.links)
+    return [(link['link_type'], link['link_url']) for link in user.get('links') or ()]
+
+def user_id_of(user):
+    """返回用户ID，用户可以是 UserRecord 或用户数据字典"""
+    return user[0] if isinstance(user, tuple) else user['user_id']
+
+def as_record(user):
+    """把用户数据字典转换为 UserRecord（已是 UserRecord 时原样返回）"""
+    if isinstance(user, UserRecord):
+        return user
+    return UserRecord(*user_values(user), links=tuple(user_links(user)))
+
+def as_dict(user):
+    """把 UserRecord 转换为 extract_user_data 输出格式的用户数据字典（已是字典时原样返回）"""
+    if isinstance(user, dict):
+        return user
+    user_data = dict(zip(USER_COLUMNS, user))
+    user_data['links'] = [{'link_type': link_type, 'link_url': link_url} for link_type, link_url in user.links]
+    return user_data